@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,6 +82,25 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL lets readers keep going while one connection writes. Write
+            # transactions take the lock up front (BEGIN IMMEDIATE) and wait
+            # up to `timeout` seconds for it instead of failing mid-transaction.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA mmap_size=268435456'
+            ),
+        },
+        'TEST': {
+            # A file rather than :memory: so tests run with WAL and real
+            # cross-connection locking, as in production.
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -134,4 +154,72 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Media is served by core.views.serve_media behind login. Set MEDIA_SENDFILE
+# to 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) to let the
+# front proxy send the bytes; for nginx, map MEDIA_ACCEL_REDIRECT_PREFIX to
+# MEDIA_ROOT in an `internal` location.
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# Browser cache lifetime for media that may be regenerated in place
+# (renditions, tiles). Hashed originals are cached as immutable.
+MEDIA_CACHE_MAX_AGE = 24 * 60 * 60
+
+# Disk budget for rendered keypoint overlays (MEDIA_ROOT/overlays, see
+# core.overlays); least recently used ones are removed beyond it.
+OVERLAY_CACHE_BYTES = 512 * 1024 * 1024
+
+# Resumable uploads (core.uploads): largest accepted file, and how long an
+# unfinished one may sit idle before sweep_uploads deletes it.
+UPLOAD_MAX_BYTES = 2 * 1024 ** 3
+UPLOAD_EXPIRY_SECONDS = 24 * 60 * 60
+
+# Rendered dashboard lists (core.viewcache). Any cache backend works. The
+# file cache is shared by every process on the host, so a save made by a
+# job worker invalidates pages the web processes cached; LocMemCache is
+# faster but per process, so it only suits a single process. Versions get
+# their own small cache: the file cache lists its directory on every write,
+# and versions are written on every save.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'views': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'views'),
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+    'view_versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'view_versions'),
+    },
+}
+VIEW_CACHE = 'views'
+VIEW_CACHE_VERSIONS = 'view_versions'
+VIEW_CACHE_TIMEOUT = 60
+
+# Runs the tests against in-memory caches (core.testing.TEST_CACHES).
+TEST_RUNNER = 'core.testing.TestRunner'
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAuthenticated',
+    ],
+}
+
+# Fraction of requests timed by core.middleware.PerformanceMiddleware
+# (Server-Timing header and /metrics/). 0 disables it entirely.
+PERF_SAMPLE_RATE = 1.0
+
+# Funnel annotation submissions through a single in-process writer thread
+# that commits them in batches (see core.writequeue). Useful on SQLite with
+# many concurrent annotators; leave off for databases with row-level locking.
+SQLITE_WRITE_QUEUE = False
+
+# How long an annotator keeps an image claimed before it returns to the queue
+IMAGE_LEASE_SECONDS = 30 * 60
\ No newline at end of file
@@ -14,22 +14,43 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path, re_path
 from django.contrib.auth import views as auth_views
-from core import views
+from rest_framework.routers import DefaultRouter
+from core import api, views
 from django.conf import settings
-from django.conf.urls.static import static
+
+router = DefaultRouter()
+router.register('images', api.ImageViewSet, basename='image')
+router.register('annotations', api.KeypointAnnotationViewSet, basename='annotation')
+router.register('comments', api.CommentViewSet, basename='comment')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/', include(router.urls)),
     path('', views.dashboard, name='dashboard'),
     path('login/', auth_views.LoginView.as_view(template_name='core/login.html'), name='login'),
     path('logout/', views.logout_view, name='logout'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('events/', views.event_stream, name='event_stream'),
     path('view-annotations/', views.view_annotations, name='view_annotations'),
     path('annotator/', views.annotator_dashboard, name='annotator_dashboard'),
+    path('annotator/claim/', views.claim_next_images, name='claim_next_images'),
     path('annotator/create/<int:image_id>/', views.create_annotation, name='create_annotation'),
+    path('images/<int:image_id>/<str:size>/', views.image_rendition, name='image_rendition'),
+    path('annotations/<int:annotation_id>/overlay/<str:size>/', views.annotation_overlay, name='annotation_overlay'),
     path('upload-image/', views.upload_image, name='upload_image'),
+    path('uploads/', views.create_upload, name='create_upload'),
+    path('uploads/<uuid:upload_id>/', views.upload_detail, name='upload_detail'),
+    path('uploads/<uuid:upload_id>/complete/', views.complete_chunked_upload, name='complete_upload'),
     path('verifier/', views.verifier_dashboard, name='verifier_dashboard'),
     path('verifier/verify/<int:annotation_id>/', views.verify_annotation, name='verify_annotation'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('verifier/verify/batch/', views.verify_annotations_batch, name='verify_annotations_batch'),
+    path('export/annotations/', views.export_annotations, name='export_annotations'),
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('verifier/comment/<int:annotation_id>/', views.add_comment, name='add_comment'),
+    re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.+)$', views.serve_media, name='media'),
+]
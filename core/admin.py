@@ -3,9 +3,61 @@ from django.contrib import admin
 # Register your models here.
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Dataset, Image, KeypointAnnotation
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html_join
+from .counters import CountChanges, apply_changes, tally
+from .imagemeta import similar_images, to_unsigned
+from .models import User, Dataset, Image, Job, KeypointAnnotation, AnnotationRevision, StatusCount
+from .revisions import record_revisions
 
-class CustomUserAdmin(UserAdmin):
+class CountedDeleteMixin:
+    """
+    Keep core.counters in step with deletes from the admin, which bypass
+    the write paths that apply their own changes. image_lookup and
+    annotation_lookup name the filters, taking a list of this admin's ids,
+    that select the images and annotations whose counts those objects
+    carry; None counts none of that kind.
+    """
+    image_lookup = None
+    annotation_lookup = None
+
+    def counted(self, ids):
+        images = Image.objects.filter(**{self.image_lookup: ids}) if self.image_lookup else Image.objects.none()
+        annotations = (
+            KeypointAnnotation.objects.filter(**{self.annotation_lookup: ids})
+            if self.annotation_lookup else KeypointAnnotation.objects.none()
+        )
+        return images, annotations
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            changes = CountChanges()
+            changes.subtract(tally(*self.counted([obj.id])))
+            super().delete_model(request, obj)
+            apply_changes(changes)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            changes = CountChanges()
+            changes.subtract(tally(*self.counted(list(queryset.values_list('id', flat=True)))))
+            super().delete_queryset(request, queryset)
+            apply_changes(changes)
+
+class CountedAdminMixin(CountedDeleteMixin):
+    """CountedDeleteMixin that also counts admin edits, e.g. of status or dataset."""
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            changes = CountChanges()
+            if change:
+                changes.subtract(tally(*self.counted([obj.id])))
+            super().save_model(request, obj, form, change)
+            changes.update(tally(*self.counted([obj.id])))
+            apply_changes(changes)
+
+class CustomUserAdmin(CountedDeleteMixin, UserAdmin):
     list_display = ('username', 'email', 'user_type', 'is_staff')
     list_filter = ('user_type', 'is_staff', 'is_superuser')
     fieldsets = UserAdmin.fieldsets + (
@@ -14,8 +66,94 @@ class CustomUserAdmin(UserAdmin):
     add_fieldsets = UserAdmin.add_fieldsets + (
         ('User Type', {'fields': ('user_type',)}),
     )
+    annotation_lookup = 'annotator_id__in'
 
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Dataset)
-admin.site.register(Image)
-admin.site.register(KeypointAnnotation)
\ No newline at end of file
+
+@admin.register(Image)
+class ImageAdmin(CountedAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'original_name', 'dataset', 'status', 'width', 'height', 'orientation', 'hash_hex')
+    list_filter = ('status', 'processed', 'orientation', 'dataset')
+    search_fields = ('=content_hash', 'original_name')
+    raw_id_fields = ('claimed_by',)
+    readonly_fields = ('content_hash', 'hash_hex', 'duplicates')
+    image_lookup = 'id__in'
+    annotation_lookup = 'image_id__in'
+
+    @admin.display(description='Perceptual hash')
+    def hash_hex(self, obj):
+        return '' if obj.perceptual_hash is None else f'{to_unsigned(obj.perceptual_hash):016x}'
+
+    @admin.display(description='Near-duplicates')
+    def duplicates(self, obj):
+        if obj.pk is None:
+            return ''
+        found = similar_images(obj)[:20]
+        if not found:
+            return 'None'
+        return format_html_join(', ', '<a href="{}">Image {}</a> ({} bits)', (
+            (reverse('admin:core_image_change', args=[pk]), pk, d) for pk, d in found
+        ))
+
+@admin.register(KeypointAnnotation)
+class KeypointAnnotationAdmin(CountedAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'image', 'annotator', 'status', 'revision', 'created_at')
+    list_filter = ('status',)
+    raw_id_fields = ('image', 'annotator')
+    annotation_lookup = 'id__in'
+
+    def save_model(self, request, obj, form, change):
+        # Record the edit like every other write path, so the history
+        # replays to the stored keypoints.
+        with transaction.atomic():
+            previous = None
+            if change:
+                current = KeypointAnnotation.objects.select_for_update().get(id=obj.id)
+                current.pack()
+                previous = current.packed
+                obj.revision = current.revision
+            super().save_model(request, obj, form, change)
+            record_revisions(obj, previous, request.user)
+
+@admin.register(StatusCount)
+class StatusCountAdmin(admin.ModelAdmin):
+    list_display = ('dataset', 'kind', 'status', 'count')
+    list_filter = ('kind', 'status', 'dataset')
+
+    # Maintained by core.counters; fix drift with rebuild_status_counts.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(AnnotationRevision)
+class AnnotationRevisionAdmin(admin.ModelAdmin):
+    list_display = ('annotation', 'number', 'kind', 'status', 'author', 'created_at')
+    list_filter = ('kind', 'status')
+    raw_id_fields = ('annotation', 'image', 'author')
+    exclude = ('data',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'status', 'priority', 'attempts', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status', 'task')
+    raw_id_fields = ('created_by',)
+    actions = ['requeue']
+
+    @admin.action(description='Run selected jobs again')
+    def requeue(self, request, queryset):
+        count = queryset.exclude(status='running').update(
+            status='queued', attempts=0, run_after=timezone.now(), error='', finished_at=None,
+        )
+        self.message_user(request, f'Queued {count} jobs.')
@@ -0,0 +1,122 @@
+from collections import defaultdict
+from itertools import combinations
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .keypoints import unpack_keypoints
+from .models import ImageAgreement, KeypointAnnotation
+from .viewcache import invalidate
+
+EPS = np.spacing(1)
+
+
+def keypoint_sigma():
+    # Per-keypoint falloff as in COCO; our skeletons have no per-joint
+    # sigmas, so a single value is used for every keypoint.
+    return getattr(settings, 'AGREEMENT_KEYPOINT_SIGMA', 0.05)
+
+
+def bbox_areas(boxes):
+    """Areas of an (N, 4) array of [x1, y1, x2, y2] boxes."""
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def bbox_iou(a, b):
+    """Row-wise IoU of two (N, 4) arrays of [x1, y1, x2, y2] boxes."""
+    top_left = np.maximum(a[:, :2], b[:, :2])
+    bottom_right = np.minimum(a[:, 2:], b[:, 2:])
+    overlap = np.clip(bottom_right - top_left, 0, None).prod(axis=1)
+    union = bbox_areas(a) + bbox_areas(b) - overlap
+    return np.where(union > 0, overlap / np.maximum(union, EPS), np.nan)
+
+
+def object_keypoint_similarity(a, b, areas, sigma=None):
+    """
+    Row-wise OKS of two (N, K, 2) keypoint arrays, using `areas` (N,) as the
+    object scale.
+    """
+    sigma = keypoint_sigma() if sigma is None else sigma
+    squared_distance = ((a - b) ** 2).sum(axis=-1)
+    variance = (2 * sigma) ** 2
+    e = squared_distance / (2 * variance * (areas[:, None] + EPS))
+    return np.exp(-e).mean(axis=1)
+
+
+def _load_annotations(image_ids):
+    """Map image id -> list of (points, bbox) from the packed keypoint column."""
+    by_image = defaultdict(list)
+    rows = (
+        KeypointAnnotation.objects.filter(image_id__in=image_ids).exclude(status='rejected')
+        .exclude(packed=None).values_list('image_id', 'packed')
+    )
+    for image_id, packed in rows.iterator(chunk_size=5000):
+        points, _, bbox = unpack_keypoints(packed)
+        by_image[image_id].append((points[:, :2], bbox))
+    return by_image
+
+
+def compute_agreement(image_ids):
+    """
+    Compute pairwise OKS and bbox IoU across the annotations of each image.
+    Pairs are grouped by keypoint count so each group is scored in a single
+    vectorized call. Returns unsaved ImageAgreement objects.
+    """
+    by_image = _load_annotations(image_ids)
+
+    # Pairs bucketed by keypoint count: k -> ([image ids], [a points], [b points], [a boxes], [b boxes])
+    buckets = defaultdict(lambda: ([], [], [], [], []))
+    for image_id, annotations in by_image.items():
+        for (a_points, a_box), (b_points, b_box) in combinations(annotations, 2):
+            if len(a_points) != len(b_points) or len(a_box) != 4 or len(b_box) != 4:
+                continue
+            bucket = buckets[len(a_points)]
+            for values, value in zip(bucket, (image_id, a_points, b_points, a_box, b_box)):
+                values.append(value)
+
+    oks_by_image = defaultdict(list)
+    iou_by_image = defaultdict(list)
+    for k, (pair_images, a_points, b_points, a_boxes, b_boxes) in buckets.items():
+        a_boxes, b_boxes = np.stack(a_boxes), np.stack(b_boxes)
+        iou = bbox_iou(a_boxes, b_boxes)
+        if k:
+            areas = (bbox_areas(a_boxes) + bbox_areas(b_boxes)) / 2
+            oks = object_keypoint_similarity(np.stack(a_points), np.stack(b_points), areas)
+        else:
+            oks = np.full(len(pair_images), np.nan)
+        for image_id, pair_oks, pair_iou in zip(pair_images, oks.tolist(), iou.tolist()):
+            oks_by_image[image_id].append(pair_oks)
+            iou_by_image[image_id].append(pair_iou)
+
+    results = []
+    for image_id in image_ids:
+        oks = np.array(oks_by_image.get(image_id, []), dtype=np.float64)
+        iou = np.array(iou_by_image.get(image_id, []), dtype=np.float64)
+        has_oks = oks.size and not np.isnan(oks).all()
+        has_iou = iou.size and not np.isnan(iou).all()
+        results.append(ImageAgreement(
+            image_id=image_id,
+            annotation_count=len(by_image.get(image_id, [])),
+            pair_count=len(oks),
+            mean_oks=float(np.nanmean(oks)) if has_oks else None,
+            min_oks=float(np.nanmin(oks)) if has_oks else None,
+            mean_iou=float(np.nanmean(iou)) if has_iou else None,
+        ))
+    return results
+
+
+def refresh_agreement(image_ids):
+    """Recompute and store the cached agreement for `image_ids`."""
+    image_ids = list(image_ids)
+    results = compute_agreement(image_ids)
+    with transaction.atomic():
+        ImageAgreement.objects.filter(image_id__in=image_ids).delete()
+        ImageAgreement.objects.bulk_create(results)
+        invalidate('imageagreement')
+    return results
+
+
+def invalidate_agreement(image_ids):
+    ImageAgreement.objects.filter(image_id__in=image_ids).delete()
+    invalidate('imageagreement')
@@ -0,0 +1,270 @@
+from django.utils.cache import get_conditional_response, patch_cache_control, set_response_etag
+from django.db import transaction
+from django.db.models import Count
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from .counters import CountChanges, apply_changes
+from .events import publish_on_commit
+from .imagemeta import upload_fields
+from .jobs import enqueue
+from .leases import QUEUE_STATUSES
+from .models import Comment, Image, KeypointAnnotation
+from .revisions import history, image_history, record_revisions
+from .roles import has_capability
+from .serializers import AnnotationRevisionSerializer, CommentSerializer, ImageSerializer, KeypointAnnotationSerializer
+
+
+class HasRoleCapability(permissions.IsAuthenticated):
+    """
+    Reads need a signed-in user; writes also need the view's
+    `write_capability` (see core.roles), as in the HTML views, or the one
+    its `action_capabilities` gives for the action.
+    """
+
+    def has_permission(self, request, view):
+        if not super().has_permission(request, view):
+            return False
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        capability = getattr(view, 'action_capabilities', {}).get(view.action, view.write_capability)
+        return has_capability(request, capability)
+
+
+class IsAuthorOrReadOnly(permissions.BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return request.method in permissions.SAFE_METHODS or obj.author_id == request.user.id
+
+
+class IsAnnotatorWhilePending(permissions.BasePermission):
+    """
+    An annotation can be changed or deleted by its annotator until it has
+    been reviewed; after that only through verification, or by an admin.
+    """
+    message = 'Only the annotator can change an annotation, and only while it is pending.'
+
+    def has_object_permission(self, request, view, obj):
+        if request.method in permissions.SAFE_METHODS or has_capability(request, 'admin'):
+            return True
+        return obj.annotator_id == request.user.id and obj.status == 'pending'
+
+
+class LeaseConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This image is claimed by another annotator.'
+    default_code = 'lease_conflict'
+
+
+def id_param(request, name):
+    """Query parameter `name` as an id, None if absent; anything else is a 400."""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        pk = int(value)
+    except ValueError:
+        pk = None
+    # Out-of-range ints would fail in the database driver instead.
+    if pk is None or not 0 <= pk < 2 ** 63:
+        raise ValidationError({name: 'Must be an integer id.'})
+    return pk
+
+
+class KeysetCursorPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class ImagePagination(KeysetCursorPagination):
+    ordering = ('uploaded_at', 'id')
+
+
+class CreatedAtPagination(KeysetCursorPagination):
+    ordering = ('created_at', 'id')
+
+
+class ConditionalGetMixin:
+    """
+    Tag GET responses with an ETag of their body and answer a matching
+    If-None-Match with 304, so polling clients skip unchanged pages.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and response.status_code == 200:
+            response.render()
+            set_response_etag(response)
+            patch_cache_control(response, private=True, no_cache=True)
+            return get_conditional_response(request, etag=response['ETag'], response=response)
+        return response
+
+
+class SparseFieldsQuerysetMixin:
+    """Only load the columns the client asked for with ?fields=."""
+
+    def sparse_queryset(self, queryset):
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return queryset
+        concrete = {field.name for field in queryset.model._meta.concrete_fields}
+        columns = (set(fields.split(',')) & concrete) | {'id'} | set(self.pagination_class.ordering)
+        return queryset.only(*columns)
+
+
+class ImageViewSet(ConditionalGetMixin, SparseFieldsQuerysetMixin, viewsets.ModelViewSet):
+    serializer_class = ImageSerializer
+    pagination_class = ImagePagination
+    permission_classes = [HasRoleCapability]
+    write_capability = 'annotate'
+    # Deleting an image takes its annotations and comments with it.
+    action_capabilities = {'destroy': 'admin'}
+
+    def get_queryset(self):
+        queryset = Image.objects.all()
+        params = self.request.query_params
+        if params.get('status'):
+            queryset = queryset.filter(status=params['status'])
+        dataset_id = id_param(self.request, 'dataset')
+        if dataset_id is not None:
+            queryset = queryset.filter(dataset_id=dataset_id)
+        return self.sparse_queryset(queryset)
+
+    def perform_create(self, serializer):
+        upload = self.request.FILES.get('file')
+        with transaction.atomic():
+            image = serializer.save(original_name=upload.name if upload else '', **(upload_fields(upload) if upload else {}))
+            changes = CountChanges()
+            changes.add(image.dataset_id, 'image', image.status)
+            apply_changes(changes)
+            enqueue('images.derivatives', {'image_id': image.id}, created_by=self.request.user)
+            publish_on_commit(['annotator'], 'image.added', id=image.id)
+
+    def perform_update(self, serializer):
+        old_dataset_id = serializer.instance.dataset_id
+        with transaction.atomic():
+            image = serializer.save()
+            changes = CountChanges()
+            if image.dataset_id != old_dataset_id:
+                changes.add(old_dataset_id, 'image', image.status, -1)
+                changes.add(image.dataset_id, 'image', image.status)
+                annotations = image.keypointannotation_set.values('status').annotate(n=Count('id')).order_by()
+                for row in annotations:
+                    changes.add(old_dataset_id, 'annotation', row['status'], -row['n'])
+                    changes.add(image.dataset_id, 'annotation', row['status'], row['n'])
+            apply_changes(changes)
+
+    @action(detail=True)
+    def history(self, request, pk=None):
+        """Every revision of every annotation on this image, oldest first per annotation."""
+        get_object_or_404(Image.objects.only('id'), pk=pk)
+        return Response(AnnotationRevisionSerializer(image_history(pk), many=True).data)
+
+    def perform_destroy(self, instance):
+        changes = CountChanges()
+        changes.add(instance.dataset_id, 'image', instance.status, -1)
+        for row in instance.keypointannotation_set.values('status').annotate(n=Count('id')).order_by():
+            changes.add(instance.dataset_id, 'annotation', row['status'], -row['n'])
+        with transaction.atomic():
+            instance.delete()
+            apply_changes(changes)
+
+
+class KeypointAnnotationViewSet(ConditionalGetMixin, SparseFieldsQuerysetMixin, viewsets.ModelViewSet):
+    serializer_class = KeypointAnnotationSerializer
+    pagination_class = CreatedAtPagination
+    permission_classes = [HasRoleCapability, IsAnnotatorWhilePending]
+    write_capability = 'annotate'
+
+    def get_queryset(self):
+        queryset = KeypointAnnotation.objects.all()
+        params = self.request.query_params
+        if params.get('status'):
+            queryset = queryset.filter(status=params['status'])
+        image_id, annotator_id = id_param(self.request, 'image'), id_param(self.request, 'annotator')
+        if image_id is not None:
+            queryset = queryset.filter(image_id=image_id)
+        if annotator_id is not None:
+            queryset = queryset.filter(annotator_id=annotator_id)
+        return self.sparse_queryset(queryset)
+
+    def perform_create(self, serializer):
+        user = self.request.user
+        with transaction.atomic():
+            image = Image.objects.select_for_update().get(id=serializer.validated_data['image'].id)
+            # Same rule as the annotation page: a live lease held by someone
+            # else keeps the image theirs.
+            if (image.status in QUEUE_STATUSES and image.claimed_by_id not in (None, user.id)
+                    and image.lease_expires_at and image.lease_expires_at > timezone.now()):
+                raise LeaseConflict()
+            annotation = serializer.save(annotator=user)
+            record_revisions(annotation, None, user)
+            changes = CountChanges()
+            changes.add(image.dataset_id, 'annotation', annotation.status)
+            if image.status in QUEUE_STATUSES:
+                changes.move(image.dataset_id, 'image', image.status, 'annotated')
+                image.status = 'annotated'
+                image.claimed_by = None
+                image.lease_expires_at = None
+                image.save(update_fields=['status', 'claimed_by', 'lease_expires_at'])
+            apply_changes(changes)
+            enqueue('overlays.render', {'annotation_ids': [annotation.id]})
+            publish_on_commit(['annotator', 'verifier'], 'annotation.submitted', id=annotation.id, image_id=image.id)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            # Edit the locked, current row: a concurrent edit or verification
+            # may have moved its revision on since the request read it.
+            serializer.instance = KeypointAnnotation.objects.select_for_update().select_related('image').get(
+                id=serializer.instance.id,
+            )
+            # It may also have been verified since the permission check.
+            self.check_object_permissions(self.request, serializer.instance)
+            old_dataset_id = serializer.instance.image.dataset_id
+            # Rows created in bulk may have no packed copy yet.
+            serializer.instance.pack()
+            previous = serializer.instance.packed
+            annotation = serializer.save()
+            record_revisions(annotation, previous, self.request.user)
+            changes = CountChanges()
+            if annotation.image.dataset_id != old_dataset_id:
+                changes.add(old_dataset_id, 'annotation', annotation.status, -1)
+                changes.add(annotation.image.dataset_id, 'annotation', annotation.status)
+            apply_changes(changes)
+
+    @action(detail=True)
+    def history(self, request, pk=None):
+        annotation = self.get_object()
+        revisions = annotation.revisions.select_related('author').order_by('number')
+        return Response(AnnotationRevisionSerializer(history(revisions), many=True).data)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance = KeypointAnnotation.objects.select_for_update().select_related('image').get(id=instance.id)
+            self.check_object_permissions(self.request, instance)
+            changes = CountChanges()
+            changes.add(instance.image.dataset_id, 'annotation', instance.status, -1)
+            instance.delete()
+            apply_changes(changes)
+
+
+class CommentViewSet(ConditionalGetMixin, SparseFieldsQuerysetMixin, viewsets.ModelViewSet):
+    serializer_class = CommentSerializer
+    pagination_class = CreatedAtPagination
+    permission_classes = [HasRoleCapability, IsAuthorOrReadOnly]
+    write_capability = 'verify'
+
+    def get_queryset(self):
+        queryset = Comment.objects.all()
+        annotation_id = id_param(self.request, 'annotation')
+        if annotation_id is not None:
+            queryset = queryset.filter(annotation_id=annotation_id)
+        return self.sparse_queryset(queryset)
+
+    def perform_create(self, serializer):
+        serializer.save(author=self.request.user)
@@ -0,0 +1,420 @@
+import io
+import json
+import subprocess
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image as PILImage
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.test import Client
+from django.urls import get_resolver, reverse
+
+from .counters import CountChanges, apply_changes, rebuild
+from .keypoints import pack_keypoints
+from .metrics import registry
+from .models import Comment, Dataset, Image, KeypointAnnotation, User
+from .viewcache import invalidate
+
+BENCH_DATASET = 'benchmark'
+BENCH_PASSWORD = 'bench'
+# One real file for the media benchmarks; the generated Image rows point at
+# files that do not exist.
+SAMPLE_MEDIA = 'images/bench/sample.jpg'
+
+# COCO person skeleton (17 keypoints) in a unit box, used as the mean pose.
+POSE = np.array([
+    [0.50, 0.08], [0.46, 0.05], [0.54, 0.05], [0.41, 0.07], [0.59, 0.07],
+    [0.34, 0.22], [0.66, 0.22], [0.27, 0.40], [0.73, 0.40], [0.24, 0.56],
+    [0.76, 0.56], [0.40, 0.55], [0.60, 0.55], [0.39, 0.76], [0.61, 0.76],
+    [0.38, 0.97], [0.62, 0.97],
+])
+COMMENTS = (
+    'Left wrist looks occluded.',
+    'Bounding box is a bit tight.',
+    'Looks good to me.',
+    'Please double check the ankles.',
+    'Hips are swapped.',
+)
+
+
+def _users(prefix, count, user_type, **extra):
+    users = []
+    for i in range(count):
+        user, created = User.objects.get_or_create(
+            username=f'bench-{prefix}-{i}', defaults={'user_type': user_type, **extra},
+        )
+        if created:
+            user.set_password(BENCH_PASSWORD)
+            user.save(update_fields=['password'])
+        users.append(user)
+    return users
+
+
+def random_pose(rng):
+    """Return (points, confidence, bbox) lists for a jittered POSE at a random place and scale."""
+    w, h = rng.uniform(80, 600, 2)
+    x, y = rng.uniform(0, 1400, 2)
+    points = POSE * (w, h) + (x, y) + rng.normal(0, 0.02, POSE.shape) * (w, h)
+    confidence = rng.uniform(0.4, 1.0, len(POSE))
+    return np.round(points, 2).tolist(), np.round(confidence, 3).tolist(), np.round([x, y, x + w, y + h], 2).tolist()
+
+
+def _random_annotation(rng, image, annotator, status):
+    points, confidence, bbox = random_pose(rng)
+    annotation = KeypointAnnotation(
+        image=image, annotator=annotator, status=status, verified=status == 'verified',
+        points=points, confidence=confidence, bbox=bbox,
+    )
+    # bulk_create skips save(), so pack here.
+    annotation.packed = pack_keypoints(points, confidence, bbox)
+    return annotation
+
+
+def _write_sample_media(rng):
+    if default_storage.exists(SAMPLE_MEDIA):
+        return
+    pixels = rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    PILImage.fromarray(pixels).save(buf, 'JPEG', quality=85)
+    default_storage.save(SAMPLE_MEDIA, ContentFile(buf.getvalue()))
+
+
+def generate_dataset(images=10000, annotated=0.3, verified=0.3, annotations_per_image=1,
+                     comments_per_annotation=1.0, annotators=20, verifiers=5, batch_size=5000,
+                     seed=0, log=None):
+    """
+    Bulk-create a synthetic Dataset named BENCH_DATASET: bench users, `images`
+    images (a fraction `annotated` pending verification and `verified`
+    verified, the rest unlabeled) with realistic pose keypoints and comments.
+    Works in batches of `batch_size` images so memory stays flat. The same
+    `seed` produces the same data.
+    """
+    rng = np.random.default_rng(seed)
+    annotator_users = _users('annotator', annotators, 'annotator')
+    verifier_users = _users('verifier', verifiers, 'verifier')
+    _users('staff', 1, 'viewer', is_staff=True)
+    dataset, _ = Dataset.objects.get_or_create(name=BENCH_DATASET, defaults={'file_path': ''})
+    _write_sample_media(rng)
+
+    created = defaultdict(int)
+    for start in range(0, images, batch_size):
+        size = min(batch_size, images - start)
+        draws = rng.random(size)
+        statuses = np.where(draws < verified, 'verified', np.where(draws < verified + annotated, 'annotated', 'unlabeled'))
+        changes = CountChanges()
+        with transaction.atomic():
+            batch = Image.objects.bulk_create(
+                Image(
+                    dataset=dataset, file=f'images/bench/{start + i}.jpg', original_name=f'{start + i}.jpg',
+                    width=1920, height=1080, status=str(status),
+                )
+                for i, status in enumerate(statuses)
+            )
+            annotations = []
+            for image in batch:
+                changes.add(dataset.id, 'image', image.status)
+                if image.status == 'unlabeled':
+                    continue
+                for _ in range(annotations_per_image):
+                    status = 'verified' if image.status == 'verified' else 'pending'
+                    annotator = annotator_users[rng.integers(len(annotator_users))]
+                    annotations.append(_random_annotation(rng, image, annotator, status))
+                    changes.add(dataset.id, 'annotation', status)
+            annotations = KeypointAnnotation.objects.bulk_create(annotations)
+
+            comments = []
+            for annotation in annotations:
+                for _ in range(rng.poisson(comments_per_annotation)):
+                    author = verifier_users[rng.integers(len(verifier_users))]
+                    comments.append(Comment(annotation=annotation, author=author, text=COMMENTS[rng.integers(len(COMMENTS))]))
+            Comment.objects.bulk_create(comments)
+            apply_changes(changes)
+            # bulk_create sends no post_save.
+            invalidate('image', 'keypointannotation', 'comment')
+
+        created['images'] += len(batch)
+        created['annotations'] += len(annotations)
+        created['comments'] += len(comments)
+        if log:
+            log(f'{created["images"]}/{images} images, {created["annotations"]} annotations, {created["comments"]} comments')
+    return dict(created)
+
+
+def clear_dataset():
+    """Delete everything generate_dataset() created and rebuild the counters."""
+    Image.objects.filter(dataset__name=BENCH_DATASET).delete()
+    Dataset.objects.filter(name=BENCH_DATASET).delete()
+    User.objects.filter(username__startswith='bench-').delete()
+    default_storage.delete(SAMPLE_MEDIA)
+    rebuild()
+
+
+def _host():
+    # Any name the site accepts; with DEBUG and no ALLOWED_HOSTS Django allows localhost.
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+class Session:
+    """A logged-in test client that records the latency of every request."""
+
+    def __init__(self, user, samples, errors):
+        self.client = Client(HTTP_HOST=_host(), raise_request_exception=False)
+        self.client.force_login(user)
+        self.samples = samples
+        self.errors = errors
+
+    def request(self, name, method, url, data=None, expect=(200,), **kwargs):
+        start = time.perf_counter()
+        response = getattr(self.client, method)(url, data, **kwargs)
+        if hasattr(response, 'streaming_content'):
+            for _ in response.streaming_content:
+                pass
+        self.samples[name].append(time.perf_counter() - start)
+        if response.status_code not in expect:
+            self.errors[name] += 1
+        return response
+
+
+def annotator_session(session, rng, dataset):
+    session.request('dashboard', 'get', reverse('dashboard'), expect=(302,))
+    session.request('annotator_dashboard', 'get', reverse('annotator_dashboard'))
+    session.request('upload_image', 'get', reverse('upload_image'))
+    response = session.request(
+        'claim_next_images', 'post', reverse('claim_next_images'), {'count': 1},
+        headers={'X-Requested-With': 'XMLHttpRequest'},
+    )
+    for claimed in response.json()['images'] if response.status_code == 200 else []:
+        url = reverse('create_annotation', args=[claimed['id']])
+        session.request('create_annotation', 'get', url)
+        session.request('image-detail', 'get', reverse('image-detail', args=[claimed['id']]))
+        session.request('image_rendition', 'get', reverse('image_rendition', args=[claimed['id'], 'thumb']), expect=(302,))
+        points, confidence, bbox = random_pose(rng)
+        session.request('create_annotation', 'post', url, {
+            'points': json.dumps(points), 'confidence': json.dumps(confidence), 'bbox': json.dumps(bbox),
+        })
+    sample = reverse('media', args=[SAMPLE_MEDIA])
+    session.request('media', 'get', sample)
+    session.request('media', 'get', sample, expect=(206,), headers={'Range': 'bytes=0-65535'})
+    # A resumable upload that is abandoned halfway: completing it early is
+    # refused and the partial file is removed.
+    with default_storage.open(SAMPLE_MEDIA) as f:
+        chunk = f.read(65536)
+    response = session.request('create_upload', 'post', reverse('create_upload'),
+                               {'filename': 'bench.jpg', 'size': 2 * len(chunk), 'dataset': dataset.id},
+                               content_type='application/json', expect=(201,))
+    if response.status_code == 201:
+        url = response['Location']
+        session.request('upload_detail', 'patch', url, chunk, content_type='application/offset+octet-stream',
+                        headers={'Upload-Offset': '0'})
+        session.request('upload_detail', 'head', url)
+        session.request('complete_upload', 'post', reverse('complete_upload', args=[response.json()['id']]),
+                        expect=(409,))
+        session.request('upload_detail', 'delete', url, expect=(204,))
+    session.request('view_annotations', 'get', reverse('view_annotations'))
+    session.request('image-list', 'get', reverse('image-list'), {'status': 'unlabeled'})
+
+
+def sample_ids(queryset, rng, count):
+    """
+    Up to `count` distinct ids from `queryset`, chosen by `rng` so runs with
+    the same seed pick the same rows. Each pick is the first id at or after
+    a random point of the id range, one indexed lookup instead of the full
+    sort order_by('?') needs.
+    """
+    bounds = queryset.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return []
+    ids = []
+    for start in rng.integers(bounds['low'], bounds['high'] + 1, count):
+        pk = queryset.filter(id__gte=start).order_by('id').values_list('id', flat=True).first()
+        if pk not in ids:
+            ids.append(pk)
+    return ids
+
+
+def verifier_session(session, rng, dataset):
+    session.request('verifier_dashboard', 'get', reverse('verifier_dashboard'))
+    pending = sample_ids(KeypointAnnotation.objects.filter(status='pending', image__dataset=dataset), rng, 3)
+    if pending:
+        first, rest = pending[0], pending[1:]
+        session.request('verify_annotation', 'get', reverse('verify_annotation', args=[first]))
+        # Generated images have no file behind them, so this measures the
+        # fallback redirect unless real media is present.
+        session.request('annotation_overlay', 'get', reverse('annotation_overlay', args=[first, 'thumb']), expect=(200, 302))
+        response = session.request('annotation-detail', 'get', reverse('annotation-detail', args=[first]))
+        session.request('annotation-history', 'get', reverse('annotation-history', args=[first]))
+        if response.status_code == 200:
+            session.request('image-history', 'get', reverse('image-history', args=[response.json()['image']]))
+        session.request('add_comment', 'get', reverse('add_comment', args=[first]))
+        session.request('add_comment', 'post', reverse('add_comment', args=[first]),
+                        {'text': COMMENTS[rng.integers(len(COMMENTS))]}, expect=(302,))
+        session.request('verify_annotation', 'post', reverse('verify_annotation', args=[first]),
+                        {'status': 'verified', 'annotation_notes': ''}, expect=(302,))
+        if rest:
+            session.request('verify_annotations_batch', 'post', reverse('verify_annotations_batch'),
+                            {'ids': rest, 'status': 'verified'}, content_type='application/json')
+    session.request('annotation-list', 'get', reverse('annotation-list'), {'status': 'pending'})
+    response = session.request('comment-list', 'get', reverse('comment-list'))
+    for comment in response.json()['results'][:1] if response.status_code == 200 else []:
+        session.request('comment-detail', 'get', reverse('comment-detail', args=[comment['id']]))
+    # Rejected annotations are rare, which keeps the export response small.
+    session.request('export_annotations', 'get', reverse('export_annotations'),
+                    {'status': 'rejected', 'dataset': dataset.id})
+    response = session.request('export_annotations', 'get', reverse('export_annotations'),
+                               {'status': 'rejected', 'dataset': dataset.id, 'background': '1'}, expect=(202,))
+    if response.status_code == 202:
+        session.request('job_status', 'get', response.json()['status_url'])
+
+
+def staff_session(session, rng, dataset):
+    session.request('metrics', 'get', reverse('metrics'))
+    session.request('api-root', 'get', reverse('api-root'))
+    session.request('admin:index', 'get', reverse('admin:index'))
+    session.request('login', 'get', reverse('login'))
+    session.request('logout', 'get', reverse('logout'), expect=(302,))
+
+
+SCENARIOS = {
+    'annotator': (annotator_session, 'bench-annotator-'),
+    'verifier': (verifier_session, 'bench-verifier-'),
+    'staff': (staff_session, 'bench-staff-'),
+}
+
+
+# Long-lived streams: their "latency" is the length of the session.
+UNTIMED = {'event_stream'}
+
+
+def _cache_hit_ratios(before, after):
+    names = sorted({name for name, _ in after})
+    ratios = {}
+    for name in names:
+        hits = after.get((name, 'hit'), 0) - before.get((name, 'hit'), 0)
+        misses = after.get((name, 'miss'), 0) - before.get((name, 'miss'), 0)
+        if hits + misses:
+            ratios[name] = {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / (hits + misses), 3)}
+    return ratios
+
+
+def _url_names(resolver=None, namespace=None):
+    resolver = resolver or get_resolver()
+    names = set()
+    for pattern in resolver.url_patterns:
+        if hasattr(pattern, 'url_patterns'):
+            inner = f'{namespace}:{pattern.namespace}' if namespace and pattern.namespace else (pattern.namespace or namespace)
+            if pattern.namespace != 'admin':
+                names |= _url_names(pattern, inner)
+            else:
+                names.add('admin:index')
+        elif pattern.name:
+            names.add(f'{namespace}:{pattern.name}' if namespace else pattern.name)
+    return names
+
+
+def _summarize(samples):
+    values = np.asarray(samples)
+    p50, p90, p95, p99 = np.quantile(values, (0.5, 0.9, 0.95, 0.99))
+    return {
+        'count': len(values),
+        'mean_ms': round(values.mean() * 1000, 3),
+        'p50_ms': round(p50 * 1000, 3),
+        'p90_ms': round(p90 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'p99_ms': round(p99 * 1000, 3),
+        'max_ms': round(values.max() * 1000, 3),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(annotators=4, verifiers=2, iterations=10, duration=None, seed=0):
+    """
+    Run `annotators` + `verifiers` (+1 staff) concurrent scripted sessions
+    against the data from generate_dataset(), each for `iterations` rounds or
+    `duration` seconds. Returns a JSON-serialisable report with throughput
+    and per-URL latency percentiles.
+    """
+    dataset = Dataset.objects.get(name=BENCH_DATASET)
+    plan = [('annotator', i) for i in range(annotators)] + [('verifier', i) for i in range(verifiers)] + [('staff', 0)]
+    users = {
+        (kind, i): User.objects.get(username=f'{SCENARIOS[kind][1]}{i}')
+        for kind, i in plan
+    }
+
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(plan))
+
+    def worker(kind, i, seed):
+        local_samples, local_errors = defaultdict(list), defaultdict(int)
+        rng = np.random.default_rng(seed)
+        scenario = SCENARIOS[kind][0]
+        try:
+            session = Session(users[kind, i], local_samples, local_errors)
+            barrier.wait()
+            deadline = time.monotonic() + duration if duration else None
+            rounds = 0
+            while (deadline and time.monotonic() < deadline) or (not deadline and rounds < iterations):
+                scenario(session, rng, dataset)
+                rounds += 1
+                if kind == 'staff':
+                    session.client.force_login(users[kind, i])
+        finally:
+            connection.close()
+            with lock:
+                for name, values in local_samples.items():
+                    samples[name].extend(values)
+                for name, count in local_errors.items():
+                    errors[name] += count
+
+    threads = [
+        threading.Thread(target=worker, args=(kind, i, seed * 1000 + n))
+        for n, (kind, i) in enumerate(plan)
+    ]
+    lookups = registry.cache_snapshot()
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    requests = sum(len(values) for values in samples.values())
+    everything = [value for values in samples.values() for value in values]
+    return {
+        'revision': _git_revision(),
+        'database': connection.vendor,
+        'config': {
+            'annotators': annotators, 'verifiers': verifiers, 'iterations': iterations,
+            'duration': duration, 'seed': seed,
+            'images': Image.objects.filter(dataset=dataset).count(),
+        },
+        'seconds': round(elapsed, 3),
+        'requests': requests,
+        'requests_per_second': round(requests / elapsed, 1) if elapsed else None,
+        'errors': sum(errors.values()),
+        'overall': _summarize(everything) if everything else None,
+        'urls': {
+            name: dict(_summarize(values), errors=errors.get(name, 0))
+            for name, values in sorted(samples.items())
+        },
+        'not_exercised': sorted(_url_names() - set(samples) - UNTIMED),
+        'view_cache': _cache_hit_ratios(lookups, registry.cache_snapshot()),
+    }
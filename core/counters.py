@@ -0,0 +1,86 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Image, KeypointAnnotation, StatusCount
+
+
+class CountChanges(Counter):
+    """Pending deltas keyed by (dataset_id, kind, status)."""
+
+    def add(self, dataset_id, kind, status, delta=1):
+        self[(dataset_id, kind, status)] += delta
+
+    def move(self, dataset_id, kind, old_status, new_status, delta=1):
+        if old_status != new_status:
+            self.add(dataset_id, kind, old_status, -delta)
+            self.add(dataset_id, kind, new_status, delta)
+
+
+def apply_changes(changes):
+    """
+    Apply `changes` to the counter table. Call inside the transaction that
+    makes the status change so the two commit together. Keys are updated in
+    a fixed order to keep concurrent writers from deadlocking.
+    """
+    for (dataset_id, kind, status), delta in sorted(changes.items(), key=lambda item: (item[0][0] or 0, item[0][1:])):
+        if not delta:
+            continue
+        updated = StatusCount.objects.filter(dataset_id=dataset_id, kind=kind, status=status).update(
+            count=F('count') + delta
+        )
+        if not updated:
+            StatusCount.objects.create(dataset_id=dataset_id, kind=kind, status=status, count=delta)
+
+
+def record(changes):
+    with transaction.atomic():
+        apply_changes(changes)
+
+
+def progress(dataset=None):
+    """Return {'image': {status: n}, 'annotation': {status: n}} from the counters."""
+    counts = StatusCount.objects.all()
+    if dataset is not None:
+        counts = counts.filter(dataset=dataset)
+    summary = {'image': defaultdict(int), 'annotation': defaultdict(int)}
+    for kind, status, count in counts.values_list('kind', 'status', 'count'):
+        summary[kind][status] += count
+    return {kind: dict(statuses) for kind, statuses in summary.items()}
+
+
+def tally(images, annotations):
+    """Return the CountChanges that the `images` and `annotations` querysets contribute."""
+    changes = CountChanges()
+    for row in images.values('dataset_id', 'status').annotate(n=Count('id')).order_by():
+        changes.add(row['dataset_id'], 'image', row['status'], row['n'])
+    for row in annotations.values('image__dataset_id', 'status').annotate(n=Count('id')).order_by():
+        changes.add(row['image__dataset_id'], 'annotation', row['status'], row['n'])
+    return changes
+
+
+def release_dataset(dataset_id):
+    """
+    Move the counts of `dataset_id` to the counters outside any Dataset.
+    Deleting a Dataset keeps its images (their dataset becomes null) but
+    cascades its StatusCount rows, so call this first, in the same
+    transaction.
+    """
+    changes = CountChanges()
+    for kind, status, count in StatusCount.objects.filter(dataset_id=dataset_id).values_list('kind', 'status', 'count'):
+        changes.add(None, kind, status, count)
+    apply_changes(changes)
+
+
+def rebuild():
+    """Recompute every counter from the Image and KeypointAnnotation tables."""
+    changes = tally(Image.objects.all(), KeypointAnnotation.objects.all())
+
+    with transaction.atomic():
+        StatusCount.objects.all().delete()
+        StatusCount.objects.bulk_create(
+            StatusCount(dataset_id=dataset_id, kind=kind, status=status, count=count)
+            for (dataset_id, kind, status), count in changes.items()
+        )
+    return changes
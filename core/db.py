@@ -0,0 +1,32 @@
+import random
+import time
+from functools import wraps
+
+from django.db import OperationalError, connection
+
+LOCK_RETRY_ATTEMPTS = 6
+LOCK_RETRY_BASE_DELAY = 0.05
+
+
+def is_lock_error(error):
+    message = str(error).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def retry_on_locked(function):
+    """
+    Retry `function` with jittered exponential backoff when SQLite reports
+    the database as locked. `function` should open its own transaction; when
+    called inside an outer atomic block the error is re-raised untouched, as
+    only the outermost transaction can be retried.
+    """
+    @wraps(function)
+    def wrap(*args, **kwargs):
+        for attempt in range(LOCK_RETRY_ATTEMPTS):
+            try:
+                return function(*args, **kwargs)
+            except OperationalError as e:
+                if not is_lock_error(e) or connection.in_atomic_block or attempt == LOCK_RETRY_ATTEMPTS - 1:
+                    raise
+                time.sleep(LOCK_RETRY_BASE_DELAY * (2 ** attempt) * (0.5 + random.random()))
+    return wrap
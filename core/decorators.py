@@ -1,21 +1,44 @@
 from django.shortcuts import redirect
 from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.http import JsonResponse
 from functools import wraps
 
-def annotator_required(function):
-    @wraps(function)
-    def wrap(request, *args, **kwargs):
-        if request.user.user_type == 'annotator':
-            return function(request, *args, **kwargs)
-        messages.error(request, 'You must be an annotator to access this page.')
-        return redirect('dashboard')
-    return wrap
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from .roles import get_role
 
-def verifier_required(function):
-    @wraps(function)
-    def wrap(request, *args, **kwargs):
-        if request.user.user_type == 'verifier':
-            return function(request, *args, **kwargs)
-        messages.error(request, 'You must be a verifier to access this page.')
+def capability_required(capability, message):
+    def denied(request):
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.content_type == 'application/json':
+            return JsonResponse({'success': False, 'error': message}, status=403)
+        messages.error(request, message)
         return redirect('dashboard')
-    return wrap
\ No newline at end of file
+
+    def decorator(function):
+        if iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrap(request, *args, **kwargs):
+                # get_role may load the user and session from the database.
+                role = await sync_to_async(get_role)(request)
+                if role is None:
+                    return redirect_to_login(request.get_full_path())
+                if capability in role.capabilities:
+                    return await function(request, *args, **kwargs)
+                return await sync_to_async(denied)(request)
+            return async_wrap
+
+        @wraps(function)
+        def wrap(request, *args, **kwargs):
+            role = get_role(request)
+            if role is None:
+                return redirect_to_login(request.get_full_path())
+            if capability in role.capabilities:
+                return function(request, *args, **kwargs)
+            return denied(request)
+        return wrap
+    return decorator
+
+annotator_required = capability_required('annotate', 'You must be an annotator to access this page.')
+
+verifier_required = capability_required('verify', 'You must be a verifier to access this page.')
@@ -0,0 +1,128 @@
+import math
+import os
+import threading
+
+from PIL import Image as PILImage, ImageOps
+
+# Long-edge size in pixels of each downscaled rendition
+RENDITIONS = {
+    'thumb': 256,
+    'preview': 1600,
+}
+TILE_SIZE = 254
+TILE_OVERLAP = 1
+JPEG_QUALITY = 85
+
+DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+    'TileSize="{tile_size}" Overlap="{overlap}" Format="jpg">'
+    '<Size Width="{width}" Height="{height}"/></Image>\n'
+)
+
+
+def rendition_name(name, size):
+    return f'{os.path.splitext(name)[0]}_{size}.jpg'
+
+
+def dzi_name(name):
+    return f'{os.path.splitext(name)[0]}.dzi'
+
+
+def tiles_dir(name):
+    return f'{os.path.splitext(name)[0]}_files'
+
+
+def is_derivative(name):
+    """Whether media file `name` is a rendition, DZI descriptor or tile rather than an original."""
+    stem, ext = os.path.splitext(name)
+    if ext == '.dzi' or '_files/' in name:
+        return True
+    return ext == '.jpg' and any(stem.endswith(f'_{size}') for size in RENDITIONS)
+
+
+def generate_derivatives(path):
+    """
+    Write the renditions and a Deep Zoom tile pyramid next to the original
+    at `path`. Returns the (width, height) of the upright original.
+    """
+    with PILImage.open(path) as original:
+        im = ImageOps.exif_transpose(original).convert('RGB')
+    width, height = im.size
+
+    for size in RENDITIONS:
+        _save_rendition(im.copy(), path, size)
+
+    write_pyramid(im, path)
+    return width, height
+
+
+def write_pyramid(im, path):
+    """
+    Write the Deep Zoom tiles of `im` under tiles_dir(path), then its
+    descriptor; the annotation viewer loads the tiles once it finds the
+    descriptor.
+    """
+    root = tiles_dir(path)
+    max_level = math.ceil(math.log2(max(im.size))) if max(im.size) > 1 else 0
+    level_image = im
+    for level in range(max_level, -1, -1):
+        if level != max_level:
+            # Halve the previous level rather than the original; much cheaper
+            # and visually indistinguishable at tile resolution.
+            level_image = level_image.resize(
+                (max(1, math.ceil(level_image.width / 2)), max(1, math.ceil(level_image.height / 2))),
+                PILImage.BOX,
+            )
+        level_dir = os.path.join(root, str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        for col in range(math.ceil(level_image.width / TILE_SIZE)):
+            for row in range(math.ceil(level_image.height / TILE_SIZE)):
+                left = max(0, col * TILE_SIZE - TILE_OVERLAP)
+                top = max(0, row * TILE_SIZE - TILE_OVERLAP)
+                right = min(level_image.width, (col + 1) * TILE_SIZE + TILE_OVERLAP)
+                bottom = min(level_image.height, (row + 1) * TILE_SIZE + TILE_OVERLAP)
+                level_image.crop((left, top, right, bottom)).save(
+                    os.path.join(level_dir, f'{col}_{row}.jpg'), 'JPEG', quality=JPEG_QUALITY
+                )
+
+    name = dzi_name(path)
+    tmp = f'{name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(DZI_TEMPLATE.format(
+            tile_size=TILE_SIZE, overlap=TILE_OVERLAP, width=im.width, height=im.height
+        ))
+    os.replace(tmp, name)
+
+
+def generate_rendition(path, size):
+    """
+    Write only the `size` rendition of the original at `path`, decoding no
+    more of it than that needs. For requests that cannot wait for the
+    background job.
+    """
+    edge = RENDITIONS[size]
+    with PILImage.open(path) as original:
+        original.draft('RGB', (edge, edge))
+        im = ImageOps.exif_transpose(original).convert('RGB')
+    _save_rendition(im, path, size)
+
+
+def _save_rendition(im, path, size):
+    edge = RENDITIONS[size]
+    im.thumbnail((edge, edge), PILImage.LANCZOS)
+    name = rendition_name(path, size)
+    # Concurrent writers of the same rendition each write a whole file and
+    # the last rename wins.
+    tmp = f'{name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    im.save(tmp, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    os.replace(tmp, name)
+
+
+def process_image_file(item):
+    """Process-pool entry point: (image_id, path) -> (image_id, size or None)."""
+    image_id, path = item
+    try:
+        return image_id, generate_derivatives(path)
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        return image_id, None
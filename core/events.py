@@ -0,0 +1,140 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict, deque, namedtuple
+from functools import partial
+
+from django.db import transaction
+
+# Topics a dashboard can follow; see core.roles for who gets which.
+TOPICS = ('annotator', 'verifier')
+HISTORY = 1000
+QUEUE_SIZE = 256
+HEARTBEAT_SECONDS = 25
+
+Event = namedtuple('Event', ['id', 'topics', 'type', 'data'])
+
+# Sent instead of the missed events when a client fell too far behind.
+RESYNC = Event(0, TOPICS, 'resync', {})
+
+
+class Subscription:
+    """An asyncio queue of events for one connected client."""
+
+    def __init__(self, topics, loop):
+        self.topics = frozenset(topics)
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def put(self, event):
+        # Runs in the subscriber's event loop.
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A slow client: drop what it has not read and tell it to reload.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self, timeout):
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    """
+    In-process publish/subscribe of small dashboard change events. Publishers
+    can be any thread; subscribers are asyncio tasks of the ASGI server.
+    Events only reach clients connected to the same process, so run a
+    single ASGI worker for /events/ (or route it to one) when using it.
+    """
+
+    def __init__(self, history=HISTORY):
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.history = deque(maxlen=history)
+        self.last_id = 0
+
+    def publish(self, topics, event_type, data):
+        with self.lock:
+            self.last_id += 1
+            event = Event(self.last_id, frozenset(topics), event_type, data)
+            self.history.append(event)
+            targets = defaultdict(list)
+            for subscription in self.subscriptions:
+                if subscription.topics & event.topics:
+                    targets[subscription.loop].append(subscription)
+        # One wake-up per event loop rather than per client.
+        for loop, subscriptions in targets.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, subscriptions, event)
+            except RuntimeError:
+                # The loop is closed; its clients are gone.
+                with self.lock:
+                    self.subscriptions.difference_update(subscriptions)
+        return event
+
+    def subscribe(self, topics, last_event_id=None):
+        """
+        Return a Subscription for the running event loop. With
+        `last_event_id`, events published since then are queued first, or a
+        resync if they are no longer in the history.
+        """
+        subscription = Subscription(topics, asyncio.get_running_loop())
+        with self.lock:
+            if last_event_id is not None:
+                oldest = self.history[0].id if self.history else self.last_id + 1
+                if last_event_id > self.last_id or last_event_id < oldest - 1:
+                    subscription.queue.put_nowait(RESYNC)
+                else:
+                    missed = [e for e in self.history if e.id > last_event_id and subscription.topics & e.topics]
+                    for event in missed[-QUEUE_SIZE:]:
+                        subscription.queue.put_nowait(event)
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+
+def _deliver(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.put(event)
+
+
+broker = Broker()
+
+
+def publish_on_commit(topics, event_type, **data):
+    """Publish an event once the current transaction commits (now if there is none)."""
+    transaction.on_commit(partial(broker.publish, topics, event_type, data))
+
+
+def format_sse(event):
+    return f'id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n'
+
+
+async def stream(topics, last_event_id=None):
+    """
+    Yield Server-Sent Events text for `topics` until the client goes away.
+    The subscription only exists while the stream is being read.
+    """
+    subscription = broker.subscribe(topics, last_event_id)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = await subscription.get(HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection.
+                yield ': ping\n\n'
+                continue
+            if event is RESYNC:
+                # No id line: the client reloads and starts from scratch.
+                yield 'event: resync\ndata: {}\n\n'
+                continue
+            yield format_sse(event)
+    finally:
+        broker.unsubscribe(subscription)
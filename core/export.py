@@ -0,0 +1,182 @@
+import datetime
+import json
+import zlib
+
+import numpy as np
+from django.db.models import Case, F, JSONField, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .keypoints import DTYPE, keypoint_schema, unpack_keypoints
+from .models import Image, KeypointAnnotation
+
+FORMATS = ('coco', 'jsonl')
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+COCO_CATEGORY = {
+    'id': 1,
+    'name': 'object',
+    'supercategory': 'object',
+}
+
+
+def parse_bound(value, end=False):
+    """Parse an ISO date or datetime; a bare date covers the whole day."""
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        day = moment = None
+    if day is not None:
+        if end:
+            day += datetime.timedelta(days=1)
+        moment = datetime.datetime.combine(day, datetime.time.min)
+    elif moment is None:
+        raise ValueError(f'Invalid date: {value}')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(status='verified', since=None, until=None, dataset=None):
+    annotations = KeypointAnnotation.objects.all()
+    if status:
+        annotations = annotations.filter(status=status)
+    if since:
+        annotations = annotations.filter(created_at__gte=parse_bound(since))
+    if until:
+        annotations = annotations.filter(created_at__lt=parse_bound(until, end=True))
+    if dataset:
+        annotations = annotations.filter(image__dataset=dataset)
+    return annotations.order_by('id')
+
+
+def _rounded(array):
+    return array.astype(np.float64).round(3).tolist()
+
+
+def _unpacked(field):
+    # The JSON column, only for rows without a packed blob; the rest would
+    # pay for decoding JSON they never use.
+    return Case(When(packed__isnull=True, then=F(field)), output_field=JSONField())
+
+
+def _iter_rows(annotations):
+    rows = annotations.values_list(
+        'id', 'image_id', 'annotator__username', 'status', 'created_at', 'annotation_notes', 'packed',
+        _unpacked('points'), _unpacked('confidence'), _unpacked('bbox'),
+    )
+    for pk, image_id, annotator, status, created_at, notes, packed, *unpacked in rows.iterator(chunk_size=CHUNK_SIZE):
+        if packed is not None:
+            points, confidence, bbox = unpack_keypoints(packed)
+        else:
+            points, confidence, bbox = (np.asarray(values, dtype=DTYPE) for values in unpacked)
+        yield {
+            'id': pk,
+            'image_id': image_id,
+            'annotator': annotator,
+            'status': status,
+            'created_at': created_at.isoformat(),
+            'notes': notes,
+            'points': points,
+            'confidence': confidence,
+            'bbox': bbox,
+        }
+
+
+def iter_jsonl(annotations):
+    for row in _iter_rows(annotations):
+        row['points'] = _rounded(row['points'])
+        row['confidence'] = _rounded(row['confidence'])
+        row['bbox'] = _rounded(row['bbox'])
+        yield json.dumps(row) + '\n'
+
+
+def _coco_annotation(row):
+    points = row['points']
+    keypoints = np.zeros((len(points), 3), dtype=np.float64)
+    if len(points):
+        keypoints[:, :2] = points[:, :2]
+        keypoints[:, 2] = 2  # labelled and visible
+    bbox = row['bbox']
+    if len(bbox) == 4:
+        x1, y1, x2, y2 = bbox.astype(np.float64)
+        coco_bbox = [x1, y1, x2 - x1, y2 - y1]
+    else:
+        coco_bbox = [0.0, 0.0, 0.0, 0.0]
+    return {
+        'id': row['id'],
+        'image_id': row['image_id'],
+        'category_id': COCO_CATEGORY['id'],
+        'keypoints': keypoints.round(3).ravel().tolist(),
+        'num_keypoints': len(points),
+        'bbox': [round(v, 3) for v in coco_bbox],
+        'area': round(coco_bbox[2] * coco_bbox[3], 3),
+        'iscrowd': 0,
+        'keypoint_scores': _rounded(row['confidence']),
+    }
+
+
+def coco_category():
+    names, skeleton = keypoint_schema()
+    return {**COCO_CATEGORY, 'keypoints': list(names), 'skeleton': [list(edge) for edge in skeleton]}
+
+
+def iter_coco(annotations):
+    """
+    Stream a COCO keypoints document. Images and annotations are each read
+    in a separate server-side pass, so memory does not grow with the export.
+    """
+    yield '{"info": %s, "categories": [%s], "images": [' % (
+        json.dumps({'description': 'Keypoint annotations', 'date_created': timezone.now().isoformat()}),
+        json.dumps(coco_category()),
+    )
+    images = Image.objects.filter(id__in=annotations.values('image_id')).order_by('id')
+    rows = images.values_list('id', 'file', 'width', 'height', 'uploaded_at')
+    separator = ''
+    for pk, file_name, width, height, uploaded_at in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield separator + json.dumps({
+            'id': pk,
+            'file_name': file_name,
+            'width': width,
+            'height': height,
+            'date_captured': uploaded_at.isoformat(),
+        })
+        separator = ', '
+    yield '], "annotations": ['
+    separator = ''
+    for row in _iter_rows(annotations):
+        yield separator + json.dumps(_coco_annotation(row))
+        separator = ', '
+    yield ']}\n'
+
+
+def export_filename(fmt='jsonl', compress=False):
+    filename = 'annotations.json' if fmt == 'coco' else 'annotations.jsonl'
+    return filename + '.gz' if compress else filename
+
+
+def iter_export(annotations, fmt='jsonl', compress=False):
+    """Yield the export as bytes in ~64 KB chunks, gzipped if `compress`."""
+    pieces = iter_coco(annotations) if fmt == 'coco' else iter_jsonl(annotations)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= BUFFER_SIZE:
+            data = ''.join(buffer).encode()
+            buffer, size = [], 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = ''.join(buffer).encode()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
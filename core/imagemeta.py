@@ -0,0 +1,188 @@
+import hashlib
+from itertools import combinations
+
+import numpy as np
+from django.db.models import Q
+from PIL import Image as PILImage, ImageOps
+
+from .models import Image
+
+# 64-bit difference hash (dHash) of the upright image: each bit says whether
+# a pixel of a 9x8 grayscale thumbnail is brighter than its left neighbour.
+# It survives rescaling, recompression and small colour changes.
+HASH_SIZE = 8
+ORIENTATION_TAG = 0x0112
+
+# Multi-index hashing: the hash is split into BANDS indexed 16-bit columns.
+# Two hashes within Hamming distance k agree to within k // BANDS bits on at
+# least one band, so a lookup only reads rows matching one of a few hundred
+# band values and then checks the full distance.
+BANDS = 4
+BAND_BITS = 64 // BANDS
+DEFAULT_DISTANCE = 6
+MAX_DISTANCE = 3 * BANDS - 1
+# Rows per step of duplicate_pairs()
+PAIR_CHUNK = 16384
+
+
+def to_signed(value):
+    """Store an unsigned 64-bit hash in a signed BigIntegerField."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming(a, b):
+    return (to_unsigned(a) ^ to_unsigned(b)).bit_count()
+
+
+def hash_bands(value):
+    value = to_unsigned(value)
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (BAND_BITS * (BANDS - 1 - i))) & mask for i in range(BANDS)]
+
+
+def band_fields(value):
+    return {f'phash_{i}': band for i, band in enumerate(hash_bands(value))}
+
+
+def dhash(im):
+    small = im.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), PILImage.BOX)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def image_metadata(fp):
+    """
+    Return the Image fields describing the picture in `fp` (a path or file
+    object): upright width and height, EXIF orientation and the perceptual
+    hash with its index bands.
+    """
+    with PILImage.open(fp) as im:
+        orientation = im.getexif().get(ORIENTATION_TAG, 1)
+        if orientation not in range(1, 9):
+            orientation = 1
+        width, height = im.size
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+        # The hash only needs a tiny image; let the JPEG decoder shrink it.
+        im.draft('RGB', (HASH_SIZE * 8, HASH_SIZE * 8))
+        perceptual_hash = to_signed(dhash(ImageOps.exif_transpose(im)))
+    return {
+        'width': width, 'height': height, 'orientation': orientation,
+        'perceptual_hash': perceptual_hash, **band_fields(perceptual_hash),
+    }
+
+
+def upload_fields(upload):
+    """Content hash and metadata of an uploaded file, for a new Image."""
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    fields = {'content_hash': digest.hexdigest()}
+    try:
+        fields.update(image_metadata(upload))
+    except (OSError, ValueError):
+        pass
+    upload.seek(0)
+    return fields
+
+
+def _flip_masks(radius):
+    """XOR masks turning a band into every value within `radius` bits of it."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        masks += [sum(1 << bit for bit in bits) for bits in combinations(range(BAND_BITS), r)]
+    return masks
+
+
+def _neighbours(band, radius):
+    return [band ^ mask for mask in _flip_masks(radius)]
+
+
+def popcount(values):
+    """Number of set bits of each uint64 in `values`."""
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _check_distance(distance):
+    if not 0 <= distance <= MAX_DISTANCE:
+        raise ValueError(f'distance must be between 0 and {MAX_DISTANCE}')
+    return distance // BANDS
+
+
+def near_duplicates(perceptual_hash, distance=DEFAULT_DISTANCE, images=None):
+    """
+    Return [(image id, distance)] for the images (from `images`, default all)
+    whose perceptual hash is within `distance` bits of `perceptual_hash`,
+    closest first.
+    """
+    radius = _check_distance(distance)
+    match = Q()
+    for i, band in enumerate(hash_bands(perceptual_hash)):
+        match |= Q(**{f'phash_{i}__in': _neighbours(band, radius)})
+    images = Image.objects.all() if images is None else images
+    found = [
+        (pk, hamming(perceptual_hash, other))
+        for pk, other in images.filter(match).values_list('id', 'perceptual_hash')
+    ]
+    return sorted((item for item in found if item[1] <= distance), key=lambda item: (item[1], item[0]))
+
+
+def duplicate_pairs(distance=DEFAULT_DISTANCE, images=None):
+    """
+    Yield (image id, image id, distance) for every pair of near-duplicate
+    images, lower id first. The same band lookups as near_duplicates() run
+    in memory over all hashes at once with NumPy, instead of one query per
+    image.
+    """
+    radius = _check_distance(distance)
+    images = Image.objects.all() if images is None else images
+    rows = images.exclude(perceptual_hash=None).order_by('id').values_list('id', 'perceptual_hash')
+    ids = np.fromiter((pk for pk, _ in rows), dtype=np.int64)
+    hashes = np.fromiter((value for _, value in rows), dtype=np.int64, count=len(ids)).view(np.uint64)
+    masks = np.array(_flip_masks(radius), dtype=np.int64)
+    found = set()
+    for i in range(BANDS):
+        bands = ((hashes >> np.uint64(BAND_BITS * (BANDS - 1 - i))) & np.uint64((1 << BAND_BITS) - 1)).astype(np.int64)
+        # Rows sorted by band value; starts[v]:starts[v + 1] are those with value v.
+        order = np.argsort(bands, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(np.bincount(bands, minlength=1 << BAND_BITS))))
+        for mask in masks:
+            keys = bands ^ mask
+            lo, counts = starts[keys], starts[keys + 1] - starts[keys]
+            # Rows in chunks keep the candidate arrays to a few MB each.
+            for chunk in range(0, len(ids), PAIR_CHUNK):
+                rows_with = chunk + np.flatnonzero(counts[chunk:chunk + PAIR_CHUNK])
+                if not rows_with.size:
+                    continue
+                # Expand each row into (row, candidate) pairs without a Python loop.
+                n = counts[rows_with]
+                left = np.repeat(rows_with, n)
+                offsets = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+                right = order[np.repeat(lo[rows_with], n) + offsets]
+                keep = left < right
+                left, right = left[keep], right[keep]
+                d = popcount(hashes[left] ^ hashes[right])
+                close = d <= distance
+                found.update(zip(left[close].tolist(), right[close].tolist(), d[close].tolist()))
+    for a, b, d in sorted(found):
+        yield int(ids[a]), int(ids[b]), d
+
+
+def similar_images(image, distance=DEFAULT_DISTANCE):
+    """
+    [(image id, distance)] of other images that are byte-identical to or
+    near-duplicates of `image`, closest first.
+    """
+    others = Image.objects.exclude(id=image.id)
+    found = {}
+    if image.content_hash:
+        found.update((pk, 0) for pk in others.filter(content_hash=image.content_hash).values_list('id', flat=True))
+    if image.perceptual_hash is not None:
+        found.update((pk, d) for pk, d in near_duplicates(image.perceptual_hash, distance, others) if pk not in found)
+    return sorted(found.items(), key=lambda item: (item[1], item[0]))
@@ -0,0 +1,179 @@
+import random
+import threading
+import time
+import traceback
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .db import retry_on_locked
+from .models import Job
+
+# Seconds a worker may run a job before it is considered lost (the worker
+# died or hung) and handed to another worker.
+DEFAULT_TIMEOUT = 5 * 60
+# Failed attempts are retried after RETRY_BASE_DELAY * 2 ** (attempt - 1)
+# seconds, jittered and capped at RETRY_MAX_DELAY.
+RETRY_BASE_DELAY = 10
+RETRY_MAX_DELAY = 60 * 60
+POLL_INTERVAL = 1.0
+RECOVERY_INTERVAL = 30
+
+Task = namedtuple('Task', ['name', 'function', 'priority', 'max_attempts', 'timeout'])
+
+# Registered by @task; core.tasks is imported when the app is ready.
+TASKS = {}
+
+
+def task(name, priority=0, max_attempts=3, timeout=DEFAULT_TIMEOUT):
+    """
+    Register a function as the background task `name`. It is called with
+    the job's keyword arguments, which like its return value must be JSON
+    serializable. Tasks can run more than once, so they must be idempotent.
+    """
+    def register(function):
+        TASKS[name] = Task(name, function, priority, max_attempts, timeout)
+        return function
+    return register
+
+
+def enqueue(name, kwargs=None, priority=None, delay=0, created_by=None):
+    """
+    Queue task `name` and return its Job. Inside a transaction the job only
+    becomes visible to workers when it commits, so it never sees data that
+    was rolled back.
+    """
+    try:
+        spec = TASKS[name]
+    except KeyError:
+        raise LookupError(f'Unknown task {name!r}')
+    return Job.objects.create(
+        task=name,
+        kwargs=kwargs or {},
+        priority=spec.priority if priority is None else priority,
+        max_attempts=spec.max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+        created_by=created_by,
+    )
+
+
+def retry_delay(attempts):
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * (0.5 + random.random()))
+
+
+@retry_on_locked
+def claim(worker, tasks=None):
+    """
+    Take the most urgent due job for `worker` and mark it running until its
+    task's timeout, or return None if there is nothing to do.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # On SQLite the transaction starts with BEGIN IMMEDIATE, which
+        # serializes claims across processes; elsewhere the row lock does.
+        candidates = Job.objects.filter(status='queued', run_after__lte=now)
+        if tasks:
+            candidates = candidates.filter(task__in=tasks)
+        candidates = candidates.order_by('-priority', 'run_after', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        job = candidates.first()
+        if job is None:
+            return None
+        spec = TASKS.get(job.task)
+        job.status = 'running'
+        job.attempts += 1
+        job.worker = worker
+        job.started_at = now
+        job.locked_until = now + timedelta(seconds=spec.timeout if spec else DEFAULT_TIMEOUT)
+        claimed = Job.objects.filter(id=job.id, status='queued').update(
+            status=job.status, attempts=job.attempts, worker=job.worker,
+            started_at=job.started_at, locked_until=job.locked_until,
+        )
+    return job if claimed else None
+
+
+@retry_on_locked
+def _finish(job, **fields):
+    # Matching on attempts fences off a worker whose job timed out and was
+    # handed to someone else.
+    return Job.objects.filter(id=job.id, status='running', attempts=job.attempts).update(
+        locked_until=None, finished_at=timezone.now(), **fields,
+    )
+
+
+def run_job(job):
+    """Run a claimed job and record its result, a retry or its failure."""
+    spec = TASKS.get(job.task)
+    if spec is None:
+        _finish(job, status='failed', error=f'Unknown task {job.task!r}')
+        return False
+    try:
+        result = spec.function(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            _finish(job, status='queued', error=error, run_after=timezone.now() + retry_delay(job.attempts))
+        else:
+            _finish(job, status='failed', error=error)
+        return False
+    _finish(job, status='succeeded', result=result, error='')
+    return True
+
+
+@retry_on_locked
+def recover_expired():
+    """
+    Requeue running jobs whose worker missed their timeout, or fail them if
+    they have no attempts left. Returns the number of jobs recovered.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        expired = Job.objects.filter(status='running', locked_until__lte=now)
+        failed = expired.filter(attempts__gte=F('max_attempts')).update(
+            status='failed', locked_until=None, finished_at=now, error='Timed out',
+        )
+        requeued = expired.update(status='queued', locked_until=None, run_after=now, error='Timed out')
+    return failed + requeued
+
+
+def _close_old_connections():
+    # Between jobs, like between requests: drop broken or expired
+    # connections. Not when the caller holds a transaction (tests).
+    if not connection.in_atomic_block:
+        close_old_connections()
+
+
+def work(worker, stop=None, tasks=None, poll_interval=POLL_INTERVAL, burst=False, log=None):
+    """
+    Claim and run jobs until `stop` (a threading or multiprocessing Event)
+    is set, or, with `burst`, until no job is due. Returns the number of
+    jobs run.
+    """
+    stop = stop or threading.Event()
+    log = log or (lambda message: None)
+    count = 0
+    next_recovery = 0
+    while not stop.is_set():
+        _close_old_connections()
+        if time.monotonic() >= next_recovery:
+            recovered = recover_expired()
+            if recovered:
+                log(f'{worker}: recovered {recovered} timed out jobs')
+            next_recovery = time.monotonic() + RECOVERY_INTERVAL
+        job = claim(worker, tasks)
+        if job is None:
+            if burst:
+                break
+            stop.wait(poll_interval)
+            continue
+        started = time.monotonic()
+        ok = run_job(job)
+        count += 1
+        log(f'{worker}: {job.task} #{job.id} {"done" if ok else "failed"} in {time.monotonic() - started:.2f}s')
+    _close_old_connections()
+    return count
@@ -0,0 +1,71 @@
+import struct
+
+import numpy as np
+from django.conf import settings
+
+# Packed layout: a little-endian header followed by float32 points
+# (n_points x dims), confidence (n_confidence) and bbox (n_bbox) values.
+MAGIC = b'KP'
+SCHEMA_VERSION = 1
+HEADER = struct.Struct('<2sBBIII')
+DTYPE = np.dtype('<f4')
+
+# Keypoint schema: names in annotation order, and skeleton edges as 1-based
+# index pairs as in COCO. Defaults to the COCO person layout; set
+# KEYPOINT_NAMES and KEYPOINT_SKELETON for other subjects.
+COCO_PERSON_KEYPOINTS = [
+    'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
+    'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow', 'left_wrist', 'right_wrist',
+    'left_hip', 'right_hip', 'left_knee', 'right_knee', 'left_ankle', 'right_ankle',
+]
+COCO_PERSON_SKELETON = [
+    [16, 14], [14, 12], [17, 15], [15, 13], [12, 13], [6, 12], [7, 13], [6, 7], [6, 8], [7, 9],
+    [8, 10], [9, 11], [2, 3], [1, 2], [1, 3], [2, 4], [3, 5], [4, 6], [5, 7],
+]
+
+
+def keypoint_schema():
+    """Return (keypoint names, skeleton edges) for the annotated subject."""
+    return (
+        getattr(settings, 'KEYPOINT_NAMES', COCO_PERSON_KEYPOINTS),
+        getattr(settings, 'KEYPOINT_SKELETON', COCO_PERSON_SKELETON),
+    )
+
+
+def pack_keypoints(points, confidence, bbox):
+    points = np.asarray(points, dtype=DTYPE)
+    if points.size == 0:
+        points = points.reshape(0, 2)
+    if points.ndim != 2:
+        raise ValueError('points must be a list of coordinate lists')
+    confidence = np.asarray(confidence, dtype=DTYPE).ravel()
+    bbox = np.asarray(bbox, dtype=DTYPE).ravel()
+    header = HEADER.pack(MAGIC, SCHEMA_VERSION, points.shape[1], points.shape[0], confidence.size, bbox.size)
+    return header + points.tobytes() + confidence.tobytes() + bbox.tobytes()
+
+
+def unpack_keypoints(data):
+    """
+    Return (points, confidence, bbox) as read-only float32 arrays that share
+    memory with `data`.
+    """
+    magic, version, dims, n_points, n_confidence, n_bbox = HEADER.unpack_from(data)
+    if magic != MAGIC or version != SCHEMA_VERSION:
+        raise ValueError(f'Unsupported keypoint blob (magic={magic!r}, version={version})')
+    offset = HEADER.size
+    points = np.frombuffer(data, dtype=DTYPE, count=n_points * dims, offset=offset).reshape(n_points, dims)
+    offset += points.nbytes
+    confidence = np.frombuffer(data, dtype=DTYPE, count=n_confidence, offset=offset)
+    offset += confidence.nbytes
+    bbox = np.frombuffer(data, dtype=DTYPE, count=n_bbox, offset=offset)
+    return points, confidence, bbox
+
+
+def iter_keypoint_arrays(queryset, chunk_size=2000):
+    """
+    Yield (id, points, confidence, bbox) for each annotation in `queryset`,
+    reading only the packed column. Rows without a packed blob are skipped.
+    """
+    rows = queryset.exclude(packed=None).values_list('id', 'packed')
+    for pk, data in rows.iterator(chunk_size=chunk_size):
+        yield (pk,) + unpack_keypoints(data)
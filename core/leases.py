@@ -0,0 +1,93 @@
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .events import publish_on_commit
+from .models import Image
+from .viewcache import invalidate
+
+# SQLite has no row locks, so claims made from this process are serialized
+# here and the UPDATE below re-checks availability before taking a row.
+_claim_lock = threading.Lock()
+
+# Machine pre-labels still need a human pass, so they stay in the queue.
+QUEUE_STATUSES = ('unlabeled', 'machine_labeled')
+
+
+def lease_duration():
+    return timedelta(seconds=getattr(settings, 'IMAGE_LEASE_SECONDS', 1800))
+
+
+def available_images(now=None):
+    now = now or timezone.now()
+    return Image.objects.filter(status__in=QUEUE_STATUSES).filter(
+        Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now)
+    )
+
+
+def active_claims(user, now=None):
+    now = now or timezone.now()
+    return Image.objects.filter(
+        status__in=QUEUE_STATUSES, claimed_by=user, lease_expires_at__gt=now
+    ).order_by('uploaded_at', 'id')
+
+
+def _claim(user, candidates, count):
+    now = timezone.now()
+    expires = now + lease_duration()
+    with transaction.atomic():
+        candidates = candidates.order_by('uploaded_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('id', flat=True)[:count])
+        if not ids:
+            return []
+        available_images(now).filter(id__in=ids).update(
+            claimed_by=user, lease_expires_at=expires
+        )
+        publish_on_commit(['annotator'], 'image.claimed', ids=ids, user=user.id)
+        invalidate('image')
+    return list(
+        Image.objects.filter(id__in=ids, claimed_by=user, lease_expires_at=expires)
+        .order_by('uploaded_at', 'id')
+    )
+
+
+def claim_images(user, count):
+    """
+    Lease up to `count` unclaimed images to `user`, topping up any leases
+    they already hold. Returns the user's active claims.
+    """
+    with _claim_lock:
+        held = list(active_claims(user))
+        if len(held) < count:
+            held += _claim(user, available_images(), count - len(held))
+    return held
+
+
+def claim_image(user, image):
+    """
+    Lease a single image to `user`. Returns False if someone else holds an
+    active lease on it.
+    """
+    with _claim_lock:
+        if active_claims(user).filter(id=image.id).exists():
+            Image.objects.filter(id=image.id).update(
+                lease_expires_at=timezone.now() + lease_duration()
+            )
+            invalidate('image')
+            return True
+        return bool(_claim(user, available_images().filter(id=image.id), 1))
+
+
+def sweep_expired_leases():
+    swept = Image.objects.filter(lease_expires_at__lte=timezone.now()).update(
+        claimed_by=None, lease_expires_at=None
+    )
+    if swept:
+        invalidate('image')
+    return swept
@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bench import run_benchmark
+from core.models import Dataset
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent scripted annotator/verifier sessions against every URL and report latency as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--annotators', type=int, default=4)
+        parser.add_argument('--verifiers', type=int, default=2)
+        parser.add_argument('--iterations', type=int, default=10, help='Scripted rounds per session')
+        parser.add_argument('--duration', type=float, help='Run each session for this many seconds instead')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the report to this file')
+
+    def handle(self, *args, **options):
+        try:
+            report = run_benchmark(
+                annotators=options['annotators'],
+                verifiers=options['verifiers'],
+                iterations=options['iterations'],
+                duration=options['duration'],
+                seed=options['seed'],
+            )
+        except Dataset.DoesNotExist:
+            raise CommandError('No benchmark data; run generate_bench_data first.')
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.agreement import refresh_agreement
+from core.models import Image
+
+
+class Command(BaseCommand):
+    help = 'Compute inter-annotator agreement (OKS and bbox IoU) per image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', help='Only images in this Dataset (name)')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute images that already have a cached result')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        images = Image.objects.filter(keypointannotation__isnull=False).distinct()
+        if options['dataset']:
+            images = images.filter(dataset__name=options['dataset'])
+        if not options['all']:
+            images = images.filter(agreement__isnull=True)
+
+        started = time.monotonic()
+        done = 0
+        low = []
+        batch = []
+        for image_id in images.order_by('id').values_list('id', flat=True).iterator(chunk_size=options['batch_size']):
+            batch.append(image_id)
+            if len(batch) >= options['batch_size']:
+                done += self.process(batch, low)
+                batch = []
+        done += self.process(batch, low)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {done} images in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.0f} images/s)'
+        ))
+        for result in sorted(low, key=lambda r: r.mean_oks)[:20]:
+            self.stdout.write(f'  Image {result.image_id}: mean OKS {result.mean_oks:.3f} over {result.pair_count} pairs')
+
+    def process(self, image_ids, low):
+        if not image_ids:
+            return 0
+        results = refresh_agreement(image_ids)
+        low.extend(r for r in results if r.mean_oks is not None and r.mean_oks < 0.5)
+        low.sort(key=lambda r: r.mean_oks)
+        del low[20:]
+        return len(results)
@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.export import FORMATS, export_queryset, iter_export
+from core.models import Dataset
+
+
+class Command(BaseCommand):
+    help = 'Stream annotations out as COCO keypoints or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument('--status', default='verified',
+                            help="Annotation status to export, or '' for all")
+        parser.add_argument('--since', help='Only annotations created on/after this date')
+        parser.add_argument('--until', help='Only annotations created on/before this date')
+        parser.add_argument('--dataset', help='Dataset name or id')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', '-o', help='File to write to (default: stdout)')
+
+    def handle(self, *args, **options):
+        dataset = None
+        if options['dataset']:
+            lookup = {'id': options['dataset']} if options['dataset'].isdigit() else {'name': options['dataset']}
+            try:
+                dataset = Dataset.objects.get(**lookup)
+            except Dataset.DoesNotExist:
+                raise CommandError(f"Dataset {options['dataset']} does not exist")
+
+        try:
+            annotations = export_queryset(
+                status=options['status'],
+                since=options['since'],
+                until=options['until'],
+                dataset=dataset,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in iter_export(annotations, options['format'], options['gzip']):
+                out.write(chunk)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
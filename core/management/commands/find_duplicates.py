@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.imagemeta import DEFAULT_DISTANCE, MAX_DISTANCE, duplicate_pairs, similar_images
+from core.models import Image
+
+
+class Command(BaseCommand):
+    help = 'List near-duplicate images by perceptual hash, as JSON lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', type=int, help='Only list the duplicates of this image')
+        parser.add_argument('--distance', type=int, default=DEFAULT_DISTANCE,
+                            help=f'Maximum Hamming distance between hashes (0-{MAX_DISTANCE})')
+        parser.add_argument('--dataset', help='Only compare images in this Dataset (name)')
+
+    def handle(self, *args, **options):
+        distance = options['distance']
+        if not 0 <= distance <= MAX_DISTANCE:
+            raise CommandError(f'--distance must be between 0 and {MAX_DISTANCE}')
+
+        if options['image']:
+            try:
+                image = Image.objects.get(id=options['image'])
+            except Image.DoesNotExist:
+                raise CommandError(f'Image {options["image"]} does not exist')
+            if image.perceptual_hash is None:
+                raise CommandError(f'Image {image.id} has no perceptual hash; run index_images first')
+            for other, d in similar_images(image, distance):
+                self.stdout.write(json.dumps({'image': image.id, 'duplicate': other, 'distance': d}))
+            return
+
+        images = Image.objects.all()
+        if options['dataset']:
+            images = images.filter(dataset__name=options['dataset'])
+        count = 0
+        for a, b, d in duplicate_pairs(distance, images):
+            self.stdout.write(json.dumps({'image': a, 'duplicate': b, 'distance': d}))
+            count += 1
+        self.stderr.write(f'{count} near-duplicate pairs within distance {distance}')
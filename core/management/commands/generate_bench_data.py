@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.bench import clear_dataset, generate_dataset
+
+
+class Command(BaseCommand):
+    help = 'Bulk-create a reproducible synthetic dataset (users, images, annotations, comments) for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=10000)
+        parser.add_argument('--annotated', type=float, default=0.3, help='Fraction of images with a pending annotation')
+        parser.add_argument('--verified', type=float, default=0.3, help='Fraction of images with a verified annotation')
+        parser.add_argument('--annotations-per-image', type=int, default=1)
+        parser.add_argument('--comments', type=float, default=1.0, help='Mean comments per annotation')
+        parser.add_argument('--annotators', type=int, default=20)
+        parser.add_argument('--verifiers', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true', help='Delete the previous benchmark data first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            clear_dataset()
+        created = generate_dataset(
+            images=options['images'],
+            annotated=options['annotated'],
+            verified=options['verified'],
+            annotations_per_image=options['annotations_per_image'],
+            comments_per_annotation=options['comments'],
+            annotators=options['annotators'],
+            verifiers=options['verifiers'],
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            log=self.stderr.write if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(json.dumps(created))
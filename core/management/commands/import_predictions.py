@@ -0,0 +1,112 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.agreement import invalidate_agreement
+from core.counters import CountChanges, apply_changes
+from core.models import Image, KeypointAnnotation, User
+from core.predictions import iter_predictions
+from core.viewcache import invalidate
+
+
+class Command(BaseCommand):
+    help = 'Import model predictions as machine_labeled KeypointAnnotations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='COCO keypoints JSON or JSON Lines file')
+        parser.add_argument('--format', choices=('coco', 'jsonl'),
+                            help='Input format (guessed from the extension by default)')
+        parser.add_argument('--annotator', default='machine',
+                            help='Username the predictions are attributed to (created if missing)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['path']):
+            raise CommandError(f"{options['path']} does not exist")
+
+        annotator, created = User.objects.get_or_create(
+            username=options['annotator'], defaults={'user_type': 'annotator'}
+        )
+        if created:
+            annotator.set_unusable_password()
+            annotator.save(update_fields=['password'])
+
+        self.stdout.write('Building filename index...')
+        index = self.build_index()
+        image_ids = set(index.values())
+        already_labeled = set(
+            KeypointAnnotation.objects.filter(annotator=annotator).values_list('image_id', flat=True)
+        )
+
+        batch_size = options['batch_size']
+        notes = f"Imported from {os.path.basename(options['path'])}"
+        pending = []
+        imported = unmatched = skipped = 0
+        started = time.monotonic()
+
+        for key, points, confidence, bbox in iter_predictions(options['path'], options['format']):
+            if isinstance(key, int):
+                image_id = key if key in image_ids else None
+            else:
+                image_id = index.get(key) or index.get(os.path.basename(key or ''))
+            if image_id is None:
+                unmatched += 1
+                continue
+            if image_id in already_labeled:
+                skipped += 1
+                continue
+            already_labeled.add(image_id)
+
+            annotation = KeypointAnnotation(
+                image_id=image_id, annotator=annotator, points=points, confidence=confidence,
+                bbox=bbox, annotation_notes=notes,
+            )
+            annotation.pack()
+            pending.append(annotation)
+            if len(pending) >= batch_size:
+                imported += self.flush(pending)
+                pending = []
+                self.stdout.write(f'{imported} imported ({imported / (time.monotonic() - started):.0f}/s)')
+        imported += self.flush(pending)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} predictions in {time.monotonic() - started:.1f}s; '
+            f'{unmatched} did not match an image, {skipped} images already had predictions'
+        ))
+
+    def build_index(self):
+        index = {}
+        rows = Image.objects.values_list('id', 'file', 'original_name')
+        for pk, file_name, original_name in rows.iterator(chunk_size=10000):
+            for name in (file_name, original_name):
+                if name:
+                    index[name] = pk
+                    index.setdefault(os.path.basename(name), pk)
+        return index
+
+    def flush(self, annotations):
+        if not annotations:
+            return 0
+        image_ids = [annotation.image_id for annotation in annotations]
+        with transaction.atomic():
+            datasets = dict(Image.objects.filter(id__in=image_ids).values_list('id', 'dataset_id'))
+            # Images deleted since the index was built.
+            annotations = [annotation for annotation in annotations if annotation.image_id in datasets]
+            relabeled = list(
+                Image.objects.select_for_update().filter(id__in=image_ids, status='unlabeled')
+                .values_list('id', flat=True)
+            )
+            KeypointAnnotation.objects.bulk_create(annotations)
+            Image.objects.filter(id__in=relabeled).update(status='machine_labeled')
+            invalidate_agreement(image_ids)
+            invalidate('keypointannotation', 'image')
+
+            changes = CountChanges()
+            for annotation in annotations:
+                changes.add(datasets[annotation.image_id], 'annotation', annotation.status)
+            for image_id in relabeled:
+                changes.move(datasets[image_id], 'image', 'unlabeled', 'machine_labeled')
+            apply_changes(changes)
+        return len(annotations)
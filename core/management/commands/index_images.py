@@ -0,0 +1,69 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.imagemeta import image_metadata
+from core.models import Image
+
+METADATA_FIELDS = [
+    'content_hash', 'width', 'height', 'orientation', 'perceptual_hash', 'phash_0', 'phash_1', 'phash_2', 'phash_3',
+]
+
+
+def read_metadata(item):
+    image_id, path = item
+    try:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return image_id, {'content_hash': digest.hexdigest(), **image_metadata(path)}
+    except (OSError, ValueError):
+        return image_id, None
+
+
+class Command(BaseCommand):
+    help = 'Store content hashes, dimensions, EXIF orientation and perceptual hashes for images that have none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true', help='Recompute images that already have both hashes')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        indexed = 0
+        failed = set()
+        last_id = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                images = Image.objects.filter(id__gt=last_id)
+                if not options['all']:
+                    # Images from before content hashing have a perceptual
+                    # hash but no content hash.
+                    images = images.filter(Q(perceptual_hash=None) | Q(content_hash=''))
+                batch = list(images.order_by('id').only('id', 'file')[:options['batch_size']])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                by_id = {image.id: image for image in batch}
+                done = []
+                items = [(image.id, image.file.path) for image in batch]
+                for image_id, metadata in pool.map(read_metadata, items, chunksize=16):
+                    if metadata is None:
+                        failed.add(image_id)
+                        continue
+                    image = by_id[image_id]
+                    for field, value in metadata.items():
+                        setattr(image, field, value)
+                    done.append(image)
+                Image.objects.bulk_update(done, METADATA_FIELDS)
+                indexed += len(done)
+                self.stdout.write(f'Indexed {indexed} images ({indexed / (time.monotonic() - started):.1f} images/s)')
+        if failed:
+            self.stderr.write(f'Could not read {len(failed)} images, e.g. {sorted(failed)[:10]}')
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} images'))
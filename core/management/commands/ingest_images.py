@@ -0,0 +1,190 @@
+import hashlib
+import os
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.counters import CountChanges, apply_changes
+from core.imagemeta import image_metadata
+from core.models import Dataset, Image
+from core.viewcache import invalidate
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp'}
+CHUNK_SIZE = 1024 * 1024
+
+
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def read_metadata(path):
+    try:
+        return image_metadata(path)
+    except (OSError, ValueError):
+        return {}
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return path, digest.hexdigest(), read_metadata(path)
+
+
+class HashingReader:
+    """File-like wrapper that hashes bytes as they are read through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.digest.update(data)
+        return data
+
+
+class Command(BaseCommand):
+    help = 'Bulk-load images from a directory, zip or tar archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory, .zip or .tar[.gz|.bz2|.xz] to ingest')
+        parser.add_argument('--dataset', help='Name of the Dataset to attach the images to (created if missing)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Hashing processes used for directory sources')
+        parser.add_argument('--progress-every', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if not os.path.exists(source):
+            raise CommandError(f'{source} does not exist')
+
+        self.dataset = None
+        if options['dataset']:
+            self.dataset, _ = Dataset.objects.get_or_create(
+                name=options['dataset'], defaults={'file_path': os.path.abspath(source)}
+            )
+        self.batch_size = options['batch_size']
+        self.progress_every = options['progress_every']
+        self.seen = set(
+            Image.objects.exclude(content_hash='').values_list('content_hash', flat=True)
+        )
+        self.pending = []
+        self.created = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+
+        if os.path.isdir(source):
+            self.ingest_directory(source, options['workers'])
+        elif zipfile.is_zipfile(source):
+            self.ingest_zip(source)
+        elif tarfile.is_tarfile(source):
+            self.ingest_tar(source)
+        else:
+            raise CommandError(f'{source} is not a directory, zip or tar archive')
+
+        self.flush()
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f'Ingested {self.created} images, skipped {self.skipped} duplicates '
+            f'in {elapsed:.1f}s ({self.rate():.1f} files/s)'
+        ))
+
+    def ingest_directory(self, root, workers):
+        paths = (
+            os.path.join(dirpath, name)
+            for dirpath, _, names in os.walk(root)
+            for name in sorted(names)
+            if is_image_name(name)
+        )
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, digest, metadata in pool.map(hash_file, paths, chunksize=64):
+                if self.is_duplicate(digest):
+                    continue
+                with open(path, 'rb') as f:
+                    self.add(os.path.relpath(path, root), digest, f, metadata)
+
+    def ingest_zip(self, source):
+        # Archive members come out of a single decompression stream, so they
+        # are hashed while being copied instead of in the process pool.
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not is_image_name(info.filename):
+                    continue
+                with archive.open(info) as member:
+                    self.add_stream(info.filename, member)
+
+    def ingest_tar(self, source):
+        with tarfile.open(source, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile() or not is_image_name(member.name):
+                    continue
+                self.add_stream(member.name, archive.extractfile(member))
+
+    def is_duplicate(self, digest):
+        if digest in self.seen:
+            self.skipped += 1
+            self.report()
+            return True
+        self.seen.add(digest)
+        return False
+
+    def add_stream(self, name, fileobj):
+        reader = HashingReader(fileobj)
+        tmp_name = default_storage.save(f'images/.ingest{os.path.splitext(name)[1].lower()}', File(reader))
+        digest = reader.digest.hexdigest()
+        if self.is_duplicate(digest):
+            default_storage.delete(tmp_name)
+            return
+        final_name = self.storage_name(name, digest)
+        if default_storage.exists(final_name):
+            default_storage.delete(tmp_name)
+        else:
+            os.replace(default_storage.path(tmp_name), default_storage.path(final_name))
+        self.queue(final_name, digest, name, read_metadata(default_storage.path(final_name)))
+
+    def add(self, name, digest, fileobj, metadata):
+        final_name = self.storage_name(name, digest)
+        if not default_storage.exists(final_name):
+            final_name = default_storage.save(final_name, File(fileobj))
+        self.queue(final_name, digest, name, metadata)
+
+    def storage_name(self, name, digest):
+        return f'images/{digest}{os.path.splitext(name)[1].lower()}'
+
+    def queue(self, name, digest, original_name, metadata):
+        self.pending.append(Image(
+            file=name, content_hash=digest, original_name=original_name, dataset=self.dataset, **metadata
+        ))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        self.report()
+
+    def flush(self):
+        if not self.pending:
+            return
+        changes = CountChanges()
+        changes.add(self.dataset.id if self.dataset else None, 'image', 'unlabeled', len(self.pending))
+        with transaction.atomic():
+            Image.objects.bulk_create(self.pending, batch_size=self.batch_size)
+            apply_changes(changes)
+            invalidate('image')
+        self.created += len(self.pending)
+        self.pending = []
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.created + len(self.pending) + self.skipped) / elapsed if elapsed else 0.0
+
+    def report(self):
+        done = self.created + len(self.pending) + self.skipped
+        if self.progress_every and done % self.progress_every == 0:
+            self.stdout.write(f'{done} files processed, {self.skipped} duplicates ({self.rate():.1f} files/s)')
@@ -0,0 +1,52 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.derivatives import process_image_file
+from core.models import Image
+
+
+class Command(BaseCommand):
+    help = 'Generate renditions and tile pyramids for images that are not yet processed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep running and pick up new images as they arrive')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to sleep between polls in --watch mode')
+
+    def handle(self, *args, **options):
+        failed = set()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                batch = list(
+                    Image.objects.filter(processed=False).exclude(id__in=failed)
+                    .order_by('id')[:options['batch_size']]
+                )
+                if not batch:
+                    if not options['watch']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+
+                started = time.monotonic()
+                by_id = {image.id: image for image in batch}
+                done = []
+                items = [(image.id, image.file.path) for image in batch]
+                for image_id, size in pool.map(process_image_file, items):
+                    image = by_id[image_id]
+                    if size is None:
+                        failed.add(image_id)
+                        self.stderr.write(f'Could not process {image} ({image.file.name})')
+                        continue
+                    image.width, image.height = size
+                    image.processed = True
+                    done.append(image)
+                Image.objects.bulk_update(done, ['width', 'height', 'processed'])
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'Processed {len(done)} images ({len(done) / elapsed:.1f} images/s)')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.search import rebuild_index, uses_fts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text index over comments and annotation notes'
+
+    def handle(self, *args, **options):
+        if not uses_fts():
+            self.stdout.write('The database has no FTS5 index; search falls back to icontains.')
+            return
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-Dataset status counters from the Image and annotation tables'
+
+    def handle(self, *args, **options):
+        changes = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(changes)} status counters'))
@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import signal
+import socket
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.jobs import POLL_INTERVAL, work
+
+
+def _worker_main(name, stop, tasks, poll_interval, burst):
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        # Spawned rather than forked children start with no Django.
+        django.setup()
+    # Ctrl-C reaches the whole process group; let the parent decide when to
+    # stop so a job in progress can finish.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    work(name, stop, tasks, poll_interval, burst, lambda message: print(message, flush=True))
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue (see core.jobs) in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--tasks', nargs='+',
+                            help='Only run these task names, e.g. to give slow exports their own pool')
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                            help='Seconds an idle worker waits before looking for jobs again')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no job is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        stop = multiprocessing.Event()
+        previous = {signum: signal.signal(signum, lambda *args: stop.set()) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            if options['processes'] <= 1:
+                count = work(f'{socket.gethostname()}:{os.getpid()}', stop, options['tasks'],
+                             options['poll_interval'], options['burst'], self.stdout.write)
+                self.stdout.write(self.style.SUCCESS(f'Ran {count} jobs'))
+            else:
+                self.run_pool(stop, options)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def run_pool(self, stop, options):
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        # Children must open their own database connections.
+        connections.close_all()
+        workers = {}
+
+        def start(i):
+            process = multiprocessing.Process(
+                target=_worker_main, name=f'worker-{i}',
+                args=(f'{prefix}:{i}', stop, options['tasks'], options['poll_interval'], options['burst']),
+            )
+            process.start()
+            workers[i] = process
+
+        for i in range(options['processes']):
+            start(i)
+        self.stdout.write(f'Started {len(workers)} workers')
+        while workers:
+            stop.wait(1)
+            for i, process in list(workers.items()):
+                if process.is_alive():
+                    continue
+                del workers[i]
+                if process.exitcode and not stop.is_set():
+                    self.stderr.write(f'{process.name} exited with code {process.exitcode}; restarting it')
+                    start(i)
+            if stop.is_set():
+                for process in workers.values():
+                    process.join()
+                break
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
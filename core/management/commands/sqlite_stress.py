@@ -0,0 +1,18 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.stress import run_stress
+
+
+class Command(BaseCommand):
+    help = 'Measure annotation write throughput and lock errors under concurrent writers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=30)
+        parser.add_argument('--submissions', type=int, default=20, help='Annotations per writer')
+        parser.add_argument('--queue', action='store_true', help='Submit through the in-process write queue')
+
+    def handle(self, *args, **options):
+        result = run_stress(options['writers'], options['submissions'], use_queue=options['queue'])
+        self.stdout.write(json.dumps(result))
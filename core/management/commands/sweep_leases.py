@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.leases import sweep_expired_leases
+
+
+class Command(BaseCommand):
+    help = 'Release image claims whose lease has expired'
+
+    def handle(self, *args, **options):
+        released = sweep_expired_leases()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired leases'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.uploads import sweep_stale_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable uploads that have been idle for longer than UPLOAD_EXPIRY_SECONDS'
+
+    def handle(self, *args, **options):
+        deleted = sweep_stale_uploads()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} stale uploads'))
@@ -0,0 +1,167 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .derivatives import is_derivative
+from .models import Image
+from .overlays import is_overlay
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+mimetypes.add_type('application/xml', '.dzi')
+
+
+def media_path(name):
+    """Absolute path of media file `name`, or Http404 if it is outside MEDIA_ROOT, hidden or missing."""
+    # Hidden directories hold work in progress, e.g. partial uploads.
+    if any(part.startswith('.') for part in name.split('/')):
+        raise Http404
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(path):
+        raise Http404
+    return path
+
+
+def file_validators(name, stat):
+    """
+    Return (etag, immutable) for media file `name`. Originals of Images with
+    a content hash get that hash as a strong ETag and are immutable (storage
+    never overwrites a name). Anything else, e.g. renditions and tiles that
+    are regenerated in place, gets an mtime/size ETag and is revalidated.
+    """
+    if not is_derivative(name) and not is_overlay(name):
+        content_hash = Image.objects.filter(file=name).exclude(content_hash='').values_list('content_hash', flat=True).first()
+        if content_hash:
+            return quote_etag(content_hash), True
+    return quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}'), False
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range `Range` header into (start, end) inclusive.
+    Returns None when the header should be ignored (absent, malformed or
+    multi-range, which are answered with the whole file) and raises
+    ValueError when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if not length:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def iter_file_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _offload(path, name, content_type):
+    mode = settings.MEDIA_SENDFILE
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + name.lstrip('/')
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = path
+    else:
+        raise ValueError(f'Unknown MEDIA_SENDFILE mode {mode!r}')
+    return response
+
+
+# Compressed files are served as what they are, like FileResponse does: a
+# Content-Encoding would make clients unpack them (and ranges would count
+# compressed bytes).
+ENCODED_TYPES = {
+    'bzip2': 'application/x-bzip',
+    'gzip': 'application/gzip',
+    'xz': 'application/x-xz',
+}
+
+
+def content_type_for(path):
+    content_type, encoding = mimetypes.guess_type(path)
+    return ENCODED_TYPES.get(encoding, content_type or 'application/octet-stream')
+
+
+def serve(request, name):
+    """
+    Return a response for media file `name` with validators, caching headers
+    and single-range support, or hand the transfer to the front proxy when
+    MEDIA_SENDFILE is set.
+    """
+    path = media_path(name)
+    stat = os.stat(path)
+    etag, immutable = file_validators(name, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': (
+            f'private, max-age={IMMUTABLE_MAX_AGE}, immutable' if immutable
+            else f'private, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+        ),
+    }
+
+    content_type = content_type_for(path)
+
+    # Whole seconds, as in the Last-Modified header it is compared with.
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None and settings.MEDIA_SENDFILE:
+        # The proxy handles Range itself when it sends the file.
+        response = _offload(path, name, content_type)
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    size = stat.st_size
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag or parse_http_date_safe(if_range) == int(stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(iter_file_range(path, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    for header, value in headers.items():
+        response[header] = value
+    return response
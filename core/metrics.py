@@ -0,0 +1,154 @@
+import contextvars
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+
+import numpy as np
+from django.db import DEFAULT_DB_ALIAS, connections
+
+WINDOW = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+SERIES = (
+    ('request_duration_seconds', 'Wall time spent in the view and middleware below it'),
+    ('db_duration_seconds', 'Time spent executing SQL'),
+    ('db_queries', 'Number of SQL queries'),
+    ('template_duration_seconds', 'Time spent rendering templates'),
+)
+
+
+class RequestTimer:
+    __slots__ = ('queries', 'db_time', 'template_time', 'template_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Called by time_query for each query of the request
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+current_timer = contextvars.ContextVar('current_timer', default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(sender=None, connection=None, **kwargs):
+    """
+    Make `connection` (default: this thread's) report its queries to the
+    current_timer of whichever request runs them. Connections belong to a
+    thread while the timer follows the request's context, so this also
+    covers queries an async request runs through sync_to_async. Used as a
+    connection_created receiver too; idempotent.
+    """
+    connection = connection or connections[DEFAULT_DB_ALIAS]
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def timed_template_render(render):
+    """Wrap Template.render to add the outermost render time to the current timer."""
+    @wraps(render)
+    def wrap(self, context):
+        timer = current_timer.get()
+        if timer is None:
+            return render(self, context)
+        timer.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            timer.template_depth -= 1
+            if not timer.template_depth:
+                timer.template_time += time.perf_counter() - start
+    wrap.timed = True
+    return wrap
+
+
+class ViewStats:
+    """Rolling window of recent samples plus all-time count and sums."""
+
+    def __init__(self):
+        self.samples = {name: deque(maxlen=WINDOW) for name, _ in SERIES}
+        self.sums = defaultdict(float)
+        self.count = 0
+
+    def add(self, values):
+        self.count += 1
+        for name, value in values.items():
+            self.samples[name].append(value)
+            self.sums[name] += value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = defaultdict(ViewStats)
+        self.cache_lookups = defaultdict(int)
+
+    def observe(self, view, wall, timer):
+        values = {
+            'request_duration_seconds': wall,
+            'db_duration_seconds': timer.db_time,
+            'db_queries': timer.queries,
+            'template_duration_seconds': timer.template_time,
+        }
+        with self.lock:
+            self.views[view].add(values)
+
+    def count_cache(self, name, hit):
+        with self.lock:
+            self.cache_lookups[name, 'hit' if hit else 'miss'] += 1
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+            self.cache_lookups.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                view: (stats.count, dict(stats.sums), {name: list(values) for name, values in stats.samples.items()})
+                for view, stats in self.views.items()
+            }
+
+    def cache_snapshot(self):
+        with self.lock:
+            return dict(self.cache_lookups)
+
+    def render_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, description in SERIES:
+            metric = f'annotations_{name}'
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} summary')
+            for view, (count, sums, samples) in sorted(snapshot.items()):
+                label = view.replace('\\', '\\\\').replace('"', '\\"')
+                if samples[name]:
+                    for q, value in zip(QUANTILES, np.quantile(samples[name], QUANTILES)):
+                        lines.append(f'{metric}{{view="{label}",quantile="{q}"}} {value:.6g}')
+                lines.append(f'{metric}_sum{{view="{label}"}} {sums.get(name, 0.0):.6g}')
+                lines.append(f'{metric}_count{{view="{label}"}} {count}')
+        lookups = sorted(self.cache_snapshot().items())
+        lines.append('# HELP annotations_view_cache_lookups_total View cache lookups by result')
+        lines.append('# TYPE annotations_view_cache_lookups_total counter')
+        for (name, result), count in lookups:
+            lines.append(f'annotations_view_cache_lookups_total{{name="{name}",result="{result}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
@@ -1,19 +1,103 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
 from django.shortcuts import redirect
-from django.urls import reverse
+from django.template.base import Template
+
+from .roles import get_role, home_url
+from .metrics import RequestTimer, current_timer, install_query_timer, registry, timed_template_render
 
 class RoleBasedRedirectMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        if request.user.is_authenticated and request.path == '/':
-            if request.user.user_type == 'viewer':
-                return redirect(reverse('view_annotations'))
-            elif request.user.user_type == 'annotator':
-                return redirect(reverse('annotator_dashboard'))
-            elif request.user.user_type == 'verifier':
-                return redirect(reverse('verifier_dashboard'))
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Check the path first so other requests never touch request.user here.
+        if request.path == '/' and request.user.is_authenticated:
+            return redirect(home_url(request))
 
         response = self.get_response(request)
         return response
 
+    async def __acall__(self, request):
+        # get_role may load the user and session from the database.
+        if request.path == '/' and await sync_to_async(get_role)(request):
+            return redirect(home_url(request))
+        return await self.get_response(request)
+
+
+class PerformanceMiddleware:
+    """
+    Record wall time, SQL query count/time and template render time for a
+    sample of requests. Adds a Server-Timing header and feeds the rolling
+    per-view stats served by the metrics view. PERF_SAMPLE_RATE (0-1)
+    controls the sampled fraction; unsampled requests pay one random().
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.sample_rate = getattr(settings, 'PERF_SAMPLE_RATE', 1.0)
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        if not getattr(Template.render, 'timed', False):
+            Template.render = timed_template_render(Template.render)
+        connection_created.connect(install_query_timer, dispatch_uid='core.metrics.install_query_timer')
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        install_query_timer()
+        timer = RequestTimer()
+        token = current_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.record(request, response, time.perf_counter() - start, timer)
+
+    async def __acall__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        # The request's sync code runs in its own thread, whose connection
+        # may predate the connection_created receiver.
+        await sync_to_async(install_query_timer)()
+        timer = RequestTimer()
+        token = current_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.record(request, response, time.perf_counter() - start, timer)
+
+    def record(self, request, response, wall, timer):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name or match._func_path) if match else 'unresolved'
+        registry.observe(view, wall, timer)
+
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={wall * 1000:.1f}',
+            f'db;dur={timer.db_time * 1000:.1f};desc="{timer.queries} queries"',
+            f'tpl;dur={timer.template_time * 1000:.1f}',
+        ])
+        return response
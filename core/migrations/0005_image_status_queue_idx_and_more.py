@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_rename_user_comment_author_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['status', 'uploaded_at', 'id'], name='image_status_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='keypointannotation',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='annotation_status_queue_idx'),
+        ),
+    ]
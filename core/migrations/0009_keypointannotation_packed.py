@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:18
+
+import struct
+
+import numpy as np
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+# Frozen copy of core.keypoints.pack_keypoints at schema version 1, so that
+# later changes there do not alter what this migration writes.
+MAGIC = b'KP'
+SCHEMA_VERSION = 1
+HEADER = struct.Struct('<2sBBIII')
+DTYPE = np.dtype('<f4')
+
+
+def pack_keypoints(points, confidence, bbox):
+    points = np.asarray(points, dtype=DTYPE)
+    if points.size == 0:
+        points = points.reshape(0, 2)
+    if points.ndim != 2:
+        raise ValueError('points must be a list of coordinate lists')
+    confidence = np.asarray(confidence, dtype=DTYPE).ravel()
+    bbox = np.asarray(bbox, dtype=DTYPE).ravel()
+    header = HEADER.pack(MAGIC, SCHEMA_VERSION, points.shape[1], points.shape[0], confidence.size, bbox.size)
+    return header + points.tobytes() + confidence.tobytes() + bbox.tobytes()
+
+
+def pack_existing_annotations(apps, schema_editor):
+    KeypointAnnotation = apps.get_model('core', 'KeypointAnnotation')
+    batch = []
+    rows = KeypointAnnotation.objects.only('id', 'points', 'confidence', 'bbox').order_by('id')
+    for annotation in rows.iterator(chunk_size=BATCH_SIZE):
+        try:
+            annotation.packed = pack_keypoints(annotation.points, annotation.confidence, annotation.bbox)
+        except (TypeError, ValueError):
+            continue
+        batch.append(annotation)
+        if len(batch) >= BATCH_SIZE:
+            KeypointAnnotation.objects.bulk_update(batch, ['packed'])
+            batch = []
+    KeypointAnnotation.objects.bulk_update(batch, ['packed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_image_width_image_height'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keypointannotation',
+            name='packed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(pack_existing_annotations, migrations.RunPython.noop),
+    ]
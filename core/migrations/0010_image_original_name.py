@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_keypointannotation_packed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='original_name',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_image_original_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageAgreement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('annotation_count', models.PositiveIntegerField()),
+                ('pair_count', models.PositiveIntegerField()),
+                ('mean_oks', models.FloatField(blank=True, null=True)),
+                ('min_oks', models.FloatField(blank=True, null=True)),
+                ('mean_iou', models.FloatField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='agreement', to='core.image')),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_status_counts(apps, schema_editor):
+    Image = apps.get_model('core', 'Image')
+    KeypointAnnotation = apps.get_model('core', 'KeypointAnnotation')
+    StatusCount = apps.get_model('core', 'StatusCount')
+    counts = [
+        StatusCount(dataset_id=row['dataset_id'], kind='image', status=row['status'], count=row['n'])
+        for row in Image.objects.values('dataset_id', 'status').annotate(n=Count('id')).order_by()
+    ]
+    counts += [
+        StatusCount(dataset_id=row['image__dataset_id'], kind='annotation', status=row['status'], count=row['n'])
+        for row in KeypointAnnotation.objects.values('image__dataset_id', 'status').annotate(n=Count('id')).order_by()
+    ]
+    StatusCount.objects.bulk_create(counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_imageagreement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('image', 'Image'), ('annotation', 'Annotation')], max_length=10)),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.BigIntegerField(default=0)),
+                ('dataset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='status_counts', to='core.dataset')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dataset', 'kind', 'status'), name='status_count_unique'), models.UniqueConstraint(condition=models.Q(('dataset__isnull', True)), fields=('kind', 'status'), name='status_count_unique_no_dataset')],
+            },
+        ),
+        migrations.RunPython(build_status_counts, migrations.RunPython.noop),
+    ]
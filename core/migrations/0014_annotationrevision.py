@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_image_file_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='keypointannotation',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='AnnotationRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('snapshot', 'Snapshot'), ('delta', 'Delta')], max_length=10)),
+                ('data', models.BinaryField()),
+                ('status', models.CharField(max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('annotation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='core.keypointannotation')),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='annotation_revisions', to=settings.AUTH_USER_MODEL)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='annotation_revisions', to='core.image')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['image', 'annotation', 'number'], name='revision_image_history_idx')],
+                'constraints': [models.UniqueConstraint(fields=('annotation', 'number'), name='annotation_revision_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,78 @@
+from django.db import migrations
+
+# Frozen copy of the full-text index as first installed; later changes to
+# core.search must not alter what this migration creates. On SQLite it is
+# an FTS5 table over Comment.text and KeypointAnnotation.annotation_notes,
+# kept in sync by triggers.
+TABLE = 'core_search'
+
+CREATE_SQL = [
+    f"""CREATE VIRTUAL TABLE {TABLE} USING fts5(
+        body, annotation_id UNINDEXED,
+        tokenize = 'porter unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER core_search_comment_insert AFTER INSERT ON core_comment BEGIN
+        INSERT INTO {TABLE}(rowid, body, annotation_id) VALUES (new.id * 2, new.text, new.annotation_id);
+    END""",
+    f"""CREATE TRIGGER core_search_comment_update AFTER UPDATE OF text, annotation_id ON core_comment BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id * 2;
+        INSERT INTO {TABLE}(rowid, body, annotation_id) VALUES (new.id * 2, new.text, new.annotation_id);
+    END""",
+    f"""CREATE TRIGGER core_search_comment_delete AFTER DELETE ON core_comment BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id * 2;
+    END""",
+    f"""CREATE TRIGGER core_search_notes_insert AFTER INSERT ON core_keypointannotation
+    WHEN coalesce(new.annotation_notes, '') != '' BEGIN
+        INSERT INTO {TABLE}(rowid, body, annotation_id) VALUES (new.id * 2 + 1, new.annotation_notes, new.id);
+    END""",
+    f"""CREATE TRIGGER core_search_notes_update AFTER UPDATE OF annotation_notes ON core_keypointannotation BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id * 2 + 1;
+        INSERT INTO {TABLE}(rowid, body, annotation_id)
+            SELECT new.id * 2 + 1, new.annotation_notes, new.id WHERE coalesce(new.annotation_notes, '') != '';
+    END""",
+    f"""CREATE TRIGGER core_search_notes_delete AFTER DELETE ON core_keypointannotation BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS core_search_comment_insert',
+    'DROP TRIGGER IF EXISTS core_search_comment_update',
+    'DROP TRIGGER IF EXISTS core_search_comment_delete',
+    'DROP TRIGGER IF EXISTS core_search_notes_insert',
+    'DROP TRIGGER IF EXISTS core_search_notes_update',
+    'DROP TRIGGER IF EXISTS core_search_notes_delete',
+    f'DROP TABLE IF EXISTS {TABLE}',
+]
+
+REBUILD_SQL = [
+    f'DELETE FROM {TABLE}',
+    f'INSERT INTO {TABLE}(rowid, body, annotation_id) SELECT id * 2, text, annotation_id FROM core_comment',
+    f"""INSERT INTO {TABLE}(rowid, body, annotation_id)
+        SELECT id * 2 + 1, annotation_notes, id FROM core_keypointannotation
+        WHERE coalesce(annotation_notes, '') != ''""",
+    f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')",
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in CREATE_SQL + REBUILD_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_annotationrevision'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
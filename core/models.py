@@ -1,6 +1,16 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.urls import reverse
+from django.utils import timezone
+
+import numpy as np
+
+from .derivatives import dzi_name, rendition_name
+from .keypoints import DTYPE, pack_keypoints, unpack_keypoints
 
 class User(AbstractUser):
     USER_TYPES = (
@@ -15,6 +25,9 @@ class Dataset(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     file_path = models.CharField(max_length=500)
 
+    def __str__(self):
+        return self.name
+
 # class Image(models.Model):
 #     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE)
 #     file_path = models.CharField(max_length=500)
@@ -45,19 +58,56 @@ class Dataset(models.Model):
 
 
 class Image(models.Model):
-    file = models.ImageField(upload_to='images/')
+    dataset = models.ForeignKey(Dataset, on_delete=models.SET_NULL, null=True, blank=True, related_name='images')
+    file = models.ImageField(upload_to='images/', db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    original_name = models.CharField(max_length=500, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     processed = models.BooleanField(default=False)
+    # Upright size, i.e. after applying the EXIF orientation.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    orientation = models.PositiveSmallIntegerField(default=1)  # EXIF orientation, 1-8
+    # 64-bit dHash and its four 16-bit bands for near-duplicate lookup, see core.imagemeta
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    phash_0 = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    phash_1 = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    phash_2 = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    phash_3 = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
     status = models.CharField(max_length=20, choices=[
         ('unlabeled', 'Unlabeled'),
         ('machine_labeled', 'Machine Labeled'),
         ('annotated', 'Annotated'),
         ('verified', 'Verified')
     ], default='unlabeled')
+    claimed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='claimed_images')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'uploaded_at', 'id'], name='image_status_queue_idx'),
+        ]
 
     def __str__(self):
         return f"Image {self.id}"
 
+    def rendition_url(self, size):
+        if not self.processed:
+            return reverse('image_rendition', args=[self.id, size])
+        return self.file.storage.url(rendition_name(self.file.name, size))
+
+    @property
+    def thumbnail_url(self):
+        return self.rendition_url('thumb')
+
+    @property
+    def preview_url(self):
+        return self.rendition_url('preview')
+
+    @property
+    def dzi_url(self):
+        return self.file.storage.url(dzi_name(self.file.name)) if self.processed else None
+
 class KeypointAnnotation(models.Model):
     image = models.ForeignKey(Image, on_delete=models.CASCADE)
     annotator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='annotations')
@@ -72,10 +122,65 @@ class KeypointAnnotation(models.Model):
         ('rejected', 'Rejected')
     ], default='pending')
     annotation_notes = models.TextField(blank=True, null=True)  # Renamed from 'comments'
-    
+    # float32 copy of points/confidence/bbox, see core.keypoints
+    packed = models.BinaryField(null=True, blank=True, editable=False)
+    # Number of the latest AnnotationRevision, 0 if none recorded yet
+    revision = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at', 'id'], name='annotation_status_queue_idx'),
+        ]
+
     def __str__(self):
         return f"Annotation for Image {self.image.id}"
 
+    def save(self, *args, **kwargs):
+        self.pack()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'points', 'confidence', 'bbox'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'packed'}
+        super().save(*args, **kwargs)
+
+    def pack(self):
+        try:
+            self.packed = pack_keypoints(self.points, self.confidence, self.bbox)
+        except (TypeError, ValueError):
+            self.packed = None
+
+    def _arrays(self):
+        if self.packed is not None:
+            return unpack_keypoints(self.packed)
+        return (
+            np.asarray(self.points, dtype=DTYPE),
+            np.asarray(self.confidence, dtype=DTYPE),
+            np.asarray(self.bbox, dtype=DTYPE),
+        )
+
+    @property
+    def points_array(self):
+        return self._arrays()[0]
+
+    @property
+    def confidence_array(self):
+        return self._arrays()[1]
+
+    @property
+    def bbox_array(self):
+        return self._arrays()[2]
+
+    def overlay_url(self, size):
+        # The revision busts browser caches when the annotation changes.
+        return f"{reverse('annotation_overlay', args=[self.id, size])}?v={self.revision}"
+
+    @property
+    def overlay_thumbnail_url(self):
+        return self.overlay_url('thumb')
+
+    @property
+    def overlay_preview_url(self):
+        return self.overlay_url('preview')
+
 class Comment(models.Model):
     annotation = models.ForeignKey(KeypointAnnotation, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -85,3 +190,136 @@ class Comment(models.Model):
     def __str__(self):
         return f"Comment by {self.author.username} on Annotation {self.annotation.id}"
 
+
+
+class AnnotationRevision(models.Model):
+    """
+    One entry in the append-only history of a KeypointAnnotation: either a
+    full packed snapshot of its keypoints or a delta against the previous
+    revision, see core.revisions.
+    """
+    KINDS = (
+        ('snapshot', 'Snapshot'),
+        ('delta', 'Delta'),
+    )
+    annotation = models.ForeignKey(KeypointAnnotation, on_delete=models.CASCADE, related_name='revisions')
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='annotation_revisions')
+    number = models.PositiveIntegerField()
+    kind = models.CharField(max_length=10, choices=KINDS)
+    data = models.BinaryField()
+    status = models.CharField(max_length=20)
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='annotation_revisions')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['annotation', 'number'], name='annotation_revision_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['image', 'annotation', 'number'], name='revision_image_history_idx'),
+        ]
+
+    def __str__(self):
+        return f"Revision {self.number} of Annotation {self.annotation_id}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Annotation revisions are append-only')
+        super().save(*args, **kwargs)
+
+
+class ImageAgreement(models.Model):
+    """Cached inter-annotator agreement for an image, see core.agreement."""
+    image = models.OneToOneField(Image, on_delete=models.CASCADE, related_name='agreement')
+    annotation_count = models.PositiveIntegerField()
+    pair_count = models.PositiveIntegerField()
+    mean_oks = models.FloatField(null=True, blank=True)
+    min_oks = models.FloatField(null=True, blank=True)
+    mean_iou = models.FloatField(null=True, blank=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Agreement for Image {self.image_id}"
+
+
+class StatusCount(models.Model):
+    """
+    Denormalized number of images/annotations per (Dataset, status), kept up
+    to date by core.counters. dataset is null for items outside any Dataset.
+    """
+    KINDS = (
+        ('image', 'Image'),
+        ('annotation', 'Annotation'),
+    )
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, null=True, blank=True, related_name='status_counts')
+    kind = models.CharField(max_length=10, choices=KINDS)
+    status = models.CharField(max_length=20)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dataset', 'kind', 'status'], name='status_count_unique'),
+            models.UniqueConstraint(
+                fields=['kind', 'status'], condition=models.Q(dataset__isnull=True),
+                name='status_count_unique_no_dataset',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dataset or 'No dataset'}: {self.count} {self.status} {self.kind}s"
+
+
+class Job(models.Model):
+    """
+    A unit of background work for `manage.py run_workers`: a registered task
+    name, its keyword arguments and, once run, its result or error. See
+    core.jobs.
+    """
+    STATUSES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+    task = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    # While running: when the job is considered lost and handed out again.
+    locked_until = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_after', 'id'], name='job_queue_idx'),
+            models.Index(fields=['status', 'locked_until'], name='job_lock_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.task}, {self.status})"
+
+
+class Upload(models.Model):
+    """
+    A resumable chunked upload in progress. The bytes received so far live
+    in a partial file whose size is the upload offset, see core.uploads.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    filename = models.CharField(max_length=500)
+    size = models.BigIntegerField()
+    dataset = models.ForeignKey(Dataset, on_delete=models.SET_NULL, null=True, blank=True)
+    image = models.OneToOneField(Image, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.filename})"
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from PIL import Image as PILImage, ImageDraw, ImageOps
+
+from .derivatives import JPEG_QUALITY, RENDITIONS, rendition_name
+
+# Rendered overlays live under MEDIA_ROOT so they are served (and offloaded
+# to the proxy) like other media. Names carry the annotation revision, so a
+# changed annotation simply gets a new file and the old one ages out.
+OVERLAY_DIR = 'overlays'
+
+STATUS_COLORS = {
+    'pending': (245, 158, 11),
+    'verified': (22, 163, 74),
+    'rejected': (220, 38, 38),
+}
+POINT_COLOR = (239, 68, 68)
+LOW_CONFIDENCE_COLOR = (250, 204, 21)
+LOW_CONFIDENCE = 0.5
+
+# Least recently used overlays are removed once the directory grows past
+# OVERLAY_CACHE_BYTES, down to PRUNE_TO of it. Reads refresh a file's atime
+# (at most every TOUCH_INTERVAL seconds), which is what recency is based on.
+PRUNE_TO = 0.9
+TOUCH_INTERVAL = 60
+PRUNE_INTERVAL = 30
+
+_prune_lock = threading.Lock()
+_written = 0
+_last_prune = 0.0
+
+
+def overlay_name(annotation_id, revision, size):
+    return f'{OVERLAY_DIR}/{annotation_id // 1000}/{annotation_id}/{revision}_{size}.jpg'
+
+
+def is_overlay(name):
+    return name.startswith(OVERLAY_DIR + '/')
+
+
+def cache_budget():
+    return getattr(settings, 'OVERLAY_CACHE_BYTES', 512 * 1024 * 1024)
+
+
+def _base_image(image, size):
+    """The image downscaled to `size`, and the factor from original pixels to it."""
+    edge = RENDITIONS[size]
+    path = image.file.path
+    if image.processed and image.width:
+        try:
+            base = PILImage.open(rendition_name(path, size))
+            base.load()
+            return base.convert('RGB'), base.width / image.width
+        except OSError:
+            pass
+    with PILImage.open(path) as original:
+        # Points are in upright pixels; orientations 5-8 swap the axes.
+        width = original.height if original.getexif().get(0x0112, 1) in (5, 6, 7, 8) else original.width
+        # Lets the JPEG decoder do most of the downscaling.
+        original.draft('RGB', (edge, edge))
+        base = ImageOps.exif_transpose(original).convert('RGB')
+    base.thumbnail((edge, edge), PILImage.LANCZOS)
+    return base, base.width / width
+
+
+def render_overlay(annotation, size):
+    """
+    Draw `annotation`'s bbox (coloured by status) and keypoints onto the
+    `size` rendition of its image and return the Pillow image.
+    """
+    base, scale = _base_image(annotation.image, size)
+    points, confidence, bbox = annotation._arrays()
+    draw = ImageDraw.Draw(base)
+    line = max(1, round(max(base.size) / 400))
+    radius = max(2, round(max(base.size) / 200))
+
+    if bbox.size == 4 and np.isfinite(bbox).all():
+        x0, y0, x1, y1 = (bbox * scale).tolist()
+        draw.rectangle(
+            (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)),
+            outline=STATUS_COLORS.get(annotation.status, POINT_COLOR), width=line,
+        )
+
+    if points.size:
+        xy = points[:, :2] * scale
+        visible = np.isfinite(xy).all(axis=1)
+        if confidence.size == len(points):
+            visible &= confidence > 0
+            low = confidence < LOW_CONFIDENCE
+        else:
+            low = np.zeros(len(points), dtype=bool)
+        for (x, y), is_low in zip(xy[visible].tolist(), low[visible].tolist()):
+            draw.ellipse(
+                (x - radius, y - radius, x + radius, y + radius),
+                fill=LOW_CONFIDENCE_COLOR if is_low else POINT_COLOR, outline=(255, 255, 255),
+            )
+    return base
+
+
+def get_overlay(annotation, size):
+    """
+    Return the media name of the `size` overlay for the current revision of
+    `annotation` (with its image selected), rendering it on a cache miss.
+    """
+    name = overlay_name(annotation.id, annotation.revision, size)
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _write(render_overlay(annotation, size), path, f'_{size}.jpg')
+        return name
+    now = time.time()
+    if stat.st_atime < now - TOUCH_INTERVAL:
+        # Sets atime only: the mtime-based ETag must not change.
+        os.utime(path, (now, stat.st_mtime))
+    return name
+
+
+def _write(overlay, path, suffix):
+    global _written
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Older revisions of this annotation will not be asked for again.
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix) and entry.path != path:
+            _remove(entry.path)
+    # Concurrent renders of the same overlay each write a whole file and the
+    # last rename wins.
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    overlay.save(tmp, 'JPEG', quality=JPEG_QUALITY)
+    os.replace(tmp, path)
+    with _prune_lock:
+        _written += os.path.getsize(path)
+        due = _written > cache_budget() * (1 - PRUNE_TO) or time.monotonic() - _last_prune > PRUNE_INTERVAL
+    if due:
+        prune()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def prune(budget=None):
+    """
+    Remove least recently used overlays until the cache is within `budget`
+    bytes (OVERLAY_CACHE_BYTES by default). Returns (files removed, bytes freed).
+    """
+    global _written, _last_prune
+    budget = cache_budget() if budget is None else budget
+    with _prune_lock:
+        _written, _last_prune = 0, time.monotonic()
+    files = []
+    total = 0
+    for root, dirs, names in os.walk(os.path.join(settings.MEDIA_ROOT, OVERLAY_DIR)):
+        for filename in names:
+            try:
+                stat = os.stat(os.path.join(root, filename))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_atime, stat.st_size, os.path.join(root, filename)))
+            total += stat.st_size
+    if total <= budget:
+        return 0, 0
+    files.sort()
+    removed = freed = 0
+    for atime, size, path in files:
+        if total - freed <= budget * PRUNE_TO:
+            break
+        _remove(path)
+        removed += 1
+        freed += size
+    return removed, freed
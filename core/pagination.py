@@ -0,0 +1,52 @@
+import base64
+import binascii
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+PAGE_SIZE = 50
+
+KeysetPage = namedtuple('KeysetPage', ['object_list', 'next_cursor'])
+
+
+def encode_cursor(timestamp, pk):
+    raw = f'{timestamp.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the (timestamp, pk) in `cursor`, or raise ValueError if it is not one encode_cursor made."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, pk = raw.rsplit('|', 1)
+        timestamp, pk = parse_datetime(timestamp), int(pk)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise ValueError('Invalid cursor.')
+    if timestamp is None or (settings.USE_TZ and timezone.is_naive(timestamp)) or not 0 <= pk < 2 ** 63:
+        raise ValueError('Invalid cursor.')
+    return timestamp, pk
+
+
+def keyset_paginate(queryset, cursor, field, page_size=PAGE_SIZE):
+    """
+    Return one page of `queryset` ordered by (`field`, id), starting after
+    the position encoded in `cursor`. Unlike OFFSET paging, the cost of a
+    page does not depend on how deep into the list it is. Raises ValueError
+    for a cursor that decode_cursor() rejects.
+    """
+    queryset = queryset.order_by(field, 'id')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': pk})
+        )
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].id)
+    return KeysetPage(rows, next_cursor)
@@ -0,0 +1,142 @@
+import json
+import os
+
+READ_SIZE = 1024 * 1024
+WHITESPACE = ' \t\r\n'
+
+
+class JSONStream:
+    """
+    Minimal incremental reader over a JSON document: walks the top-level
+    object and yields the elements of its arrays one at a time, so files
+    much larger than memory can be processed.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(READ_SIZE)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r} at offset {self.pos}')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Probably cut off mid-value; read more and retry.
+                if not self._fill():
+                    raise
+                continue
+            if end == len(self.buffer) and self._fill():
+                # A number at the end of the buffer may continue in the next chunk.
+                continue
+            self.pos = end
+            return value
+
+    def array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'Expected , or ] at offset {self.pos}')
+
+    def top_level_array(self, key):
+        """Yield the elements of the top-level `key` array, skipping others."""
+        self.expect('{')
+        while self.peek() != '}':
+            name = self.value()
+            self.expect(':')
+            if self.peek() == '[':
+                for item in self.array():
+                    if name == key:
+                        yield item
+                if name == key:
+                    return
+            else:
+                self.value()
+            if self.peek() == ',':
+                self.pos += 1
+
+
+def iter_coco_array(path, key):
+    with open(path) as f:
+        yield from JSONStream(f).top_level_array(key)
+
+
+def _from_coco_keypoints(flat, scores=None):
+    triples = [flat[i:i + 3] for i in range(0, len(flat), 3)]
+    points = [[x, y] for x, y, _ in triples]
+    confidence = list(scores) if scores is not None else [float(v) for _, _, v in triples]
+    return points, confidence
+
+
+def iter_coco_predictions(path):
+    """
+    Yield (file_name, points, confidence, bbox) from a COCO keypoints
+    document. The file is streamed twice: once for images, once for
+    annotations, so only the image id -> file name map is held in memory.
+    """
+    file_names = {image['id']: image['file_name'] for image in iter_coco_array(path, 'images')}
+    for annotation in iter_coco_array(path, 'annotations'):
+        file_name = file_names.get(annotation.get('image_id'))
+        points, confidence = _from_coco_keypoints(annotation.get('keypoints', []), annotation.get('keypoint_scores'))
+        x, y, w, h = annotation.get('bbox') or (0, 0, 0, 0)
+        yield file_name, points, confidence, [x, y, x + w, y + h]
+
+
+def iter_jsonl_predictions(path):
+    """
+    Yield (image key, points, confidence, bbox) from a JSON Lines file. Each
+    line is either our own export format (points, confidence and an
+    [x1, y1, x2, y2] bbox) or carries COCO-style flat `keypoints`.
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            key = row.get('file_name') or row.get('image_id')
+            if 'points' in row:
+                points = row['points']
+                confidence = row.get('confidence') or [1.0] * len(points)
+            else:
+                points, confidence = _from_coco_keypoints(row.get('keypoints', []), row.get('keypoint_scores'))
+            yield key, points, confidence, row.get('bbox') or []
+
+
+def iter_predictions(path, fmt=None):
+    if fmt is None:
+        fmt = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'coco'
+    if fmt == 'coco':
+        return iter_coco_predictions(path)
+    return iter_jsonl_predictions(path)
@@ -0,0 +1,145 @@
+import struct
+
+import numpy as np
+
+from .keypoints import DTYPE, HEADER, unpack_keypoints
+from .models import AnnotationRevision, KeypointAnnotation
+
+# Every SNAPSHOT_INTERVAL-th revision (1, 1 + N, 1 + 2N, ...) stores the full
+# packed keypoints, so rebuilding any revision reads at most N rows. The
+# revisions in between store only the values that changed.
+SNAPSHOT_INTERVAL = 16
+
+# Delta layout: a header, then `count` little-endian indexes (uint16 or
+# uint32, per `width`) into the packed float32 values, then their new values.
+DELTA_MAGIC = b'KD'
+DELTA_VERSION = 1
+DELTA_HEADER = struct.Struct('<2sBBI')
+
+
+def _split(packed):
+    """Return (layout header bytes, float32 values) of a core.keypoints blob."""
+    return bytes(packed[:HEADER.size]), np.frombuffer(packed, dtype=DTYPE, offset=HEADER.size)
+
+
+def encode_delta(old, new):
+    changed = np.flatnonzero(old != new)
+    width = 2 if old.size <= 0xFFFF else 4
+    return (
+        DELTA_HEADER.pack(DELTA_MAGIC, DELTA_VERSION, width, changed.size)
+        + changed.astype(f'<u{width}').tobytes()
+        + new[changed].tobytes()
+    )
+
+
+def apply_delta(values, data):
+    magic, version, width, count = DELTA_HEADER.unpack_from(data)
+    if magic != DELTA_MAGIC or version != DELTA_VERSION:
+        raise ValueError(f'Unsupported keypoint delta (magic={magic!r}, version={version})')
+    indexes = np.frombuffer(data, dtype=f'<u{width}', count=count, offset=DELTA_HEADER.size)
+    updates = np.frombuffer(data, dtype=DTYPE, count=count, offset=DELTA_HEADER.size + indexes.nbytes)
+    values = values.copy()
+    values[indexes] = updates
+    return values
+
+
+def _revision(annotation, number, author, previous, current):
+    layout, values = _split(current)
+    if previous is None or (number - 1) % SNAPSHOT_INTERVAL == 0 or _split(previous)[0] != layout:
+        kind, data = 'snapshot', bytes(current)
+    else:
+        kind, data = 'delta', encode_delta(_split(previous)[1], values)
+    return AnnotationRevision(
+        annotation=annotation, image_id=annotation.image_id, number=number,
+        kind=kind, data=data, status=annotation.status, author=author,
+    )
+
+
+def build_revisions(annotation, previous, author):
+    """
+    Return the unsaved AnnotationRevisions recording the change of
+    `annotation` from the packed keypoints `previous` (None for a new
+    annotation) to its current fields, and advance annotation.revision.
+    Save the annotation (including `revision`) and bulk_create the result in
+    one transaction. Annotations created in bulk without history first get a
+    snapshot of their previous state, so it is not lost.
+    """
+    annotation.pack()
+    if annotation.packed is None:
+        return []
+    revisions = []
+    if annotation.revision == 0 and previous is not None and bytes(previous) != bytes(annotation.packed):
+        revisions.append(AnnotationRevision(
+            annotation=annotation, image_id=annotation.image_id, number=1, kind='snapshot',
+            data=bytes(previous), status=annotation.status, author_id=annotation.annotator_id,
+        ))
+        annotation.revision = 1
+    annotation.revision += 1
+    revisions.append(_revision(annotation, annotation.revision, author, previous, annotation.packed))
+    return revisions
+
+
+def record_revisions(annotation, previous, author):
+    """
+    Store the revisions of an already saved `annotation` that changed from
+    `previous`, and its new revision number. Call it in the transaction that
+    saved the annotation, after locking the row and reading `previous` and
+    the revision number from it, so concurrent edits cannot take the same
+    number or record against an outdated base.
+    """
+    revisions = build_revisions(annotation, previous, author)
+    if revisions:
+        KeypointAnnotation.objects.filter(id=annotation.id).update(revision=annotation.revision)
+        AnnotationRevision.objects.bulk_create(revisions)
+    return revisions
+
+
+def _advance(state, row):
+    """Return the packed keypoints after applying revision `row` to `state`."""
+    if row.kind == 'snapshot':
+        return bytes(row.data)
+    if state is None:
+        raise ValueError(f'{row} has no snapshot to apply to')
+    layout, values = _split(state)
+    return layout + apply_delta(values, bytes(row.data)).tobytes()
+
+
+def revision_state(annotation_id, number):
+    """
+    Return (points, confidence, bbox) of revision `number` of an annotation,
+    replaying at most SNAPSHOT_INTERVAL rows from the last regular snapshot.
+    """
+    start = (number - 1) // SNAPSHOT_INTERVAL * SNAPSHOT_INTERVAL + 1
+    rows = AnnotationRevision.objects.filter(
+        annotation_id=annotation_id, number__range=(start, number),
+    ).order_by('number').only('kind', 'data', 'number', 'annotation_id')
+    state = row = None
+    for row in rows:
+        state = _advance(state, row)
+    if row is None or row.number != number:
+        raise AnnotationRevision.DoesNotExist(f'Annotation {annotation_id} has no revision {number}')
+    return unpack_keypoints(state)
+
+
+def history(revisions):
+    """
+    Yield (revision, points, confidence, bbox) for every revision in
+    `revisions`, which must hold whole histories ordered by annotation and
+    number, e.g. image_history().
+    """
+    state = None
+    annotation_id = None
+    for row in revisions:
+        if row.annotation_id != annotation_id:
+            annotation_id, state = row.annotation_id, None
+        state = _advance(state, row)
+        yield (row,) + unpack_keypoints(state)
+
+
+def image_history(image_id):
+    """All revisions of all annotations on an image in one indexed query, with their keypoints."""
+    return history(
+        AnnotationRevision.objects.filter(image_id=image_id)
+        .select_related('author')
+        .order_by('annotation_id', 'number')
+    )
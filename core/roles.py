@@ -0,0 +1,72 @@
+from collections import namedtuple
+
+from django.urls import reverse
+
+SESSION_KEY = '_role'
+
+CAPABILITIES = {
+    'admin': frozenset(['view', 'annotate', 'verify', 'admin']),
+    'verifier': frozenset(['view', 'verify']),
+    'annotator': frozenset(['view', 'annotate']),
+    'viewer': frozenset(['view']),
+}
+
+HOME = {
+    'admin': 'admin:index',
+    'verifier': 'verifier_dashboard',
+    'annotator': 'annotator_dashboard',
+    'viewer': 'view_annotations',
+}
+
+Role = namedtuple('Role', ['name', 'capabilities'])
+
+
+def _fingerprint(user):
+    # Everything the role is derived from; a change to any of it (e.g. an
+    # admin editing user_type) invalidates the cached role on next use.
+    return [user.pk, user.user_type, user.is_superuser]
+
+
+def compute_role(user):
+    if user.is_superuser:
+        name = 'admin'
+    elif user.user_type in CAPABILITIES:
+        name = user.user_type
+    else:
+        name = 'viewer'
+    return Role(name, CAPABILITIES[name])
+
+
+def get_role(request):
+    """
+    Return the Role of the current user, cached in the session. Uses only
+    fields of the already-loaded request.user, so it never queries the DB.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    cached = request.session.get(SESSION_KEY)
+    if cached and cached['fingerprint'] == _fingerprint(user):
+        return Role(cached['name'], CAPABILITIES[cached['name']])
+    role = compute_role(user)
+    request.session[SESSION_KEY] = {'name': role.name, 'fingerprint': _fingerprint(user)}
+    return role
+
+
+def has_capability(request, capability):
+    role = get_role(request)
+    return role is not None and capability in role.capabilities
+
+
+def event_topics(role):
+    """The core.events topics a user with `role` follows."""
+    topics = []
+    if 'annotate' in role.capabilities:
+        topics.append('annotator')
+    if 'verify' in role.capabilities:
+        topics.append('verifier')
+    return topics
+
+
+def home_url(request):
+    return reverse(HOME[get_role(request).name])
@@ -0,0 +1,140 @@
+import re
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape, format_html
+from django.utils.safestring import mark_safe
+
+from .models import Comment, KeypointAnnotation
+
+# Full-text index over Comment.text and KeypointAnnotation.annotation_notes.
+# On SQLite it is an FTS5 table kept in sync by triggers (created by
+# migration 0015), so bulk_create and bulk_update are indexed too. Rowids are 2 * comment id for comments and
+# 2 * annotation id + 1 for notes, which lets the triggers find their row.
+TABLE = 'core_search'
+
+REBUILD_SQL = [
+    f'DELETE FROM {TABLE}',
+    f'INSERT INTO {TABLE}(rowid, body, annotation_id) SELECT id * 2, text, annotation_id FROM core_comment',
+    f"""INSERT INTO {TABLE}(rowid, body, annotation_id)
+        SELECT id * 2 + 1, annotation_notes, id FROM core_keypointannotation
+        WHERE coalesce(annotation_notes, '') != ''""",
+    f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')",
+]
+
+# Most recent matching rows that search_annotations() ranks with bm25
+SEARCH_CANDIDATES = 2000
+
+SNIPPET_WORDS = 12
+
+SearchHit = namedtuple('SearchHit', ['annotation_id', 'rank', 'snippet'])
+
+
+def uses_fts(conn=connection):
+    return conn.vendor == 'sqlite'
+
+
+def rebuild_index():
+    """Re-index every comment and note from scratch."""
+    if not uses_fts():
+        return
+    with connection.cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
+
+
+def fts_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match, the last one
+    as a prefix so partial input already finds results (from two letters
+    on, which the prefix index covers). Returns '' if the text has no words.
+    Quoting each word keeps FTS5 syntax out of user input.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    if len(words[-1]) >= 2:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def make_snippet(body, words):
+    """
+    Return about SNIPPET_WORDS words of `body` around the first word that
+    starts with one of `words`, HTML-escaped with the matches in <mark>.
+    """
+    # FTS5's snippet() is slow for prefix queries restricted to a rowid
+    # list, so this runs in Python over the few rows being shown.
+    prefixes = tuple(word.lower() for word in words)
+    tokens = re.split(r'(\w+)', body)
+    # tokens alternates separator, word, separator, ...; words are odd.
+    hits = [i for i in range(1, len(tokens), 2) if tokens[i].lower().startswith(prefixes)]
+    first = hits[0] if hits else 1
+    start = max(1, first - SNIPPET_WORDS // 2 * 2)
+    end = min(len(tokens), start + SNIPPET_WORDS * 2)
+    parts = ['…' if start > 1 else escape(tokens[0])]
+    for i in range(start, end):
+        if i in hits:
+            parts.append(format_html('<mark>{}</mark>', tokens[i]))
+        else:
+            parts.append(escape(tokens[i]))
+    if end < len(tokens) - 1:
+        parts.append('…')
+    return mark_safe(''.join(parts))
+
+
+def search_annotations(text, limit=50):
+    """
+    Return up to `limit` SearchHits for the annotations whose comments or
+    notes best match `text`, best first, one hit per annotation. Only the
+    SEARCH_CANDIDATES newest matching rows are ranked, which keeps very
+    common words as fast as rare ones; queries with fewer matches are
+    ranked exactly.
+    """
+    if not uses_fts():
+        return _search_fallback(text, limit)
+    query = fts_query(text)
+    if not query:
+        return []
+    with connection.cursor() as cursor:
+        # Walking the doclist in rowid order stops after SEARCH_CANDIDATES
+        # rows; bm25 is then computed for those rows only. Ask for a few
+        # extra since an annotation can match in several comments.
+        cursor.execute(
+            f"""SELECT rowid, annotation_id, rank FROM (
+                SELECT rowid, annotation_id, rank FROM {TABLE} WHERE {TABLE} MATCH %s
+                ORDER BY rowid DESC LIMIT %s
+            ) ORDER BY rank LIMIT %s""",
+            [query, SEARCH_CANDIDATES, limit * 4],
+        )
+        best = {}
+        for rowid, annotation_id, rank in cursor.fetchall():
+            if annotation_id not in best and len(best) < limit:
+                best[annotation_id] = (rowid, rank)
+        if not best:
+            return []
+        rowids = [rowid for rowid, _ in best.values()]
+        cursor.execute(
+            f"SELECT rowid, body FROM {TABLE} WHERE rowid IN ({', '.join(['%s'] * len(rowids))})", rowids,
+        )
+        bodies = dict(cursor.fetchall())
+    words = re.findall(r'\w+', text)
+    return [
+        SearchHit(annotation_id, rank, make_snippet(bodies.get(rowid, ''), words))
+        for annotation_id, (rowid, rank) in best.items()
+    ]
+
+
+def _search_fallback(text, limit):
+    words = re.findall(r'\w+', text)
+    if not words:
+        return []
+    notes, comments = Q(), Q()
+    for word in words:
+        notes &= Q(annotation_notes__icontains=word)
+        comments &= Q(text__icontains=word)
+    ids = list(KeypointAnnotation.objects.filter(notes).values_list('id', flat=True)[:limit])
+    ids += Comment.objects.filter(comments).values_list('annotation_id', flat=True)[:limit]
+    return [SearchHit(pk, 0.0, '') for pk in dict.fromkeys(ids)][:limit]
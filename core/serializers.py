@@ -1,7 +1,54 @@
 from rest_framework import serializers
-from .models import Image
+from .models import Comment, Image, KeypointAnnotation
 
-class ImageSerializer(serializers.ModelSerializer):
+
+class SparseFieldsMixin:
+    """Limit the serialized fields to those listed in ?fields=a,b,c."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        fields = request.query_params.get('fields') if request else None
+        if fields:
+            requested = set(fields.split(','))
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+class ImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Image
-        fields = ['id', 'file', 'uploaded_at', 'processed', 'status']
+        fields = ['id', 'file', 'uploaded_at', 'processed', 'status', 'dataset', 'width', 'height', 'orientation', 'original_name']
+        read_only_fields = ['uploaded_at', 'processed', 'status', 'width', 'height', 'orientation', 'original_name']
+
+
+class KeypointAnnotationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = KeypointAnnotation
+        fields = ['id', 'image', 'annotator', 'points', 'confidence', 'bbox', 'created_at', 'verified', 'status', 'annotation_notes']
+        read_only_fields = ['annotator', 'created_at', 'verified', 'status']
+
+
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Comment
+        fields = ['id', 'annotation', 'author', 'text', 'created_at']
+        read_only_fields = ['author', 'created_at']
+
+
+class AnnotationRevisionSerializer(serializers.Serializer):
+    """Serializes the (revision, points, confidence, bbox) tuples of core.revisions.history()."""
+
+    def to_representation(self, item):
+        revision, points, confidence, bbox = item
+        return {
+            'annotation': revision.annotation_id,
+            'number': revision.number,
+            'kind': revision.kind,
+            'status': revision.status,
+            'author': revision.author.username if revision.author else None,
+            'created_at': serializers.DateTimeField().to_representation(revision.created_at),
+            'points': points.tolist(),
+            'confidence': confidence.tolist(),
+            'bbox': bbox.tolist(),
+        }
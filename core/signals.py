@@ -0,0 +1,43 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from .agreement import invalidate_agreement
+from .counters import release_dataset
+from .models import Comment, Dataset, Image, KeypointAnnotation
+from .roles import get_role
+from .viewcache import invalidate
+
+
+@receiver([post_save, post_delete], sender=KeypointAnnotation)
+def annotation_changed(sender, instance, **kwargs):
+    invalidate_agreement([instance.image_id])
+
+
+@receiver(pre_delete, sender=Dataset)
+def dataset_deleted(sender, instance, **kwargs):
+    # Runs inside the deletion's transaction, before the cascade.
+    release_dataset(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Image)
+@receiver([post_save, post_delete], sender=KeypointAnnotation)
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_views(sender, **kwargs):
+    invalidate(sender._meta.model_name)
+
+
+@receiver(post_migrate)
+def invalidate_views_after_migrate(sender, **kwargs):
+    # The database may be new (tests) or restored; nothing cached applies.
+    if sender.name == 'core':
+        invalidate('image', 'keypointannotation', 'comment', 'imageagreement')
+
+
+@receiver(user_logged_in)
+def cache_role_on_login(sender, request, user, **kwargs):
+    # login() saves the session anyway; resolving the role here keeps the
+    # first page after login from writing the session a second time.
+    if request is not None and hasattr(request, 'session'):
+        request.user = user
+        get_role(request)
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from django.db import OperationalError, connection, transaction
+
+from .counters import CountChanges, apply_changes, tally
+from .db import is_lock_error
+from .models import Dataset, Image, Job, KeypointAnnotation, User
+from .views import save_annotation
+from .writequeue import write_queue
+
+STRESS_DATASET = 'sqlite-stress'
+
+
+def run_stress(writers=30, submissions=20, use_queue=False, cleanup=True):
+    """
+    Have `writers` threads each submit `submissions` annotations at once,
+    through save_annotation() directly or via the write queue. Returns
+    throughput and error counts.
+    """
+    last_job = Job.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    dataset = Dataset.objects.create(name=STRESS_DATASET, file_path='')
+    annotator, created = User.objects.get_or_create(username='stress-annotator', defaults={'user_type': 'annotator'})
+    total = writers * submissions
+    with transaction.atomic():
+        images = Image.objects.bulk_create(
+            Image(file=f'images/stress-{i}.jpg', dataset=dataset) for i in range(total)
+        )
+        changes = CountChanges()
+        changes.add(dataset.id, 'image', 'unlabeled', total)
+        apply_changes(changes)
+    image_ids = [image.id for image in images]
+
+    data = {'points': [[10.0, 20.0], [30.0, 40.0]], 'confidence': [1.0, 1.0], 'bbox': [10.0, 20.0, 30.0, 40.0]}
+    errors = []
+    start = threading.Barrier(writers)
+
+    def writer(ids):
+        try:
+            start.wait()
+            for image_id in ids:
+                try:
+                    if use_queue:
+                        write_queue.submit(save_annotation, image_id, annotator, data).result(timeout=60)
+                    else:
+                        save_annotation(image_id, annotator, data)
+                except Exception as e:
+                    errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=writer, args=(image_ids[i::writers],))
+        for i in range(writers)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    written = Image.objects.filter(dataset=dataset, status='annotated').count()
+    if cleanup:
+        remove_stress_data(dataset, annotator if created else None, last_job)
+
+    return {
+        'writers': writers,
+        'submissions': total,
+        'written': written,
+        'seconds': round(elapsed, 3),
+        'writes_per_second': round(written / elapsed, 1) if elapsed else None,
+        'errors': len(errors),
+        'lock_errors': sum(1 for e in errors if isinstance(e, OperationalError) and is_lock_error(e)),
+    }
+
+
+def remove_stress_data(dataset, annotator, last_job):
+    """
+    Delete what a stress run wrote: its images and annotations with their
+    counts, the overlay jobs queued for those annotations after job id
+    `last_job`, the dataset, and `annotator` if the run created it.
+    """
+    images = Image.objects.filter(dataset=dataset)
+    annotations = KeypointAnnotation.objects.filter(image__dataset=dataset)
+    with transaction.atomic():
+        annotation_ids = set(annotations.values_list('id', flat=True))
+        jobs = Job.objects.filter(id__gt=last_job, task='overlays.render')
+        Job.objects.filter(id__in=[
+            job.id for job in jobs.only('id', 'kwargs')
+            if job.kwargs.get('annotation_ids') and set(job.kwargs['annotation_ids']) <= annotation_ids
+        ]).delete()
+
+        changes = CountChanges()
+        changes.subtract(tally(images, annotations))
+        images.delete()
+        apply_changes(changes)
+        dataset.delete()
+        if annotator is not None:
+            annotator.delete()
@@ -0,0 +1,65 @@
+import os
+import uuid
+
+from django.conf import settings
+
+from .agreement import refresh_agreement
+from .derivatives import generate_derivatives
+from .export import export_filename, export_queryset, iter_export
+from .jobs import task
+from .models import Image, KeypointAnnotation
+from .overlays import get_overlay
+
+EXPORT_DIR = 'exports'
+
+
+@task('images.derivatives', priority=10, timeout=10 * 60)
+def build_derivatives(image_id):
+    """Renditions and tiles for a freshly uploaded image."""
+    image = Image.objects.filter(id=image_id).first()
+    if image is None:
+        return None
+    if not image.processed:
+        image.width, image.height = generate_derivatives(image.file.path)
+        image.processed = True
+        image.save(update_fields=['width', 'height', 'processed'])
+    return {'width': image.width, 'height': image.height}
+
+
+@task('agreement.refresh', priority=5)
+def score_agreement(image_ids):
+    # Images may have been deleted since the job was queued.
+    image_ids = list(Image.objects.filter(id__in=image_ids).values_list('id', flat=True))
+    return {'images': len(refresh_agreement(image_ids))}
+
+
+@task('overlays.render', priority=1)
+def render_overlays(annotation_ids, size='thumb'):
+    """Warm the overlay cache so list pages do not render on first view."""
+    rendered = 0
+    for annotation in KeypointAnnotation.objects.filter(id__in=annotation_ids).select_related('image'):
+        try:
+            get_overlay(annotation, size)
+        except OSError:
+            # The image file is missing; the page falls back to the plain image.
+            continue
+        rendered += 1
+    return {'rendered': rendered}
+
+
+@task('export.annotations', timeout=60 * 60, max_attempts=1)
+def export_annotations(fmt='jsonl', compress=False, status='verified', since=None, until=None, dataset=None):
+    """
+    Write an export to MEDIA_ROOT under an unguessable name and return it;
+    the file is then served like any other media file.
+    """
+    annotations = export_queryset(status=status, since=since, until=until, dataset=dataset)
+    name = f'{EXPORT_DIR}/{uuid.uuid4().hex}/{export_filename(fmt, compress)}'
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    size = 0
+    with open(path, 'wb') as f:
+        for chunk in iter_export(annotations, fmt, compress):
+            f.write(chunk)
+            size += len(chunk)
+    return {'file': name, 'size': size}
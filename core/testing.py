@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+
+# Per-process caches for the test run, so tests neither read pages cached
+# on disk by the development server nor leave any behind.
+TEST_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'test-{alias}'}
+    for alias in ('default', 'views', 'view_versions')
+}
+
+
+class _AssertMaxQueriesContext(CaptureQueriesContext):
+    def __init__(self, test_case, limit, connection):
+        self.test_case = test_case
+        self.limit = limit
+        super().__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        executed = len(self)
+        self.test_case.assertLessEqual(
+            executed, self.limit,
+            '%d queries executed, at most %d expected\nCaptured queries were:\n%s' % (
+                executed, self.limit,
+                '\n'.join('%d. %s' % (i, query['sql']) for i, query in enumerate(self.captured_queries, start=1)),
+            ),
+        )
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin adding assertMaxQueries(), an upper-bound counterpart of
+    assertNumQueries() for guarding views against N+1 regressions.
+    """
+
+    def assertMaxQueries(self, limit, func=None, *args, using=DEFAULT_DB_ALIAS, **kwargs):
+        context = _AssertMaxQueriesContext(self, limit, connections[using])
+        if func is None:
+            return context
+        with context:
+            return func(*args, **kwargs)
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner that swaps in TEST_CACHES for the whole run."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES=TEST_CACHES)
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
+
+
+def temporary_directory(test_case):
+    """Return a new directory that is removed when `test_case` finishes."""
+    path = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+class TemporaryMediaMixin:
+    """
+    TestCase mixin pointing MEDIA_ROOT at a directory of its own for the
+    whole class, removed once the class has run.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root))
+        super().setUpClass()
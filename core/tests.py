@@ -1,3 +1,1552 @@
-from django.test import TestCase
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import tarfile
+import threading
+import zipfile
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+from PIL import Image as PILImage
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.messages import get_messages
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import uploads
+from .agreement import bbox_iou, compute_agreement, object_keypoint_similarity, refresh_agreement
+from .bench import generate_dataset, run_benchmark, sample_ids
+from .derivatives import generate_derivatives, is_derivative
+from .export import export_queryset, iter_coco, iter_export
+from .models import AnnotationRevision, Comment, Dataset, Image, ImageAgreement, Job, KeypointAnnotation, StatusCount, Upload, User
+from .revisions import SNAPSHOT_INTERVAL, image_history, revision_state
+from .search import search_annotations
+from .events import broker, stream
+from .keypoints import iter_keypoint_arrays, pack_keypoints, unpack_keypoints
+from .jobs import TASKS, claim, enqueue, recover_expired, run_job, task, work
+from .imagemeta import band_fields, duplicate_pairs, hamming, image_metadata, near_duplicates, to_signed
+from .pagination import decode_cursor, encode_cursor, keyset_paginate
+from .overlays import OVERLAY_DIR, POINT_COLOR, overlay_name, prune
+from .counters import progress, rebuild
+from .leases import _claim, active_claims, claim_image, claim_images, lease_duration, sweep_expired_leases
+from .metrics import registry
+from .stress import STRESS_DATASET, run_stress
+from .testing import QueryBudgetMixin, TemporaryMediaMixin, temporary_directory
+from .views import MAX_BATCH_VERIFY, apply_verification
+from .viewcache import invalidate, version_cache, view_cache
+
+
+class ListViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    ROWS = 1000
+    BUDGET = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        cls.verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        images = Image.objects.bulk_create(
+            Image(file=f'images/{i}.jpg') for i in range(cls.ROWS)
+        )
+        annotations = KeypointAnnotation.objects.bulk_create(
+            KeypointAnnotation(
+                image=image, annotator=cls.annotator, points=[[1, 2]], confidence=[1.0], bbox=[1, 2, 1, 2],
+                status='verified' if i % 2 else 'pending',
+            )
+            for i, image in enumerate(images)
+        )
+        Comment.objects.bulk_create(
+            Comment(annotation=annotation, author=cls.verifier, text='looks good')
+            for annotation in annotations
+            for _ in range(2)
+        )
+        cls.annotation = annotations[0]
+        Comment.objects.bulk_create(
+            Comment(annotation=cls.annotation, author=cls.annotator, text=f'note {i}') for i in range(200)
+        )
+        # bulk_create sends no post_save, so cached lists from other tests would show.
+        invalidate('image', 'keypointannotation', 'comment')
+
+    def setUp(self):
+        self.client.force_login(self.verifier)
+
+    def test_annotator_dashboard(self):
+        self.client.force_login(self.annotator)
+        with self.assertMaxQueries(self.BUDGET):
+            response = self.client.get(reverse('annotator_dashboard'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_verifier_dashboard(self):
+        with self.assertMaxQueries(self.BUDGET):
+            response = self.client.get(reverse('verifier_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Comments: 2')
+        self.assertContains(response, 'Comments: 202')
+
+    def test_pages_are_not_grouped(self):
+        # Counting comments in the page query would group every matching
+        # row before the page is cut.
+        for url in (reverse('verifier_dashboard'), reverse('view_annotations')):
+            invalidate('keypointannotation')
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            pages = [query['sql'] for query in queries if 'FROM "core_keypointannotation"' in query['sql']]
+            self.assertTrue(pages)
+            for sql in pages:
+                self.assertNotIn('GROUP BY', sql)
+
+    def test_view_annotations(self):
+        with self.assertMaxQueries(self.BUDGET):
+            response = self.client.get(reverse('view_annotations'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'annotator')
+
+    def test_view_annotations_next_page(self):
+        cursor = self.client.get(reverse('view_annotations')).context['next_cursor']
+        with self.assertMaxQueries(self.BUDGET):
+            response = self.client.get(reverse('view_annotations'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+
+    def test_verify_annotation(self):
+        with self.assertMaxQueries(self.BUDGET):
+            response = self.client.get(reverse('verify_annotation', args=[self.annotation.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'note 199')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        Image.objects.bulk_create(Image(file=f'images/{i}.jpg') for i in range(7))
+        # Rows sharing a timestamp are ordered, and resumed, by id.
+        Image.objects.update(uploaded_at=timezone.now())
+        self.ids = list(Image.objects.order_by('id').values_list('id', flat=True))
+
+    def walk(self, page_size):
+        pages, cursor = [], None
+        while True:
+            page = keyset_paginate(Image.objects.all(), cursor, 'uploaded_at', page_size=page_size)
+            pages.append([image.id for image in page.object_list])
+            if page.next_cursor is None:
+                return pages
+            cursor = page.next_cursor
+
+    def test_ties_on_the_sort_key(self):
+        pages = self.walk(3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), self.ids)
+
+    def test_last_page(self):
+        self.assertEqual([len(page) for page in self.walk(7)], [7])
+        self.assertEqual([len(page) for page in self.walk(6)], [6, 1])
+        last = encode_cursor(Image.objects.get(id=self.ids[-1]).uploaded_at, self.ids[-1])
+        self.assertEqual(keyset_paginate(Image.objects.all(), last, 'uploaded_at'), ([], None))
+
+    def test_invalid_cursors_are_rejected(self):
+        now = timezone.now()
+        bad = [
+            'not a cursor',
+            base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+            base64.urlsafe_b64encode(b'yesterday|1').decode(),
+            base64.urlsafe_b64encode(f'{now.isoformat()}|one'.encode()).decode(),
+            base64.urlsafe_b64encode(f'{now.replace(tzinfo=None).isoformat()}|1'.encode()).decode(),
+            encode_cursor(now, 2 ** 63),
+            encode_cursor(now, -1),
+        ]
+        for cursor in bad:
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+        verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        self.client.force_login(User.objects.create_user('annotator', password='x', user_type='annotator'))
+        for cursor in bad:
+            self.assertEqual(self.client.get(reverse('annotator_dashboard'), {'cursor': cursor}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('annotator_dashboard'), {'cursor': ''}).status_code, 200)
+        self.client.force_login(verifier)
+        for url in (reverse('verifier_dashboard'), reverse('view_annotations')):
+            self.assertEqual(self.client.get(url, {'cursor': bad[-2]}).status_code, 400)
+            self.assertEqual(self.client.get(url, {'cursor': encode_cursor(now, 1)}).status_code, 200)
+
+
+class SQLiteConcurrencyTests(TransactionTestCase):
+    WRITERS = 16
+    SUBMISSIONS = 10
+
+    def setUp(self):
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            self.skipTest('needs a file-backed SQLite database')
+
+    def assertNoLockErrors(self, result):
+        self.assertEqual(result['lock_errors'], 0)
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual(result['written'], self.WRITERS * self.SUBMISSIONS)
+
+    def run_and_check(self, **kwargs):
+        Image.objects.create(file='images/kept.jpg')
+        rebuild()
+        before = progress()
+        jobs = Job.objects.count()
+        self.assertNoLockErrors(run_stress(self.WRITERS, self.SUBMISSIONS, **kwargs))
+        self.assertEqual(progress(), before)
+        rebuild()
+        self.assertEqual(progress(), before)
+        self.assertEqual(Job.objects.count(), jobs)
+        self.assertFalse(User.objects.filter(username='stress-annotator').exists())
+        self.assertFalse(Dataset.objects.filter(name=STRESS_DATASET).exists())
+
+    def test_concurrent_writers(self):
+        self.run_and_check()
+
+    def test_concurrent_writers_through_write_queue(self):
+        self.run_and_check(use_queue=True)
+
+
+class LeaseTests(TestCase):
+    def setUp(self):
+        self.annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.other = User.objects.create_user('other', password='x', user_type='annotator')
+        self.images = [Image.objects.create(file=f'images/{i}.jpg') for i in range(5)]
+
+    def expire(self, *images):
+        Image.objects.filter(id__in=[image.id for image in images]).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_claims_top_up_to_the_batch_size(self):
+        self.assertEqual([image.id for image in claim_images(self.annotator, 2)], [image.id for image in self.images[:2]])
+        held = claim_images(self.annotator, 3)
+        self.assertEqual([image.id for image in held], [image.id for image in self.images[:3]])
+        self.assertEqual(len(claim_images(self.annotator, 1)), 3)
+        self.assertEqual([image.id for image in claim_images(self.other, 5)], [image.id for image in self.images[3:]])
+        self.assertEqual(claim_images(self.other, 5)[0].claimed_by_id, self.other.id)
+
+    def test_claims_never_take_a_leased_image(self):
+        claim_images(self.annotator, 3)
+        # Another process may pick candidates before this one's lease
+        # commits; the update re-checks availability.
+        self.assertEqual(_claim(self.other, Image.objects.all(), 5), self.images[3:])
+        self.assertFalse(claim_image(self.other, self.images[0]))
+        self.assertEqual(Image.objects.filter(claimed_by=self.annotator).count(), 3)
+
+    def test_expired_leases_are_reclaimed_and_renewed_by_their_holder(self):
+        claim_images(self.annotator, 2)
+        self.expire(self.images[0], self.images[1])
+        self.assertTrue(claim_image(self.annotator, self.images[1]))
+        self.assertTrue(claim_image(self.other, self.images[0]))
+        self.images[0].refresh_from_db()
+        self.assertEqual(self.images[0].claimed_by_id, self.other.id)
+        self.assertEqual([image.id for image in active_claims(self.annotator)], [self.images[1].id])
+
+        held = Image.objects.get(id=self.images[1].id)
+        Image.objects.filter(id=held.id).update(lease_expires_at=timezone.now() + timedelta(seconds=5))
+        self.assertTrue(claim_image(self.annotator, held))
+        held.refresh_from_db()
+        self.assertGreater(held.lease_expires_at, timezone.now() + lease_duration() - timedelta(minutes=1))
+        self.assertFalse(claim_image(self.other, held))
+
+    def test_sweep_releases_only_expired_leases(self):
+        claim_images(self.annotator, 3)
+        self.expire(self.images[0], self.images[2])
+        self.assertEqual(sweep_expired_leases(), 2)
+        self.assertEqual(list(Image.objects.filter(claimed_by__isnull=False).values_list('id', flat=True)), [self.images[1].id])
+        self.assertEqual(sweep_expired_leases(), 0)
+
+        self.expire(self.images[1])
+        out = io.StringIO()
+        call_command('sweep_leases', stdout=out)
+        self.assertIn('Released 1 expired leases', out.getvalue())
+        self.assertFalse(Image.objects.filter(lease_expires_at__isnull=False).exists())
+
+    def test_claim_next_images(self):
+        url = reverse('claim_next_images')
+        self.client.force_login(self.annotator)
+        response = self.client.post(url, {'count': 2}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual([image['id'] for image in response.json()['images']], [image.id for image in self.images[:2]])
+        self.assertRedirects(self.client.post(url, {'count': 'many'}), reverse('annotator_dashboard'), fetch_redirect_response=False)
+        self.assertEqual(active_claims(self.annotator).count(), 5)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+        self.client.force_login(User.objects.create_user('viewer', password='x', user_type='viewer'))
+        self.assertEqual(self.client.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').status_code, 403)
+
+    def test_annotating_an_image_leased_to_someone_else(self):
+        claim_images(self.other, 1)
+        url = reverse('create_annotation', args=[self.images[0].id])
+        self.client.force_login(self.annotator)
+        response = self.client.get(url)
+        self.assertRedirects(response, reverse('annotator_dashboard'), fetch_redirect_response=False)
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)], ['This image is being annotated by someone else.'])
+
+        response = self.client.post(url, {'points': '[[1, 2]]', 'confidence': '[1.0]', 'bbox': '[1, 2, 3, 4]'})
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(self.images[0].keypointannotation_set.exists())
+
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class LeaseConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a file-backed database')
+
+    def test_concurrent_claims_do_not_overlap(self):
+        users = [User.objects.create_user(f'annotator{i}', password='x', user_type='annotator') for i in range(8)]
+        Image.objects.bulk_create(Image(file=f'images/{i}.jpg') for i in range(30))
+        start = threading.Barrier(len(users))
+        claims = {}
+
+        def claimer(user):
+            try:
+                start.wait()
+                claims[user.id] = [image.id for image in claim_images(user, 5)]
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claimer, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        claimed = [image_id for ids in claims.values() for image_id in ids]
+        self.assertEqual(len(claimed), 30)
+        self.assertEqual(len(set(claimed)), 30)
+        self.assertLessEqual(max(len(ids) for ids in claims.values()), 5)
+        for user_id, ids in claims.items():
+            self.assertEqual(Image.objects.filter(id__in=ids, claimed_by_id=user_id).count(), len(ids))
+
+
+class BenchmarkTests(TemporaryMediaMixin, TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('sessions run in threads, which need a file-backed database')
+
+    def test_benchmark_covers_every_url(self):
+        created = generate_dataset(images=200, annotators=2, verifiers=1, batch_size=64)
+        self.assertEqual(created['images'], 200)
+        pending = KeypointAnnotation.objects.filter(status='pending')
+        picks = sample_ids(pending, np.random.default_rng(7), 3)
+        self.assertEqual(picks, sample_ids(pending, np.random.default_rng(7), 3))
+        self.assertEqual(pending.filter(id__in=picks).count(), len(picks))
+        report = run_benchmark(annotators=2, verifiers=1, iterations=1)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['not_exercised'], [])
+        self.assertGreater(report['urls']['verifier_dashboard']['count'], 0)
+
+
+class RoleAccessTests(TestCase):
+    def setUp(self):
+        self.users = {
+            user_type: User.objects.create_user(user_type, password='x', user_type=user_type)
+            for user_type in ('viewer', 'annotator', 'verifier')
+        }
+
+    def test_dashboard_redirects_to_role_home(self):
+        for user_type, url_name in (
+            ('viewer', 'view_annotations'),
+            ('annotator', 'annotator_dashboard'),
+            ('verifier', 'verifier_dashboard'),
+        ):
+            self.client.force_login(self.users[user_type])
+            self.assertRedirects(self.client.get(reverse('dashboard')), reverse(url_name), fetch_redirect_response=False)
+
+    def test_role_required_views(self):
+        self.client.force_login(self.users['annotator'])
+        self.assertEqual(self.client.get(reverse('annotator_dashboard')).status_code, 200)
+        self.assertRedirects(self.client.get(reverse('verifier_dashboard')), reverse('dashboard'), fetch_redirect_response=False)
+
+    def test_cached_role_follows_user_type_change(self):
+        user = self.users['annotator']
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('annotator_dashboard')).status_code, 200)
+        user.user_type = 'verifier'
+        user.save()
+        self.assertEqual(self.client.get(reverse('verifier_dashboard')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('annotator_dashboard')).status_code, 302)
+
+    async def test_async_middleware_path(self):
+        await self.async_client.aforce_login(self.users['annotator'])
+        response = await self.async_client.get('/')
+        self.assertRedirects(response, reverse('annotator_dashboard'), fetch_redirect_response=False)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        # The session and user are loaded through sync_to_async and still counted.
+        self.assertNotIn('"0 queries"', response['Server-Timing'])
+
+
+class APIPermissionTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user('viewer', password='x', user_type='viewer')
+        self.annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.other = User.objects.create_user('other', password='x', user_type='annotator')
+        self.verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        self.image = Image.objects.create(file='images/a.jpg')
+        self.annotation = KeypointAnnotation.objects.create(
+            image=self.image, annotator=self.annotator, points=[[1, 2]], confidence=[1.0], bbox=[1, 2, 3, 4],
+        )
+        self.comment = Comment.objects.create(annotation=self.annotation, author=self.verifier, text='ok')
+
+    def test_viewer_cannot_write(self):
+        self.client.force_login(self.viewer)
+        for name, obj in (('image', self.image), ('annotation', self.annotation), ('comment', self.comment)):
+            detail = reverse(f'{name}-detail', args=[obj.id])
+            self.assertEqual(self.client.get(detail).status_code, 200)
+            self.assertEqual(self.client.post(reverse(f'{name}-list'), {}).status_code, 403, name)
+            self.assertEqual(self.client.patch(detail, {}, content_type='application/json').status_code, 403, name)
+            self.assertEqual(self.client.delete(detail).status_code, 403, name)
+        self.assertTrue(Comment.objects.filter(id=self.comment.id).exists())
+
+    def test_only_the_author_edits_a_comment(self):
+        detail = reverse('comment-detail', args=[self.comment.id])
+        other = User.objects.create_user('verifier2', password='x', user_type='verifier')
+        self.client.force_login(other)
+        self.assertEqual(self.client.patch(detail, {'text': 'no'}, content_type='application/json').status_code, 403)
+        self.assertEqual(self.client.delete(detail).status_code, 403)
+        self.client.force_login(self.verifier)
+        self.assertEqual(self.client.patch(detail, {'text': 'fine'}, content_type='application/json').status_code, 200)
+        self.assertEqual(self.client.delete(detail).status_code, 204)
+
+    def test_id_filters_must_be_integers(self):
+        self.client.force_login(self.viewer)
+        for name, param in (('image', 'dataset'), ('annotation', 'image'), ('annotation', 'annotator'),
+                            ('comment', 'annotation')):
+            for value in ('abc', '1' * 30):
+                response = self.client.get(reverse(f'{name}-list'), {param: value})
+                self.assertEqual(response.status_code, 400, param)
+                self.assertIn(param, response.json())
+        response = self.client.get(reverse('annotation-list'), {'image': self.image.id})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.annotation.id])
+
+    def test_only_admins_delete_images(self):
+        detail = reverse('image-detail', args=[self.image.id])
+        self.client.force_login(self.annotator)
+        self.assertEqual(self.client.delete(detail).status_code, 403)
+        self.assertTrue(KeypointAnnotation.objects.filter(image=self.image).exists())
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+        self.assertEqual(self.client.delete(detail).status_code, 204)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_annotations_are_changed_by_their_annotator_while_pending(self):
+        detail = reverse('annotation-detail', args=[self.annotation.id])
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.patch(detail, {'points': [[9, 9]]}, content_type='application/json').status_code, 403)
+        self.assertEqual(self.client.delete(detail).status_code, 403)
+
+        apply_verification([KeypointAnnotation.objects.select_related('image').get(id=self.annotation.id)], 'verified')
+        self.client.force_login(self.annotator)
+        self.assertEqual(self.client.patch(detail, {'points': [[9, 9]]}, content_type='application/json').status_code, 403)
+        self.assertEqual(self.client.delete(detail).status_code, 403)
+        self.annotation.refresh_from_db()
+        self.assertEqual((self.annotation.points, self.annotation.status), ([[1, 2]], 'verified'))
+
+        KeypointAnnotation.objects.filter(id=self.annotation.id).update(status='pending')
+        self.assertEqual(self.client.patch(detail, {'points': [[9, 9]]}, content_type='application/json').status_code, 200)
+        self.assertEqual(self.client.delete(detail).status_code, 204)
+
+    def test_annotation_respects_leases(self):
+        image = Image.objects.create(file='images/b.jpg')
+        claim_images(self.other, 2)
+        self.client.force_login(self.annotator)
+        payload = {'image': image.id, 'points': [[1, 2]], 'confidence': [1.0], 'bbox': [1, 2, 3, 4]}
+        response = self.client.post(reverse('annotation-list'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(image.keypointannotation_set.exists())
+        image.refresh_from_db()
+        self.assertEqual((image.status, image.claimed_by_id), ('unlabeled', self.other.id))
+
+        self.client.force_login(self.other)
+        response = self.client.post(reverse('annotation-list'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        image.refresh_from_db()
+        self.assertEqual((image.status, image.claimed_by_id), ('annotated', None))
+
+
+@override_settings(MEDIA_SENDFILE=None)
+class MediaServingTests(TemporaryMediaMixin, TestCase):
+    DATA = bytes(range(256)) * 40
+
+    def setUp(self):
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'images'), exist_ok=True)
+        with open(os.path.join(settings.MEDIA_ROOT, 'images', 'a.jpg'), 'wb') as f:
+            f.write(self.DATA)
+        Image.objects.create(file='images/a.jpg', content_hash='abc123')
+        self.url = reverse('media', args=['images/a.jpg'])
+        self.client.force_login(User.objects.create_user('viewer', password='x', user_type='viewer'))
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_full_file_with_validators(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.DATA)
+        self.assertEqual(response['ETag'], '"abc123"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_if_none_match(self):
+        response, _ = self.get(**{'If-None-Match': '"abc123"'})
+        self.assertEqual(response.status_code, 304)
+
+    def test_ranges(self):
+        for header, start, end in (('bytes=10-19', 10, 19), ('bytes=10000-', 10000, 10239), ('bytes=-5', 10235, 10239)):
+            response, body = self.get(Range=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(body, self.DATA[start:end + 1], header)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{len(self.DATA)}')
+        self.assertEqual(self.get(Range='bytes=20000-')[0].status_code, 416)
+        # A stale If-Range means the client's copy changed: send everything.
+        self.assertEqual(self.get(Range='bytes=0-9', **{'If-Range': '"old"'})[0].status_code, 200)
+
+    def test_outside_media_root(self):
+        self.assertEqual(self.client.get(reverse('media', args=['../manage.py'])).status_code, 404)
+
+    def test_if_modified_since(self):
+        response, _ = self.get()
+        self.assertEqual(self.get(**{'If-Modified-Since': response['Last-Modified']})[0].status_code, 304)
+
+    def test_compressed_files_are_not_content_encoded(self):
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'exports', 'x'), exist_ok=True)
+        with open(os.path.join(settings.MEDIA_ROOT, 'exports', 'x', 'a.jsonl.gz'), 'wb') as f:
+            f.write(self.DATA)
+        response = self.client.get(reverse('media', args=['exports/x/a.jsonl.gz']))
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.DATA)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_accel_redirect(self):
+        response, body = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/images/a.jpg')
+        self.assertEqual(body, b'')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+
+class AnnotationRevisionTests(TestCase):
+    def setUp(self):
+        self.annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        self.image = Image.objects.create(file='images/a.jpg')
+        self.points = [[float(i), float(i)] for i in range(17)]
+        self.client.force_login(self.annotator)
+        self.client.post(reverse('create_annotation', args=[self.image.id]), {
+            'points': json.dumps(self.points), 'confidence': json.dumps([1.0] * 17), 'bbox': json.dumps([0, 0, 20, 20]),
+        })
+        self.annotation = KeypointAnnotation.objects.get()
+
+    def edit(self, i):
+        points = [list(p) for p in self.points]
+        points[i % 17] = [100.0 + i, 200.0 + i]
+        response = self.client.patch(
+            reverse('annotation-detail', args=[self.annotation.id]),
+            json.dumps({'points': points}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return points
+
+    def test_edits_are_stored_as_deltas_with_periodic_snapshots(self):
+        versions = [self.points] + [self.edit(i) for i in range(SNAPSHOT_INTERVAL + 2)]
+        revisions = list(self.annotation.revisions.order_by('number'))
+        self.assertEqual([r.number for r in revisions], list(range(1, len(versions) + 1)))
+        self.assertEqual(
+            [r.number for r in revisions if r.kind == 'snapshot'], [1, SNAPSHOT_INTERVAL + 1],
+        )
+        snapshot, delta = revisions[0], revisions[1]
+        self.assertLess(len(delta.data), len(snapshot.data) / 4)
+        for number, points in enumerate(versions, 1):
+            self.assertEqual(revision_state(self.annotation.id, number)[0].tolist(), points)
+
+    def test_verification_is_recorded(self):
+        self.client.force_login(self.verifier)
+        self.client.post(reverse('verify_annotation', args=[self.annotation.id]), {'status': 'verified'})
+        with self.assertNumQueries(1):
+            history = list(image_history(self.image.id))
+        self.assertEqual([(r.number, r.status, r.author) for r, *_ in history], [
+            (1, 'pending', self.annotator), (2, 'verified', self.verifier),
+        ])
+        self.assertEqual(history[1][1].tolist(), self.points)
+
+    def test_bulk_created_annotation_keeps_its_original_state(self):
+        legacy = KeypointAnnotation.objects.bulk_create([KeypointAnnotation(
+            image=self.image, annotator=self.annotator, points=[[1, 1]], confidence=[0.5], bbox=[0, 0, 1, 1],
+        )])[0]
+        self.client.patch(
+            reverse('annotation-detail', args=[legacy.id]),
+            json.dumps({'points': [[2, 2]]}), content_type='application/json',
+        )
+        self.assertEqual(revision_state(legacy.id, 1)[0].tolist(), [[1, 1]])
+        self.assertEqual(revision_state(legacy.id, 2)[0].tolist(), [[2, 2]])
+        self.assertRaises(AnnotationRevision.DoesNotExist, revision_state, legacy.id, 3)
+
+    def test_stale_verification_and_admin_edits_keep_history_consistent(self):
+        stale = KeypointAnnotation.objects.select_related('image').get()
+        edited = self.edit(1)
+        # Verifying the copy read before the edit numbers after it.
+        apply_verification([stale], 'verified', author=self.verifier)
+        admin_user = User.objects.create_superuser('admin', password='x')
+        self.client.force_login(admin_user)
+        points = [list(p) for p in edited]
+        points[5] = [55.0, 55.0]
+        response = self.client.post(reverse('admin:core_keypointannotation_change', args=[self.annotation.id]), {
+            'image': self.image.id, 'annotator': self.annotator.id, 'points': json.dumps(points),
+            'confidence': json.dumps([1.0] * 17), 'bbox': json.dumps([0, 0, 20, 20]), 'status': 'verified',
+            'annotation_notes': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        # Verified annotations only take API edits from admins.
+        final = self.edit(2)
+
+        self.annotation.refresh_from_db()
+        self.assertEqual(self.annotation.revision, 5)
+        self.assertEqual(list(self.annotation.revisions.values_list('number', flat=True)), [1, 2, 3, 4, 5])
+        for number, expected in ((2, edited), (3, edited), (4, points), (5, final)):
+            self.assertEqual(revision_state(self.annotation.id, number)[0].tolist(), expected, number)
+
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        image = Image.objects.create(file='images/a.jpg')
+        self.wrist, self.ankle, self.other = KeypointAnnotation.objects.bulk_create(
+            KeypointAnnotation(image=image, annotator=self.annotator, points=[[1, 2]], confidence=[1.0], bbox=[1, 2, 1, 2])
+            for _ in range(3)
+        )
+        Comment.objects.bulk_create([
+            Comment(annotation=self.wrist, author=self.verifier, text='Left wrist swapped with the right one'),
+            Comment(annotation=self.wrist, author=self.verifier, text='wrist wrist wrist, occluded'),
+            Comment(annotation=self.ankle, author=self.verifier, text='Ankle is occluded by a <b>chair</b>'),
+            Comment(annotation=self.other, author=self.verifier, text='Looks fine'),
+        ])
+
+    def ids(self, text):
+        return [hit.annotation_id for hit in search_annotations(text)]
+
+    def test_ranked_and_grouped_by_annotation(self):
+        self.assertEqual(self.ids('wrist'), [self.wrist.id])
+        self.assertEqual(set(self.ids('occluded')), {self.wrist.id, self.ankle.id})
+        self.assertEqual(self.ids('left wrist swapped'), [self.wrist.id])
+        self.assertEqual(self.ids('occlusion'), [])
+        self.assertEqual(self.ids('occlu'), self.ids('occluded'))
+        self.assertEqual(self.ids('" OR * ('), [])
+
+    def test_index_follows_changes(self):
+        comment = Comment.objects.get(text='Looks fine')
+        comment.text = 'hips swapped'
+        comment.save()
+        self.assertEqual(self.ids('hips'), [self.other.id])
+        comment.delete()
+        self.assertEqual(self.ids('hips'), [])
+        KeypointAnnotation.objects.filter(id=self.other.id).update(annotation_notes='Elbow jitter')
+        self.assertEqual(self.ids('elbow'), [self.other.id])
+
+    def test_dashboard_search(self):
+        self.client.force_login(self.verifier)
+        response = self.client.get(reverse('verifier_dashboard'), {'q': 'chair'})
+        self.assertContains(response, f'Annotation #{self.ankle.id} ')
+        self.assertNotContains(response, f'Annotation #{self.wrist.id} ')
+        self.assertContains(response, '<mark>chair</mark>')
+        self.assertNotContains(response, '<b>chair')
+
+
+class LiveUpdateTests(TestCase):
+    async def test_stream_delivers_matching_topics(self):
+        events = stream(['verifier'])
+        self.assertIn('retry:', await events.__anext__())
+        broker.publish(['annotator'], 'image.added', {'id': 1})
+        event = broker.publish(['verifier'], 'annotation.verified', {'ids': [7]})
+        chunk = await events.__anext__()
+        self.assertEqual(chunk, f'id: {event.id}\nevent: annotation.verified\ndata: {{"ids": [7]}}\n\n')
+        await events.aclose()
+        self.assertFalse(broker.subscriptions)
+
+    async def test_reconnect_replays_missed_events(self):
+        first = broker.publish(['verifier'], 'annotation.verified', {'ids': [1]})
+        second = broker.publish(['verifier'], 'annotation.rejected', {'ids': [2]})
+        events = stream(['verifier'], last_event_id=first.id)
+        await events.__anext__()
+        self.assertIn(f'id: {second.id}\n', await events.__anext__())
+        await events.aclose()
+        events = stream(['verifier'], last_event_id=second.id + 100)
+        await events.__anext__()
+        self.assertEqual(await events.__anext__(), 'event: resync\ndata: {}\n\n')
+        await events.aclose()
+
+    async def test_event_stream_view(self):
+        self.assertEqual((await self.async_client.get(reverse('event_stream'))).status_code, 403)
+        user = await User.objects.acreate(username='verifier', user_type='verifier')
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.get(reverse('event_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = aiter(response.streaming_content)
+        await anext(content)
+        broker.publish(['annotator'], 'image.claimed', {'ids': [1], 'user': 1})
+        broker.publish(['verifier'], 'annotation.submitted', {'id': 3, 'image_id': 4})
+        self.assertIn(b'event: annotation.submitted', await anext(content))
+        await content.aclose()
+
+    def test_wsgi_clients_are_told_not_to_reconnect(self):
+        self.assertEqual(self.client.get(reverse('event_stream')).status_code, 204)
+
+    def test_claims_are_published_on_commit(self):
+        annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        image = Image.objects.create(file='images/a.jpg')
+        last_id = broker.last_id
+        with self.captureOnCommitCallbacks(execute=True):
+            claim_images(annotator, 1)
+        event = broker.history[-1]
+        self.assertEqual((event.id, event.type, event.data), (last_id + 1, 'image.claimed', {'ids': [image.id], 'user': annotator.id}))
+
+
+class JobQueueTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.calls = []
+
+        @task('test.flaky', max_attempts=2)
+        def flaky(n):
+            self.calls.append(n)
+            if n < 0:
+                raise ValueError('negative')
+            return n * 2
+        self.addCleanup(TASKS.pop, 'test.flaky')
+
+    def test_priorities_retries_and_results(self):
+        low = enqueue('test.flaky', {'n': 1})
+        bad = enqueue('test.flaky', {'n': -1}, priority=5)
+        high = enqueue('test.flaky', {'n': 2}, priority=10)
+        self.assertEqual(work('test', burst=True), 3)
+        self.assertEqual(self.calls, [2, -1, 1])
+        high.refresh_from_db()
+        self.assertEqual((high.status, high.result, high.attempts), ('succeeded', 4, 1))
+        bad.refresh_from_db()
+        self.assertEqual((bad.status, bad.attempts), ('queued', 1))
+        self.assertIn('ValueError: negative', bad.error)
+        Job.objects.filter(id=bad.id).update(run_after=bad.created_at)
+        work('test', burst=True)
+        bad.refresh_from_db()
+        self.assertEqual((bad.status, bad.attempts), ('failed', 2))
+        self.assertEqual(Job.objects.get(id=low.id).status, 'succeeded')
+        with self.assertRaises(LookupError):
+            enqueue('test.missing')
+
+    def test_timed_out_jobs_are_handed_out_again(self):
+        job = enqueue('test.flaky', {'n': 3})
+        lost = claim('lost')
+        Job.objects.filter(id=job.id).update(locked_until=lost.started_at)
+        self.assertEqual(recover_expired(), 1)
+        again = claim('second')
+        self.assertEqual((again.id, again.attempts), (job.id, 2))
+        # The first worker finishing late must not overwrite the new attempt.
+        run_job(lost)
+        self.assertEqual(Job.objects.get(id=job.id).status, 'running')
+        run_job(again)
+        self.assertEqual(Job.objects.get(id=job.id).status, 'succeeded')
+
+    def test_background_export(self):
+        verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        other = User.objects.create_user('other', password='x', user_type='verifier')
+        image = Image.objects.create(file='images/a.jpg')
+        KeypointAnnotation.objects.create(image=image, annotator=verifier, status='verified',
+                                          points=[[1, 2]], confidence=[1.0], bbox=[1, 2, 1, 2])
+        self.client.force_login(verifier)
+        response = self.client.get(reverse('export_annotations'), {'background': '1'})
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url).json()['status'], 'queued')
+        work('test', burst=True)
+        data = self.client.get(status_url).json()
+        self.assertEqual(data['status'], 'succeeded')
+        with open(os.path.join(settings.MEDIA_ROOT, data['result']['file'])) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        self.assertEqual(self.client.get(data['download_url']).status_code, 200)
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+
+class KeypointPackingTests(TestCase):
+    def test_round_trip(self):
+        for points, confidence, bbox in (
+            ([[1.5, 2.25], [3, 4]], [1.0, 0.5], [1, 2, 3, 4]),
+            ([[1, 2, 0.5], [3, 4, 1]], [0.75, 0.125], []),  # 3D points, no bbox
+            ([], [], [0, 0, 10, 10]),
+        ):
+            unpacked = unpack_keypoints(pack_keypoints(points, confidence, bbox))
+            for array, values in zip(unpacked, (points, confidence, bbox)):
+                self.assertEqual(array.dtype, np.float32)
+                self.assertEqual(array.tolist(), values)
+                self.assertFalse(array.flags.writeable)
+        points, _, _ = unpack_keypoints(pack_keypoints([], [], []))
+        self.assertEqual(points.shape, (0, 2))
+        # float32 keeps about seven significant digits.
+        points, _, _ = unpack_keypoints(pack_keypoints([[1234.5678, 0.1]], [1], []))
+        np.testing.assert_allclose(points, [[1234.5678, 0.1]], rtol=1e-6)
+
+    def test_rejects_bad_input(self):
+        with self.assertRaises(ValueError):
+            pack_keypoints([[1, 2], [3]], [1, 1], [])
+        with self.assertRaises(ValueError):
+            pack_keypoints([1, 2], [1], [])
+        with self.assertRaises(ValueError):
+            unpack_keypoints(b'XX' + pack_keypoints([[1, 2]], [1], [])[2:])
+
+    def test_model_keeps_packed_copy(self):
+        user = User.objects.create_user('annotator', password='x', user_type='annotator')
+        image = Image.objects.create(file='images/a.jpg')
+        annotation = KeypointAnnotation.objects.create(
+            image=image, annotator=user, points=[[1, 2], [3, 4]], confidence=[1.0, 0.5], bbox=[1, 2, 3, 4],
+        )
+        annotation.points = [[5, 6]]
+        annotation.save(update_fields=['points'])
+        annotation.refresh_from_db()
+        self.assertEqual(annotation.points_array.tolist(), [[5, 6]])
+        self.assertEqual(unpack_keypoints(annotation.packed)[0].tolist(), [[5, 6]])
+
+        # Rows bulk-created without a packed copy fall back to the JSON columns.
+        unpacked = KeypointAnnotation.objects.bulk_create([KeypointAnnotation(
+            image=image, annotator=user, points=[[7, 8]], confidence=[0.25], bbox=[],
+        )])[0]
+        self.assertIsNone(KeypointAnnotation.objects.get(id=unpacked.id).packed)
+        self.assertEqual(KeypointAnnotation.objects.get(id=unpacked.id).points_array.tolist(), [[7, 8]])
+        self.assertEqual(
+            [(pk, points.tolist()) for pk, points, _, _ in iter_keypoint_arrays(KeypointAnnotation.objects.all())],
+            [(annotation.id, [[5, 6]])],
+        )
+
+
+class AgreementTests(TestCase):
+    def test_bbox_iou(self):
+        a = np.array([[0, 0, 2, 2], [0, 0, 2, 2], [0, 0, 1, 1], [5, 5, 5, 5]], dtype=np.float64)
+        b = np.array([[1, 1, 3, 3], [0, 0, 2, 2], [2, 2, 3, 3], [5, 5, 5, 5]], dtype=np.float64)
+        iou = bbox_iou(a, b)
+        np.testing.assert_allclose(iou[:3], [1 / 7, 1, 0])
+        # Two empty boxes have no meaningful IoU.
+        self.assertTrue(np.isnan(iou[3]))
+
+    def test_object_keypoint_similarity(self):
+        a = np.array([[[0, 0], [10, 10]]], dtype=np.float64)
+        b = np.array([[[3, 4], [10, 10]]], dtype=np.float64)
+        areas = np.array([100.0])
+        # Distance 5, area 100, sigma 0.05: e = 25 / (2 * 0.1 ** 2 * 100) = 12.5
+        np.testing.assert_allclose(object_keypoint_similarity(a, b, areas, sigma=0.05), [(np.exp(-12.5) + 1) / 2])
+        np.testing.assert_allclose(object_keypoint_similarity(a, a, areas), [1.0])
+        with self.settings(AGREEMENT_KEYPOINT_SIGMA=0.5):
+            np.testing.assert_allclose(object_keypoint_similarity(a, b, areas), [(np.exp(-0.125) + 1) / 2])
+
+    def test_compute_agreement(self):
+        user = User.objects.create_user('annotator', password='x', user_type='annotator')
+        pair, single = Image.objects.create(file='images/a.jpg'), Image.objects.create(file='images/b.jpg')
+        for image, points, bbox, status in (
+            (pair, [[0, 0], [10, 10]], [0, 0, 10, 10], 'pending'),
+            (pair, [[3, 4], [10, 10]], [0, 0, 10, 20], 'verified'),
+            (pair, [[50, 50], [60, 60]], [0, 0, 10, 10], 'rejected'),
+            (pair, [[0, 0]], [0, 0, 10, 10], 'pending'),  # different keypoint count: not compared
+            (single, [[1, 1]], [0, 0, 1, 1], 'pending'),
+        ):
+            KeypointAnnotation.objects.create(image=image, annotator=user, status=status, points=points,
+                                              confidence=[1.0] * len(points), bbox=bbox)
+
+        with self.settings(AGREEMENT_KEYPOINT_SIGMA=0.05):
+            by_image = {result.image_id: result for result in refresh_agreement([pair.id, single.id])}
+        result = by_image[pair.id]
+        self.assertEqual((result.annotation_count, result.pair_count), (3, 1))
+        # Mean box area 150: e = 25 / (2 * 0.01 * 150)
+        self.assertAlmostEqual(result.mean_oks, (np.exp(-25 / 3) + 1) / 2)
+        self.assertAlmostEqual(result.min_oks, result.mean_oks)
+        self.assertAlmostEqual(result.mean_iou, 0.5)
+        result = by_image[single.id]
+        self.assertEqual((result.annotation_count, result.pair_count, result.mean_oks, result.mean_iou), (1, 0, None, None))
+        self.assertEqual(ImageAgreement.objects.count(), 2)
+        self.assertEqual(len(compute_agreement([pair.id])), 1)
+
+
+class BatchVerifyTests(TestCase):
+    def setUp(self):
+        self.verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.images = [Image.objects.create(file=f'images/{i}.jpg', status='annotated') for i in range(2)]
+        self.annotations = [
+            KeypointAnnotation.objects.create(image=image, annotator=annotator, points=[[1, 2]], confidence=[1.0],
+                                              bbox=[1, 2, 1, 2])
+            for image in self.images + self.images[:1]
+        ]
+        rebuild()
+        self.url = reverse('verify_annotations_batch')
+        self.client.force_login(self.verifier)
+
+    def post(self, payload):
+        return self.client.post(self.url, payload, content_type='application/json')
+
+    def test_partial_failure(self):
+        first, second, third = (annotation.id for annotation in self.annotations)
+        response = self.post({'ids': [first, 99999, third, first], 'status': 'verified', 'notes': 'ok'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [
+            {'id': first, 'success': True, 'status': 'verified'},
+            {'id': 99999, 'success': False, 'error': 'Annotation not found.'},
+            {'id': third, 'success': True, 'status': 'verified'},
+        ])
+        statuses = dict(KeypointAnnotation.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {first: 'verified', second: 'pending', third: 'verified'})
+        self.assertEqual(KeypointAnnotation.objects.get(id=first).annotation_notes, 'ok')
+        self.assertEqual(list(Image.objects.order_by('id').values_list('status', flat=True)), ['verified', 'annotated'])
+        self.assertEqual(progress()['annotation'], {'pending': 1, 'verified': 2})
+        self.assertEqual(progress()['image'], {'annotated': 1, 'verified': 1})
+        self.assertEqual(AnnotationRevision.objects.filter(status='verified').count(), 2)
+        self.assertEqual(Job.objects.get(task='agreement.refresh').kwargs, {'image_ids': [self.images[0].id]})
+
+        # Form posts work the same way; nothing found is still a 200 with per-id errors.
+        response = self.client.post(self.url, {'ids': [second, 99998], 'status': 'rejected'})
+        self.assertEqual([result['success'] for result in response.json()['results']], [True, False])
+        self.assertEqual(KeypointAnnotation.objects.get(id=second).status, 'rejected')
+        response = self.post({'ids': [99997], 'status': 'rejected'})
+        self.assertEqual((response.status_code, response.json()['results'][0]['success']), (200, False))
+
+    def test_invalid_requests(self):
+        pk = self.annotations[0].id
+        for payload in (
+            {'ids': [pk], 'status': 'approved'},
+            {'ids': [pk, 'x'], 'status': 'verified'},
+            {'ids': [], 'status': 'verified'},
+            {'ids': list(range(1, MAX_BATCH_VERIFY + 2)), 'status': 'verified'},
+        ):
+            self.assertEqual(self.post(payload).status_code, 400)
+        self.assertEqual(self.client.post(self.url, '{', content_type='application/json').status_code, 400)
+        self.assertEqual(self.post([pk]).status_code, 400)
+        # Not a list: must not be read as the ids "1" and "0".
+        self.assertEqual(self.post({'ids': str(pk) + '0', 'status': 'verified'}).status_code, 400)
+        self.assertEqual(self.post({'ids': pk, 'status': 'verified'}).status_code, 400)
+        self.assertEqual(self.post({'ids': [True], 'status': 'verified'}).status_code, 400)
+        self.assertEqual(self.post({'ids': [10 ** 30], 'status': 'verified'}).status_code, 400)
+        self.assertEqual(KeypointAnnotation.objects.filter(status='pending').count(), 3)
+
+        self.client.force_login(User.objects.get(username='annotator'))
+        self.assertEqual(self.post({'ids': [pk], 'status': 'verified'}).status_code, 403)
+        self.assertEqual(KeypointAnnotation.objects.get(id=pk).status, 'pending')
+
+
+class PerformanceMetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.client.force_login(self.annotator)
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get(reverse('annotator_dashboard'))
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'total', 'db', 'tpl'})
+        count, sums, samples = registry.snapshot()['annotator_dashboard']
+        self.assertEqual(count, 1)
+        self.assertGreater(samples['db_queries'][0], 0)
+        self.assertIn(f'desc="{samples["db_queries"][0]} queries"', timing['db'])
+        self.assertGreater(sums['template_duration_seconds'], 0)
+        self.assertLessEqual(sums['template_duration_seconds'], sums['request_duration_seconds'])
+
+        self.assertRedirects(self.client.get(reverse('metrics')), f'{reverse("admin:login")}?next={reverse("metrics")}',
+                             fetch_redirect_response=False)
+        staff = User.objects.create_user('staff', password='x', user_type='viewer', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        body = response.content.decode()
+        self.assertIn('# TYPE annotations_db_queries summary', body)
+        self.assertIn('annotations_request_duration_seconds_count{view="annotator_dashboard"} 1', body)
+        self.assertIn('annotations_db_queries{view="annotator_dashboard",quantile="0.5"}', body)
+        self.assertRegex(body, r'annotations_view_cache_lookups_total\{name="pending_images",result="(hit|miss)"\} 1')
+
+    def test_sampling_disabled(self):
+        with self.settings(PERF_SAMPLE_RATE=0):
+            client = Client()
+            client.force_login(self.annotator)
+            response = client.get(reverse('annotator_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(registry.snapshot(), {})
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        self.dataset = Dataset.objects.create(name='d', file_path='d')
+        self.image = Image.objects.create(file='images/a.jpg', width=640, height=480, dataset=self.dataset)
+        self.other_image = Image.objects.create(file='images/b.jpg', width=320, height=240)
+        self.first = self.annotate(self.image, [[1.5, 2.25], [3, 4]], [1.0, 0.5], [1, 2, 3, 4], '2024-01-01T12:00:00Z')
+        # Rows written before packing existed, or that could not be packed
+        self.unpacked = self.annotate(self.other_image, [[10, 20]], [0.25], [5, 6, 15, 26], '2024-02-01T12:00:00Z')
+        KeypointAnnotation.objects.filter(id=self.unpacked.id).update(packed=None)
+        self.pending = self.annotate(self.image, [[7, 8]], [1.0], [7, 8, 9, 10], '2024-01-10T12:00:00Z', 'pending')
+
+    def annotate(self, image, points, confidence, bbox, created_at, status='verified'):
+        annotation = KeypointAnnotation.objects.create(
+            image=image, annotator=self.verifier, status=status, points=points, confidence=confidence, bbox=bbox,
+        )
+        KeypointAnnotation.objects.filter(id=annotation.id).update(created_at=created_at)
+        return annotation
+
+    def jsonl(self, **filters):
+        return [json.loads(line) for line in b''.join(iter_export(export_queryset(**filters))).decode().splitlines()]
+
+    def test_jsonl_reads_every_row_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = self.jsonl()
+        self.assertEqual([row['id'] for row in rows], [self.first.id, self.unpacked.id])
+        self.assertEqual(rows[0]['points'], [[1.5, 2.25], [3.0, 4.0]])
+        self.assertEqual(rows[0]['confidence'], [1.0, 0.5])
+        self.assertEqual((rows[0]['annotator'], rows[0]['image_id']), ('verifier', self.image.id))
+        self.assertEqual(rows[1]['points'], [[10.0, 20.0]])
+        self.assertEqual(rows[1]['bbox'], [5.0, 6.0, 15.0, 26.0])
+
+    def test_filters(self):
+        ids = lambda **filters: [row['id'] for row in self.jsonl(**filters)]
+        self.assertEqual(ids(status=''), [self.first.id, self.unpacked.id, self.pending.id])
+        self.assertEqual(ids(status='pending'), [self.pending.id])
+        self.assertEqual(ids(dataset=self.dataset.id), [self.first.id])
+        self.assertEqual(ids(since='2024-01-15'), [self.unpacked.id])
+        # A bare date covers the whole day.
+        self.assertEqual(ids(until='2024-01-01'), [self.first.id])
+        self.assertEqual(ids(status='', since='2024-01-02', until='2024-01-31T00:00:00Z'), [self.pending.id])
+        with self.assertRaises(ValueError):
+            export_queryset(since='last week')
+
+    def test_gzipped_coco_download(self):
+        self.client.force_login(self.verifier)
+        response = self.client.get(reverse('export_annotations'), {'format': 'coco', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('annotations.json.gz', response['Content-Disposition'])
+        data = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(
+            [(image['id'], image['file_name'], image['width']) for image in data['images']],
+            [(self.image.id, 'images/a.jpg', 640), (self.other_image.id, 'images/b.jpg', 320)],
+        )
+        first, unpacked = data['annotations']
+        self.assertEqual(first['keypoints'], [1.5, 2.25, 2, 3, 4, 2])
+        self.assertEqual((first['bbox'], first['area'], first['num_keypoints']), ([1, 2, 2, 2], 4, 2))
+        self.assertEqual((unpacked['image_id'], unpacked['bbox']), (self.other_image.id, [5, 6, 10, 20]))
+        self.assertEqual(unpacked['keypoint_scores'], [0.25])
+        [category] = data['categories']
+        self.assertEqual((category['keypoints'][:2], len(category['keypoints'])), (['nose', 'left_eye'], 17))
+        self.assertIn([16, 14], category['skeleton'])
+        self.assertEqual(self.client.get(reverse('export_annotations'), {'format': 'csv'}).status_code, 400)
+
+    @override_settings(KEYPOINT_NAMES=['head', 'tail'], KEYPOINT_SKELETON=[(1, 2)])
+    def test_coco_category_follows_the_keypoint_schema(self):
+        data = json.loads(''.join(iter_coco(export_queryset())))
+        self.assertEqual(data['categories'], [{
+            'id': 1, 'name': 'object', 'supercategory': 'object', 'keypoints': ['head', 'tail'], 'skeleton': [[1, 2]],
+        }])
+
+
+class RenditionTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'images'), exist_ok=True)
+        PILImage.new('RGB', (2000, 1000), (0, 128, 0)).save(os.path.join(settings.MEDIA_ROOT, 'images', 'a.jpg'))
+        self.image = Image.objects.create(file='images/a.jpg')
+        self.client.force_login(User.objects.create_user('viewer', password='x', user_type='viewer'))
+
+    def test_unprocessed_image_gets_only_the_requested_rendition(self):
+        response = self.client.get(self.image.thumbnail_url)
+        self.assertRedirects(response, reverse('media', args=['images/a_thumb.jpg']), fetch_redirect_response=False)
+        self.assertEqual(sorted(os.listdir(os.path.join(settings.MEDIA_ROOT, 'images'))), ['a.jpg', 'a_thumb.jpg'])
+        with PILImage.open(os.path.join(settings.MEDIA_ROOT, 'images', 'a_thumb.jpg')) as thumb:
+            self.assertEqual(thumb.size, (256, 128))
+        self.image.refresh_from_db()
+        self.assertFalse(self.image.processed)
+
+        self.image.processed = True
+        self.image.save()
+        self.assertRedirects(
+            self.client.get(reverse('image_rendition', args=[self.image.id, 'preview'])),
+            reverse('media', args=['images/a_preview.jpg']), fetch_redirect_response=False,
+        )
+
+    def test_processed_image_is_viewed_through_its_tile_pyramid(self):
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'tiled'), exist_ok=True)
+        PILImage.new('RGB', (2000, 1000), (0, 128, 0)).save(os.path.join(settings.MEDIA_ROOT, 'tiled', 'b.jpg'))
+        self.image = Image.objects.create(file='tiled/b.jpg')
+        self.assertEqual(generate_derivatives(self.image.file.path), (2000, 1000))
+        files = os.path.join(settings.MEDIA_ROOT, 'tiled', 'b_files')
+        self.assertEqual(sorted(map(int, os.listdir(files))), list(range(12)))
+        self.assertEqual(len(os.listdir(os.path.join(files, '11'))), 8 * 4)
+        self.assertEqual(os.listdir(os.path.join(files, '0')), ['0_0.jpg'])
+        with PILImage.open(os.path.join(files, '11', '1_1.jpg')) as tile:
+            self.assertEqual(tile.size, (256, 256))
+        self.assertTrue(is_derivative('tiled/b_files/11/1_1.jpg'))
+
+        self.image.processed = True
+        self.image.save()
+        response = self.client.get(self.image.dzi_url)
+        self.assertEqual(response['Content-Type'], 'application/xml')
+        self.assertIn(b'<Size Width="2000" Height="1000"/>', b''.join(response.streaming_content))
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+        self.client.force_login(User.objects.create_user('annotator', password='x', user_type='annotator'))
+        response = self.client.get(reverse('create_annotation', args=[self.image.id]))
+        self.assertContains(response, f'data-dzi="{self.image.dzi_url}"')
+
+
+@override_settings(MEDIA_SENDFILE=None)
+class OverlayTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'images'), exist_ok=True)
+        PILImage.new('RGB', (800, 400), (0, 0, 255)).save(os.path.join(settings.MEDIA_ROOT, 'images', 'a.jpg'))
+        self.verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        image = Image.objects.create(file='images/a.jpg')
+        self.annotation = KeypointAnnotation.objects.create(
+            image=image, annotator=self.verifier, points=[[400, 200], [100, 100]], confidence=[1.0, 1.0],
+            bbox=[50, 50, 500, 300],
+        )
+        self.client.force_login(self.verifier)
+
+    def get(self, size='thumb'):
+        self.annotation.refresh_from_db()
+        response = self.client.get(self.annotation.overlay_url(size))
+        return response, PILImage.open(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_renders_and_caches_by_revision(self):
+        response, overlay = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(overlay.size, (256, 128))
+        path = os.path.join(settings.MEDIA_ROOT, overlay_name(self.annotation.id, self.annotation.revision, 'thumb'))
+        mtime = os.stat(path).st_mtime_ns
+        self.assertEqual(self.get()[0]['ETag'], response['ETag'])
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+        apply_verification([self.annotation], 'verified', author=self.verifier)
+        self.assertEqual(self.get()[0].status_code, 200)
+        self.assertFalse(os.path.exists(path))
+        preview = self.get('preview')[1]
+        self.assertEqual(preview.size, (800, 400))
+        self.assertTrue(all(abs(a - b) < 40 for a, b in zip(preview.getpixel((400, 200)), POINT_COLOR)))
+
+    def test_prune_removes_least_recently_used(self):
+        directory = os.path.join(settings.MEDIA_ROOT, OVERLAY_DIR, '0', '1')
+        os.makedirs(directory, exist_ok=True)
+        for i in range(5):
+            path = os.path.join(directory, f'{i}_thumb.jpg')
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            os.utime(path, (1000 + (i * 7) % 5, 1000))
+        self.assertEqual(prune(budget=350), (2, 200))
+        self.assertEqual(sorted(os.listdir(directory)), ['1_thumb.jpg', '2_thumb.jpg', '4_thumb.jpg'])
+
+
+class ImageMetadataTests(TemporaryMediaMixin, TestCase):
+    def picture(self, seed, size=(640, 480), orientation=None, quality=90):
+        rng = random.Random(seed)
+        small = PILImage.new('RGB', (8, 6))
+        small.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(48)])
+        im = small.resize(size, PILImage.BICUBIC)
+        buf = io.BytesIO()
+        exif = PILImage.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        im.save(buf, 'JPEG', quality=quality, exif=exif)
+        return buf.getvalue()
+
+    def test_metadata_and_near_duplicate_upload(self):
+        meta = image_metadata(io.BytesIO(self.picture(1, orientation=6)))
+        self.assertEqual((meta['width'], meta['height'], meta['orientation']), (480, 640, 6))
+
+        same = image_metadata(io.BytesIO(self.picture(1, size=(320, 240), quality=40)))
+        other = image_metadata(io.BytesIO(self.picture(2)))
+        original = image_metadata(io.BytesIO(self.picture(1)))
+        self.assertLessEqual(hamming(original['perceptual_hash'], same['perceptual_hash']), 6)
+        self.assertGreater(hamming(original['perceptual_hash'], other['perceptual_hash']), 12)
+
+        annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.client.force_login(annotator)
+        self.client.post(reverse('upload_image'), {'file': SimpleUploadedFile('a.jpg', self.picture(1))})
+        first = Image.objects.get()
+        self.assertEqual((first.width, first.orientation), (640, 1))
+        self.assertEqual(first.perceptual_hash, original['perceptual_hash'])
+        response = self.client.post(
+            reverse('upload_image'), {'file': SimpleUploadedFile('b.jpg', self.picture(1, size=(320, 240), quality=40))},
+            follow=True,
+        )
+        self.assertContains(response, f'looks like a duplicate of #{first.id}')
+
+    def test_index_matches_brute_force(self):
+        rng = random.Random(0)
+        hashes = [rng.getrandbits(64) for _ in range(200)]
+        # Plant near copies at every distance up to 11 bits.
+        for i in range(60):
+            bits = rng.sample(range(64), i % 12)
+            hashes.append(hashes[i] ^ sum(1 << bit for bit in bits))
+        Image.objects.bulk_create(
+            Image(file=f'images/{i}.jpg', perceptual_hash=to_signed(h), **band_fields(h)) for i, h in enumerate(hashes)
+        )
+        ids = list(Image.objects.order_by('id').values_list('id', flat=True))
+        for distance in (0, 3, 6, 11):
+            expected = {
+                (ids[i], ids[j], hamming(a, b))
+                for i, a in enumerate(hashes) for j, b in enumerate(hashes)
+                if i < j and hamming(a, b) <= distance
+            }
+            self.assertEqual(set(duplicate_pairs(distance)), expected, distance)
+            self.assertEqual(
+                {(ids[0], pk, d) for pk, d in near_duplicates(hashes[0], distance) if pk != ids[0]},
+                {pair for pair in expected if pair[0] == ids[0]},
+            )
+        out = io.StringIO()
+        call_command('find_duplicates', '--distance', '3', stdout=out, stderr=io.StringIO())
+        self.assertEqual(len(out.getvalue().splitlines()), len(set(duplicate_pairs(3))))
+
+    def test_index_images_backfills_content_hashes(self):
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'images'), exist_ok=True)
+        data = {}
+        for name, seed in (('old.jpg', 3), ('new.jpg', 4)):
+            data[name] = self.picture(seed)
+            with open(os.path.join(settings.MEDIA_ROOT, 'images', name), 'wb') as f:
+                f.write(data[name])
+        meta = image_metadata(io.BytesIO(data['old.jpg']))
+        old = Image.objects.create(file='images/old.jpg', **meta)
+        new = Image.objects.create(file='images/new.jpg')
+        missing = Image.objects.create(file='images/missing.jpg')
+
+        out, err = io.StringIO(), io.StringIO()
+        call_command('index_images', '--workers', '1', stdout=out, stderr=err)
+        self.assertIn('Indexed 2 images', out.getvalue())
+        self.assertIn(f'e.g. [{missing.id}]', err.getvalue())
+        old.refresh_from_db()
+        new.refresh_from_db()
+        self.assertEqual(old.content_hash, hashlib.sha256(data['old.jpg']).hexdigest())
+        self.assertEqual(old.perceptual_hash, meta['perceptual_hash'])
+        self.assertEqual((new.content_hash, new.width), (hashlib.sha256(data['new.jpg']).hexdigest(), 640))
+
+
+class ChunkedUploadTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.client.force_login(self.annotator)
+        buf = io.BytesIO()
+        PILImage.new('RGB', (300, 200), (0, 128, 0)).save(buf, 'JPEG')
+        self.data = buf.getvalue()
+
+    def patch(self, url, offset, data):
+        return self.client.patch(
+            url, data, content_type='application/offset+octet-stream', headers={'Upload-Offset': str(offset)},
+        )
+
+    def test_resumable_upload(self):
+        response = self.client.post(
+            reverse('create_upload'), {'filename': 'a.JPG', 'size': len(self.data)}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        url = response['Location']
+        half = len(self.data) // 2
+        self.assertEqual(self.patch(url, 0, self.data[:half])['Upload-Offset'], str(half))
+        self.assertEqual(self.patch(url, 0, self.data[:half]).json()['offset'], half)
+        upload = Upload.objects.get()
+        self.assertEqual(self.client.get(settings.MEDIA_URL + f'.partial/{upload.id}.part').status_code, 404)
+        self.assertEqual(self.client.post(url + 'complete/').status_code, 409)
+
+        # A restarted process has no hash state and re-reads the partial file.
+        uploads._hashers.clear()
+        self.assertEqual(self.client.get(url).json()['offset'], half)
+        self.assertEqual(self.patch(url, half, self.data[half:] + b'x').status_code, 413)
+        self.assertEqual(self.patch(url, half, self.data[half:]).json()['offset'], len(self.data))
+
+        digest = hashlib.sha256(self.data).hexdigest()
+        self.assertEqual(self.client.post(url + 'complete/?sha256=0').status_code, 400)
+        result = self.client.post(url + f'complete/?sha256={digest}').json()
+        image = Image.objects.get()
+        self.assertEqual(result['image'], image.id)
+        self.assertEqual((image.file.name, image.content_hash), (f'images/{digest}.jpg', digest))
+        self.assertEqual((image.width, image.height, image.original_name), (300, 200, 'a.JPG'))
+        self.assertIsNotNone(image.perceptual_hash)
+        self.assertTrue(Job.objects.filter(task='images.derivatives').exists())
+        self.assertEqual(self.client.post(url + 'complete/').json()['image'], image.id)
+        self.assertEqual(self.patch(url, len(self.data), b'x').status_code, 409)
+
+    def test_abort_sweep_and_access(self):
+        url = self.client.post(
+            reverse('create_upload'), {'filename': 'a.jpg', 'size': 10}, content_type='application/json',
+        )['Location']
+        self.patch(url, 0, b'12345')
+        upload = Upload.objects.get()
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(Upload.objects.exists())
+        self.assertFalse(os.path.exists(uploads.partial_path(upload)))
+
+        url = self.client.post(
+            reverse('create_upload'), {'filename': 'b.jpg', 'size': 10}, content_type='application/json',
+        )['Location']
+        self.patch(url, 0, b'12345')
+        Upload.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(uploads.sweep_stale_uploads(), 0)
+        os.utime(uploads.partial_path(Upload.objects.get()), (0, 0))
+        self.assertEqual(uploads.sweep_stale_uploads(), 1)
+
+        verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        self.client.force_login(verifier)
+        response = self.client.post(
+            reverse('create_upload'), {'filename': 'c.jpg', 'size': 10}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class ViewCacheTests(TestCase):
+    def setUp(self):
+        self.annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.verifier = User.objects.create_user('verifier', password='x', user_type='verifier')
+        self.images = [Image.objects.create(file=f'images/{i}.jpg') for i in range(3)]
+        self.annotation = KeypointAnnotation.objects.create(
+            image=self.images[0], annotator=self.annotator, points=[[1, 2]], confidence=[1.0], bbox=[1, 2, 3, 4],
+        )
+
+    def test_tests_use_in_memory_caches(self):
+        self.assertIsInstance(view_cache(), LocMemCache)
+        self.assertIsInstance(version_cache(), LocMemCache)
+
+    def test_lease_renewal_refreshes_the_claimed_list(self):
+        claim_images(self.annotator, 1)
+        Image.objects.filter(id=self.images[0].id).update(lease_expires_at=timezone.now() + timedelta(minutes=5))
+        invalidate('image')
+        self.client.force_login(self.annotator)
+        self.assertContains(self.client.get(reverse('annotator_dashboard')), 'Lease expires in 4\xa0minutes')
+        self.assertTrue(claim_image(self.annotator, self.images[0]))
+        self.assertContains(self.client.get(reverse('annotator_dashboard')), 'Lease expires in 29\xa0minutes')
+
+    def test_verifier_dashboard_hits_until_a_save(self):
+        self.client.force_login(self.verifier)
+        self.client.get(reverse('verifier_dashboard'))
+        hits = registry.cache_snapshot().get(('pending_annotations', 'hit'), 0)
+        # Only the session and user are loaded.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('verifier_dashboard'))
+        self.assertContains(response, 'Comments: 0')
+        self.assertEqual(registry.cache_snapshot()[('pending_annotations', 'hit')], hits + 1)
+
+        Comment.objects.create(annotation=self.annotation, author=self.verifier, text='hm')
+        self.assertContains(self.client.get(reverse('verifier_dashboard')), 'Comments: 1')
+        # bulk_update skips post_save; apply_verification invalidates itself.
+        apply_verification([self.annotation], 'verified', author=self.verifier)
+        self.assertContains(self.client.get(reverse('verifier_dashboard')), 'No pending annotations available.')
+        self.assertContains(self.client.get(reverse('view_annotations')), f'Annotation #{self.annotation.id} ')
+
+    def test_annotator_dashboard_follows_claims(self):
+        self.client.force_login(self.annotator)
+        self.assertContains(self.client.get(reverse('annotator_dashboard')), 'You have no claimed images.')
+        claim_images(self.annotator, 1)
+        response = self.client.get(reverse('annotator_dashboard'))
+        self.assertContains(response, f'data-image-id="{self.images[0].id}"')
+        self.assertNotContains(response, f'data-pending-image-id="{self.images[0].id}"')
+        self.assertContains(response, f'data-pending-image-id="{self.images[1].id}"')
+
+
+class IngestImagesTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.source = temporary_directory(self)
+        self.pictures = {}
+        for name, color, size in (('a.jpg', 'red', (64, 48)), ('sub/b.png', 'blue', (30, 40)), ('c.jpg', 'green', (10, 10))):
+            buf = io.BytesIO()
+            PILImage.new('RGB', size, color).save(buf, 'PNG' if name.endswith('.png') else 'JPEG')
+            self.pictures[name] = buf.getvalue()
+        self.write('a.jpg', self.pictures['a.jpg'])
+        self.write('sub/b.png', self.pictures['sub/b.png'])
+        self.write('copy-of-a.jpg', self.pictures['a.jpg'])
+        self.write('notes.txt', b'not an image')
+
+    def write(self, name, data):
+        path = os.path.join(self.source, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def ingest(self, source, *args):
+        out = io.StringIO()
+        call_command('ingest_images', source, '--workers', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_directory(self):
+        output = self.ingest(self.source, '--dataset', 'd', '--batch-size', '1')
+        self.assertIn('Ingested 2 images, skipped 1 duplicates', output)
+        dataset = Dataset.objects.get(name='d')
+        images = {image.original_name: image for image in Image.objects.filter(dataset=dataset)}
+        self.assertEqual(set(images), {'a.jpg', 'sub/b.png'})
+        digest = hashlib.sha256(self.pictures['sub/b.png']).hexdigest()
+        b = images['sub/b.png']
+        self.assertEqual((b.content_hash, b.file.name, b.width, b.height), (digest, f'images/{digest}.png', 30, 40))
+        with b.file.open('rb') as f:
+            self.assertEqual(f.read(), self.pictures['sub/b.png'])
+        self.assertEqual(progress(dataset)['image'], {'unlabeled': 2})
+
+        self.assertIn('Ingested 0 images, skipped 3 duplicates', self.ingest(self.source))
+        self.assertEqual(Image.objects.count(), 2)
+
+    def test_archives(self):
+        self.ingest(self.source)
+        archive = os.path.join(temporary_directory(self), 'images.zip')
+        with zipfile.ZipFile(archive, 'w') as z:
+            z.writestr('a.jpg', self.pictures['a.jpg'])
+            z.writestr('c.jpg', self.pictures['c.jpg'])
+            z.writestr('readme.md', 'x')
+        self.assertIn('Ingested 1 images, skipped 1 duplicates', self.ingest(archive))
+
+        archive = os.path.join(temporary_directory(self), 'images.tar.gz')
+        with tarfile.open(archive, 'w:gz') as tar:
+            tar.add(self.source, arcname='photos')
+        self.assertIn('Ingested 0 images, skipped 3 duplicates', self.ingest(archive))
+
+        c = Image.objects.get(original_name='c.jpg')
+        self.assertEqual((c.dataset, c.width, c.content_hash), (None, 10, hashlib.sha256(self.pictures['c.jpg']).hexdigest()))
+        # Skipped archive members leave no temporary copies behind.
+        names = os.listdir(os.path.join(settings.MEDIA_ROOT, 'images'))
+        self.assertFalse([name for name in names if name.startswith('.ingest')])
+        self.assertEqual(progress()['image'], {'unlabeled': 3})
+
+    def test_missing_source(self):
+        with self.assertRaises(CommandError):
+            self.ingest(os.path.join(self.source, 'nope'))
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.superuser = User.objects.create_superuser('admin', password='x', user_type='verifier')
+        self.annotator = User.objects.create_user('annotator', password='x', user_type='annotator')
+        self.dataset = Dataset.objects.create(name='d', file_path='d')
+        self.images = [
+            Image.objects.create(file=f'images/{i}.jpg', dataset=dataset, status=status)
+            for i, (dataset, status) in enumerate([
+                (self.dataset, 'unlabeled'), (self.dataset, 'annotated'), (self.dataset, 'annotated'), (None, 'annotated'),
+            ])
+        ]
+        self.annotations = [
+            KeypointAnnotation.objects.create(image=image, annotator=self.annotator, status=status,
+                                              points=[[1, 2]], confidence=[1.0], bbox=[1, 2, 1, 2])
+            for image, status in [(self.images[1], 'pending'), (self.images[2], 'verified'), (self.images[3], 'pending')]
+        ]
+        rebuild()
+        self.request = RequestFactory().post('/')
+        self.request.user = self.superuser
+
+    def assertMatchesRebuild(self):
+        counts = lambda: set(StatusCount.objects.exclude(count=0).values_list('dataset_id', 'kind', 'status', 'count'))
+        kept = counts()
+        rebuild()
+        self.assertEqual(kept, counts())
+
+    def test_rebuild(self):
+        StatusCount.objects.update(count=99)
+        call_command('rebuild_status_counts', stdout=io.StringIO())
+        self.assertEqual(progress(self.dataset), {
+            'image': {'unlabeled': 1, 'annotated': 2},
+            'annotation': {'pending': 1, 'verified': 1},
+        })
+        self.assertEqual(progress(), {
+            'image': {'unlabeled': 1, 'annotated': 3},
+            'annotation': {'pending': 2, 'verified': 1},
+        })
+
+    def test_admin_edits_and_deletes(self):
+        image_admin, annotation_admin = admin.site._registry[Image], admin.site._registry[KeypointAnnotation]
+
+        image = self.images[1]
+        image.status, image.dataset = 'verified', None
+        image_admin.save_model(self.request, image, None, True)
+        self.assertEqual(progress(self.dataset), {
+            'image': {'unlabeled': 1, 'annotated': 1},
+            'annotation': {'pending': 0, 'verified': 1},
+        })
+        self.assertMatchesRebuild()
+
+        image_admin.save_model(self.request, Image(file='images/new.jpg', dataset=self.dataset), None, False)
+        annotation = self.annotations[1]
+        annotation.status = 'rejected'
+        annotation_admin.save_model(self.request, annotation, None, True)
+        self.assertMatchesRebuild()
+
+        image_admin.delete_model(self.request, self.images[2])
+        annotation_admin.delete_queryset(self.request, KeypointAnnotation.objects.filter(id=self.annotations[2].id))
+        self.assertMatchesRebuild()
+
+        admin.site._registry[User].delete_model(self.request, self.annotator)
+        self.assertFalse(any(progress()['annotation'].values()))
+        self.assertMatchesRebuild()
+
+    def test_deleting_a_dataset_keeps_its_images_counted(self):
+        before = progress()
+        self.dataset.delete()
+        self.assertEqual(progress(), before)
+        self.assertFalse(StatusCount.objects.filter(dataset__isnull=False).exists())
+        self.assertMatchesRebuild()
+
+    def test_status_count_admin_is_read_only(self):
+        self.client.force_login(self.superuser)
+        self.assertEqual(self.client.get(reverse('admin:core_statuscount_changelist')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('admin:core_statuscount_add')).status_code, 403)
+        pk = StatusCount.objects.values_list('id', flat=True).first()
+        self.assertEqual(self.client.post(reverse('admin:core_statuscount_delete', args=[pk]), {'post': 'yes'}).status_code, 403)
+        self.assertTrue(StatusCount.objects.filter(id=pk).exists())
+
+
+class ImportPredictionsTests(TestCase):
+    def setUp(self):
+        self.images = [
+            Image.objects.create(file=f'images/{name}', original_name=name) for name in ('a.jpg', 'b.jpg', 'c.jpg')
+        ]
+        rebuild()
+        self.dir = temporary_directory(self)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path):
+        out = io.StringIO()
+        call_command('import_predictions', path, stdout=out)
+        return out.getvalue()
+
+    def test_jsonl_skips_unknown_ids(self):
+        path = self.write('p.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'image_id': self.images[0].id, 'points': [[1, 2], [3, 4]], 'confidence': [0.9, 0.8], 'bbox': [0, 0, 5, 5]},
+            {'image_id': 99999, 'points': [[1, 2]]},
+            {'file_name': 'some/dir/b.jpg', 'keypoints': [1, 2, 0.5, 3, 4, 0.7]},
+            {'file_name': 'missing.jpg', 'points': [[1, 2]]},
+        ]))
+        output = self.run_import(path)
+        self.assertIn('Imported 2 predictions', output)
+        self.assertIn('2 did not match an image', output)
+        first, second = KeypointAnnotation.objects.order_by('image_id')
+        self.assertEqual((first.image_id, first.points, first.confidence), (self.images[0].id, [[1, 2], [3, 4]], [0.9, 0.8]))
+        self.assertEqual((second.image_id, second.confidence), (self.images[1].id, [0.5, 0.7]))
+        self.assertEqual(
+            list(Image.objects.order_by('id').values_list('status', flat=True)),
+            ['machine_labeled', 'machine_labeled', 'unlabeled'],
+        )
+        self.assertEqual(progress()['image'], {'machine_labeled': 2, 'unlabeled': 1})
+
+        self.assertIn('2 images already had predictions', self.run_import(path))
+        self.assertEqual(KeypointAnnotation.objects.count(), 2)
+
+    def test_coco(self):
+        path = self.write('p.json', json.dumps({
+            'info': {'description': 'x'},
+            'images': [{'id': 7, 'file_name': 'c.jpg'}, {'id': 8, 'file_name': 'nope.jpg'}],
+            'annotations': [
+                {'image_id': 7, 'keypoints': [10, 20, 2, 30, 40, 1], 'bbox': [1, 2, 10, 20]},
+                {'image_id': 8, 'keypoints': [1, 1, 2]},
+            ],
+        }))
+        self.assertIn('1 did not match an image', self.run_import(path))
+        annotation = KeypointAnnotation.objects.get()
+        self.assertEqual(annotation.image_id, self.images[2].id)
+        self.assertEqual((annotation.points, annotation.bbox), ([[10, 20], [30, 40]], [1, 2, 11, 22]))
+        self.assertEqual(annotation.annotator.username, 'machine')
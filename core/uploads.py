@@ -0,0 +1,203 @@
+import fcntl
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .counters import CountChanges, apply_changes
+from .events import publish_on_commit
+from .imagemeta import image_metadata
+from .jobs import enqueue
+from .models import Image, Upload
+
+# Resumable uploads: the client creates an Upload, appends chunks at the
+# offset the server reports, and completes it. Chunks are streamed straight
+# into a partial file next to the final location (so completing is a
+# rename) while a SHA-256 is updated, so memory stays at one CHUNK_SIZE
+# buffer per request whatever the file size.
+PARTIAL_DIR = '.partial'
+CHUNK_SIZE = 1024 * 1024
+HASHER_CACHE = 1024
+
+# Hash state of recent uploads by id, as (offset, hasher). hashlib objects
+# cannot be stored, so another process (or a restart) resuming an upload
+# re-hashes its partial file once.
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+class UploadConflict(Exception):
+    """The client's offset does not match the partial file, or another request is writing it."""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def max_upload_size():
+    return getattr(settings, 'UPLOAD_MAX_BYTES', 2 * 1024 ** 3)
+
+
+def upload_expiry():
+    return timedelta(seconds=getattr(settings, 'UPLOAD_EXPIRY_SECONDS', 24 * 60 * 60))
+
+
+def partial_path(upload):
+    return os.path.join(settings.MEDIA_ROOT, PARTIAL_DIR, f'{upload.id}.part')
+
+
+def upload_offset(upload):
+    try:
+        return os.path.getsize(partial_path(upload))
+    except FileNotFoundError:
+        return 0
+
+
+def _open_locked(upload):
+    path = partial_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f = open(path, 'ab')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        raise UploadConflict('Another request is writing this upload', upload_offset(upload))
+    return f
+
+
+def _hasher(upload, offset):
+    with _hashers_lock:
+        cached = _hashers.pop(upload.id, None)
+    if cached and cached[0] == offset:
+        return cached[1]
+    hasher = hashlib.sha256()
+    with open(partial_path(upload), 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+def _remember(upload, offset, hasher):
+    with _hashers_lock:
+        _hashers[upload.id] = (offset, hasher)
+        while len(_hashers) > HASHER_CACHE:
+            _hashers.popitem(last=False)
+
+
+def append_chunk(upload, offset, stream):
+    """
+    Append the bytes read from `stream` to `upload` if `offset` is where the
+    partial file ends, and return the new offset. Blocking; run it off the
+    event loop.
+    """
+    with _open_locked(upload) as f:
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            raise UploadConflict(f'Upload is at offset {current}, not {offset}', current)
+        hasher = _hasher(upload, current)
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                if current + len(chunk) > upload.size:
+                    raise ValueError(f'More data than the declared size of {upload.size} bytes')
+                f.write(chunk)
+                hasher.update(chunk)
+                current += len(chunk)
+        finally:
+            # Whatever reached the file is kept, so a dropped connection
+            # resumes from the last byte written.
+            f.flush()
+            if current == os.fstat(f.fileno()).st_size:
+                _remember(upload, current, hasher)
+    return current
+
+
+def assemble_upload(upload, sha256=None):
+    """
+    Check a fully received upload and move its partial file into place
+    under its content hash. Returns (name, sha256, metadata fields). Raises
+    UploadConflict if bytes are missing and ValueError if it does not match
+    `sha256` or is not an image. Blocking file work only, no queries.
+    """
+    with _open_locked(upload) as f:
+        size = os.fstat(f.fileno()).st_size
+        if size != upload.size:
+            raise UploadConflict(f'Upload has {size} of {upload.size} bytes', size)
+        digest = _hasher(upload, size).hexdigest()
+        if sha256 and sha256.lower() != digest:
+            raise ValueError('Checksum mismatch')
+        path = partial_path(upload)
+        try:
+            # Reads the header and a draft-scaled decode, not the whole file.
+            metadata = image_metadata(path)
+        except (OSError, ValueError):
+            raise ValueError('Not a readable image')
+
+        name = f'images/{digest}{os.path.splitext(upload.filename)[1].lower()}'
+        final_path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        if os.path.exists(final_path):
+            # Same bytes already stored under their hash.
+            os.remove(path)
+        else:
+            os.replace(path, final_path)
+    with _hashers_lock:
+        _hashers.pop(upload.id, None)
+    return name, digest, metadata
+
+
+def create_image(upload, name, digest, metadata):
+    """Record the Image for an assembled upload."""
+    with transaction.atomic():
+        image = Image.objects.create(
+            file=name, content_hash=digest, original_name=upload.filename, dataset_id=upload.dataset_id, **metadata,
+        )
+        upload.image = image
+        upload.save(update_fields=['image'])
+        changes = CountChanges()
+        changes.add(image.dataset_id, 'image', image.status)
+        apply_changes(changes)
+        enqueue('images.derivatives', {'image_id': image.id}, created_by=upload.user)
+        publish_on_commit(['annotator'], 'image.added', id=image.id)
+    return image
+
+
+def complete_upload(upload, sha256=None):
+    return create_image(upload, *assemble_upload(upload, sha256))
+
+
+def remove_partial(upload):
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+    with _hashers_lock:
+        _hashers.pop(upload.id, None)
+
+
+def abort_upload(upload):
+    remove_partial(upload)
+    upload.delete()
+
+
+def sweep_stale_uploads():
+    """
+    Delete uploads whose partial file was last written more than
+    UPLOAD_EXPIRY_SECONDS ago, and the records of completed ones as old.
+    """
+    cutoff = timezone.now() - upload_expiry()
+    count = 0
+    for upload in Upload.objects.filter(created_at__lt=cutoff).iterator():
+        try:
+            modified = os.path.getmtime(partial_path(upload))
+        except FileNotFoundError:
+            modified = 0
+        if upload.image_id is None and modified > cutoff.timestamp():
+            continue
+        abort_upload(upload)
+        count += 1
+    return count
@@ -0,0 +1,74 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .metrics import registry
+
+# Rendered list fragments (and whatever else a view wants to keep) are
+# cached under keys that embed the current version of every model they
+# were built from. Saving a model stores a new random version, so
+# invalidation is one cache write: entries built from the old version are
+# never read again and expire on their own. Writes that skip post_save
+# (bulk_update, queryset.update) call invalidate() themselves.
+VERSION_PREFIX = 'viewcache-version:'
+
+
+def view_cache():
+    return caches[getattr(settings, 'VIEW_CACHE', 'default')]
+
+
+def version_cache():
+    return caches[getattr(settings, 'VIEW_CACHE_VERSIONS', getattr(settings, 'VIEW_CACHE', 'default'))]
+
+
+def cache_timeout():
+    # Also bounds how long changes nobody saved show up late, e.g. an
+    # expired lease putting an image back in the queue.
+    return getattr(settings, 'VIEW_CACHE_TIMEOUT', 60)
+
+
+def _bump(names):
+    version_cache().set_many({VERSION_PREFIX + name: uuid.uuid4().hex for name in names}, None)
+
+
+def invalidate(*names):
+    """
+    Drop every cached entry that depends on the models `names` (model_name,
+    e.g. 'image'). Inside a transaction this happens again on commit, so a
+    page rendered from the old rows in the meantime is not kept.
+    """
+    _bump(names)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(names))
+
+
+def versions(names):
+    keys = [VERSION_PREFIX + name for name in names]
+    cache = version_cache()
+    found = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+    if missing:
+        # Lost or evicted versions start over, which can only invalidate.
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def cached(name, depends_on, parts, compute):
+    """
+    Return the cached value of `name` for `parts` (the request arguments it
+    varies by, e.g. the cursor), calling `compute()` on a miss. It is
+    rebuilt whenever one of the models in `depends_on` changes.
+    """
+    digest = hashlib.md5(repr(list(parts)).encode(), usedforsecurity=False).hexdigest()
+    key = f'viewcache:{name}:{".".join(versions(depends_on))}:{digest}'
+    cache = view_cache()
+    value = cache.get(key)
+    registry.count_cache(name, value is not None)
+    if value is None:
+        value = compute()
+        cache.set(key, value, cache_timeout())
+    return value
@@ -1,44 +1,121 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import logout
-from django.http import JsonResponse
-from .models import Image, KeypointAnnotation
+from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponseForbidden, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.views.decorators.http import require_http_methods, require_POST
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Func, OuterRef, Prefetch, Subquery
+from .models import AnnotationRevision, Comment, Dataset, Image, ImageAgreement, Job, KeypointAnnotation, Upload
 from .forms import ImageUploadForm, KeypointAnnotationForm, CommentForm
+from .pagination import decode_cursor, keyset_paginate
+from .db import retry_on_locked
+from .writequeue import write_queue
+from .metrics import registry
+from .roles import event_topics, get_role, home_url
+from .events import publish_on_commit, stream
+from .decorators import annotator_required, verifier_required
+from .counters import CountChanges, apply_changes, progress
+from .agreement import compute_agreement, invalidate_agreement
+from .revisions import build_revisions
+from .search import search_annotations
+from .export import FORMATS, export_filename, export_queryset, iter_export
+from .derivatives import RENDITIONS, generate_rendition, rendition_name
+from .imagemeta import similar_images, upload_fields
+from .jobs import enqueue
+from .uploads import (
+    CHUNK_SIZE, UploadConflict, append_chunk, assemble_upload, create_image, max_upload_size, remove_partial,
+    upload_offset,
+)
+from .overlays import get_overlay
+from .viewcache import cached, invalidate
+from . import media
+from .leases import QUEUE_STATUSES, active_claims, available_images, claim_image, claim_images
 
 import json
+import os
+
+VERIFICATION_STATUSES = ('pending', 'verified', 'rejected')
+MAX_BATCH_VERIFY = 1000
 
 @login_required
 def dashboard(request):
-    if request.user.is_superuser:
-        return redirect('admin:index')
-    elif hasattr(request.user, 'annotator'):
-        return redirect('annotator_dashboard')
-    elif hasattr(request.user, 'verifier'):
-        return redirect('verifier_dashboard')
-    else:
-        return redirect('view_annotations')
+    return redirect(home_url(request))
+
+def page_cursor(request):
+    """The ?cursor= of a keyset-paged list, or None. Raises ValueError for a cursor we did not issue."""
+    cursor = request.GET.get('cursor') or None
+    if cursor:
+        decode_cursor(cursor)
+    return cursor
 
 @login_required
+@annotator_required
 def annotator_dashboard(request):
-    pending_images = Image.objects.filter(status='unlabeled')
+    try:
+        cursor = page_cursor(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    def pending_images():
+        page = keyset_paginate(available_images(), cursor, 'uploaded_at')
+        html = render_to_string('core/_pending_images.html', {'pending_images': page.object_list})
+        return html, page.next_cursor
+
+    def claimed_images():
+        return render_to_string('core/_claimed_images.html', {'claimed_images': active_claims(request.user)})
+
+    pending, next_cursor = cached('pending_images', ['image'], [cursor], pending_images)
     return render(request, 'core/annotator_dashboard.html', {
-        'pending_images': pending_images
+        'progress': progress(),
+        'claimed_images': cached('claimed_images', ['image'], [request.user.id], claimed_images),
+        'pending_images': pending,
+        'next_cursor': next_cursor,
     })
 
 @login_required
+@require_POST
+@annotator_required
+def claim_next_images(request):
+    try:
+        count = int(request.POST.get('count', 10))
+    except ValueError:
+        count = 10
+    count = max(1, min(count, 100))
+    images = claim_images(request.user, count)
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'images': [
+                {'id': image.id, 'lease_expires_at': image.lease_expires_at.isoformat()}
+                for image in images
+            ]
+        })
+    return redirect('annotator_dashboard')
+
+@login_required
+@annotator_required
 def create_annotation(request, image_id):
     image = get_object_or_404(Image, id=image_id)
+
+    if image.status in QUEUE_STATUSES and not claim_image(request.user, image):
+        if request.method == 'POST':
+            return JsonResponse({'success': False, 'errors': {'image': ['This image is claimed by another annotator.']}}, status=409)
+        messages.error(request, 'This image is being annotated by someone else.')
+        return redirect('annotator_dashboard')
     
     if request.method == 'POST':
         form = KeypointAnnotationForm(request.POST)
         if form.is_valid():
-            annotation = form.save(commit=False)
-            annotation.image = image
-            annotation.annotator = request.user
-            annotation.save()
-            
-            image.status = 'annotated'
-            image.save()
+            if settings.SQLITE_WRITE_QUEUE:
+                write_queue.submit(save_annotation, image.id, request.user, form.cleaned_data).result(timeout=30)
+            else:
+                save_annotation(image.id, request.user, form.cleaned_data)
             
             return JsonResponse({'success': True})
         return JsonResponse({'success': False, 'errors': form.errors})
@@ -47,51 +124,447 @@ def create_annotation(request, image_id):
         'image': image
     })
 
+@retry_on_locked
+def save_annotation(image_id, annotator, data):
+    """
+    Store a submitted annotation and mark its image annotated, as one short
+    write transaction.
+    """
+    with transaction.atomic():
+        image = Image.objects.select_for_update().get(id=image_id)
+        annotation = KeypointAnnotation(image=image, annotator=annotator, **data)
+
+        changes = CountChanges()
+        changes.add(image.dataset_id, 'annotation', annotation.status)
+        changes.move(image.dataset_id, 'image', image.status, 'annotated')
+
+        revisions = build_revisions(annotation, None, annotator)
+        annotation.save()
+        AnnotationRevision.objects.bulk_create(revisions)
+        image.status = 'annotated'
+        image.claimed_by = None
+        image.lease_expires_at = None
+        image.save(update_fields=['status', 'claimed_by', 'lease_expires_at'])
+        apply_changes(changes)
+        enqueue('overlays.render', {'annotation_ids': [annotation.id]})
+        publish_on_commit(['annotator', 'verifier'], 'annotation.submitted', id=annotation.id, image_id=image.id)
+    return annotation
+
 @login_required
+@annotator_required
 def upload_image(request):
     if request.method == 'POST':
         form = ImageUploadForm(request.POST, request.FILES)
         if form.is_valid():
-            form.save()
+            upload = request.FILES['file']
+            form.instance.original_name = upload.name
+            for field, value in upload_fields(upload).items():
+                setattr(form.instance, field, value)
+            with transaction.atomic():
+                image = form.save()
+                changes = CountChanges()
+                changes.add(image.dataset_id, 'image', image.status)
+                apply_changes(changes)
+                enqueue('images.derivatives', {'image_id': image.id}, created_by=request.user)
+                publish_on_commit(['annotator'], 'image.added', id=image.id)
+            duplicates = similar_images(image)
+            if duplicates:
+                messages.warning(request, (
+                    f'Image #{image.id} looks like a duplicate of '
+                    + ', '.join(f'#{pk}' for pk, _ in duplicates[:5])
+                    + (' and others.' if len(duplicates) > 5 else '.')
+                ))
             return redirect('annotator_dashboard')
     else:
         form = ImageUploadForm()
-    return render(request, 'core/upload_image.html', {'form': form})
+    return render(request, 'core/upload_image.html', {'form': form, 'chunk_size': CHUNK_SIZE * 8})
+
+def upload_status(upload, offset):
+    return {
+        'id': str(upload.id),
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': offset,
+        'image': upload.image_id,
+        'url': reverse('upload_detail', args=[upload.id]),
+    }
+
+def _upload_response(data, status=200):
+    response = JsonResponse(data, status=status)
+    response['Upload-Offset'] = data['offset']
+    return response
+
+# The resumable upload views are async. Under ASGI, Django reads the body
+# before calling any view and runs each request's sync code in a thread of
+# its own. Here the blocking file work (appending, hashing, assembling) runs
+# with thread_sensitive=False in the default executor instead, and queries
+# go through sync_to_async as usual.
+
+@login_required
+@require_POST
+@annotator_required
+async def create_upload(request):
+    try:
+        payload = json.loads(request.body)
+        filename, size = os.path.basename(str(payload['filename'])), int(payload['size'])
+        dataset_id = int(payload['dataset']) if payload.get('dataset') else None
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Send JSON with filename and size.'}, status=400)
+    if not filename or not 0 < size <= max_upload_size():
+        return JsonResponse({'success': False, 'error': f'size must be between 1 and {max_upload_size()} bytes.'}, status=413)
+    if dataset_id and not await Dataset.objects.filter(id=dataset_id).aexists():
+        return JsonResponse({'success': False, 'error': 'Unknown dataset.'}, status=400)
+    upload = await Upload.objects.acreate(
+        user=await request.auser(), filename=filename[:500], size=size, dataset_id=dataset_id,
+    )
+    response = _upload_response(upload_status(upload, 0), status=201)
+    response['Location'] = reverse('upload_detail', args=[upload.id])
+    return response
+
+@login_required
+@require_http_methods(['GET', 'HEAD', 'PATCH', 'DELETE'])
+@annotator_required
+async def upload_detail(request, upload_id):
+    """
+    GET/HEAD: the current offset to resume from. PATCH: append the request
+    body at the Upload-Offset header. DELETE: abandon the upload.
+    """
+    upload = await aget_object_or_404(Upload, id=upload_id, user=await request.auser())
+    if request.method == 'DELETE':
+        await sync_to_async(remove_partial, thread_sensitive=False)(upload)
+        await upload.adelete()
+        return HttpResponse(status=204)
+    if request.method != 'PATCH' or upload.image_id:
+        offset = upload.size if upload.image_id else upload_offset(upload)
+        if request.method == 'PATCH':
+            return JsonResponse({'success': False, 'error': 'Upload is already complete.', 'offset': offset}, status=409)
+        return _upload_response(upload_status(upload, offset))
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return JsonResponse({'success': False, 'error': 'Upload-Offset header required.'}, status=400)
+    try:
+        # Reads the body in CHUNK_SIZE pieces; nothing is held in memory.
+        offset = await sync_to_async(append_chunk, thread_sensitive=False)(upload, offset, request)
+    except UploadConflict as e:
+        return JsonResponse({'success': False, 'error': str(e), 'offset': e.offset}, status=409)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=413)
+    return _upload_response(upload_status(upload, offset))
+
+@login_required
+@require_POST
+@annotator_required
+async def complete_chunked_upload(request, upload_id):
+    upload = await aget_object_or_404(Upload, id=upload_id, user=await request.auser())
+    if upload.image_id is None:
+        try:
+            assembled = await sync_to_async(assemble_upload, thread_sensitive=False)(upload, request.GET.get('sha256'))
+        except UploadConflict as e:
+            return JsonResponse({'success': False, 'error': str(e), 'offset': e.offset}, status=409)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        await sync_to_async(create_image)(upload, *assembled)
+    # Completing again (e.g. after a lost response) returns the same Image.
+    image = await Image.objects.aget(id=upload.image_id)
+    duplicates = await sync_to_async(similar_images)(image)
+    return JsonResponse({
+        'success': True,
+        'image': image.id,
+        'width': image.width,
+        'height': image.height,
+        'duplicates': [pk for pk, _ in duplicates[:20]],
+    })
+
+@login_required
+def serve_media(request, path):
+    return media.serve(request, path)
+
+@login_required
+def image_rendition(request, image_id, size):
+    if size not in RENDITIONS:
+        raise Http404
+    image = get_object_or_404(Image, id=image_id)
+    if image.processed:
+        return redirect(image.rendition_url(size))
+    # Background processing has not reached this image yet. Build just the
+    # requested rendition so the client still gets a downscaled copy; the
+    # rest are left to the derivatives job, which marks the image processed.
+    name = rendition_name(image.file.name, size)
+    if not image.file.storage.exists(name):
+        try:
+            generate_rendition(image.file.path, size)
+        except (OSError, ValueError):
+            return redirect(image.file.url)
+    return redirect(image.file.storage.url(name))
+
+@login_required
+def annotation_overlay(request, annotation_id, size):
+    if size not in RENDITIONS:
+        raise Http404
+    annotation = get_object_or_404(KeypointAnnotation.objects.select_related('image'), id=annotation_id)
+    try:
+        name = get_overlay(annotation, size)
+    except (OSError, ValueError):
+        # Unreadable image or keypoints: show the plain image instead.
+        return redirect(annotation.image.rendition_url(size))
+    return media.serve(request, name)
+
+def apply_verification(annotations, status, notes=None, author=None):
+    """
+    Set `status` (and `notes`, if given) on `annotations`, record a revision
+    for each and mark the images of verified ones as verified, in one
+    transaction of bulk writes. `annotations` must have their image selected.
+    """
+    images = {}
+    changes = CountChanges()
+    for annotation in annotations:
+        dataset_id = annotation.image.dataset_id
+        changes.move(dataset_id, 'annotation', annotation.status, status)
+        annotation.status = status
+        annotation.verified = status == 'verified'
+        if notes is not None:
+            annotation.annotation_notes = notes
+        if status == 'verified' and annotation.image_id not in images:
+            changes.move(dataset_id, 'image', annotation.image.status, 'verified')
+            annotation.image.status = 'verified'
+            images[annotation.image_id] = annotation.image
+
+    fields = ['status', 'verified', 'revision'] + (['annotation_notes'] if notes is not None else [])
+    _save_verification(annotations, list(images.values()), fields, changes, author)
+
+@retry_on_locked
+def _save_verification(annotations, images, fields, changes, author):
+    with transaction.atomic():
+        # Number revisions from the locked rows, not from when they were
+        # read: an edit may have been saved in between.
+        current = KeypointAnnotation.objects.select_for_update().filter(
+            id__in=[annotation.id for annotation in annotations],
+        ).only('revision', 'packed', 'points', 'confidence', 'bbox').in_bulk()
+        revisions = []
+        for annotation in annotations:
+            row = current[annotation.id]
+            annotation.revision, annotation.packed = row.revision, row.packed
+            annotation.points, annotation.confidence, annotation.bbox = row.points, row.confidence, row.bbox
+            revisions += build_revisions(annotation, annotation.packed, author)
+        KeypointAnnotation.objects.bulk_update(annotations, fields)
+        Image.objects.bulk_update(images, ['status'])
+        AnnotationRevision.objects.bulk_create(revisions)
+        invalidate('keypointannotation', 'image')
+        if annotations:
+            publish_on_commit(
+                ['verifier'], f'annotation.{annotations[0].status}', ids=[annotation.id for annotation in annotations],
+            )
+        # bulk_update skips post_save, so drop the cached agreement here and
+        # let a worker score the images again before the next dashboard load.
+        image_ids = sorted({annotation.image_id for annotation in annotations})
+        invalidate_agreement(image_ids)
+        if image_ids:
+            enqueue('agreement.refresh', {'image_ids': image_ids})
+            # Overlays are coloured by status, so the new revision needs its own.
+            enqueue('overlays.render', {'annotation_ids': [annotation.id for annotation in annotations]})
+        apply_changes(changes)
+
+def comment_count():
+    """
+    Correlated count of an annotation's comments. Unlike Count('comments')
+    it adds no GROUP BY, so a keyset page still reads only its own rows
+    instead of grouping every match before the LIMIT.
+    """
+    comments = Comment.objects.filter(annotation=OuterRef('pk')).order_by()
+    return Subquery(comments.annotate(n=Func(F('id'), function='COUNT')).values('n'))
 
 @login_required
+@verifier_required
 def verifier_dashboard(request):
-    pending_annotations = KeypointAnnotation.objects.filter(status='pending')
+    query = request.GET.get('q', '').strip()
+    try:
+        cursor = page_cursor(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    def pending_annotations():
+        annotations = KeypointAnnotation.objects.select_related('image__agreement', 'annotator').annotate(
+            comment_count=comment_count()
+        )
+        if query:
+            # Ranked search over comments and notes, any status, no paging.
+            hits = search_annotations(query)
+            found = annotations.in_bulk([hit.annotation_id for hit in hits])
+            page_annotations, next_cursor = [], None
+            for hit in hits:
+                if hit.annotation_id in found:
+                    found[hit.annotation_id].snippet = hit.snippet
+                    page_annotations.append(found[hit.annotation_id])
+        else:
+            page = keyset_paginate(annotations.filter(status='pending'), cursor, 'created_at')
+            page_annotations, next_cursor = page.object_list, page.next_cursor
+
+        # Score any images on this page that have no cached agreement yet, in
+        # one batch, and keep the result for later page loads.
+        missing = {a.image_id: a.image for a in page_annotations if not hasattr(a.image, 'agreement')}
+        if missing:
+            results = compute_agreement(list(missing))
+            ImageAgreement.objects.bulk_create(results, ignore_conflicts=True)
+            for result in results:
+                missing[result.image_id].agreement = result
+        html = render_to_string('core/_pending_annotations.html', {
+            'pending_annotations': page_annotations,
+            'query': query,
+        })
+        return html, next_cursor
+
+    pending, next_cursor = cached(
+        'pending_annotations', ['keypointannotation', 'comment', 'imageagreement'], [query, cursor],
+        pending_annotations,
+    )
     return render(request, 'core/verifier_dashboard.html', {
-        'pending_annotations': pending_annotations
+        'pending_annotations': pending,
+        'next_cursor': next_cursor,
+        'query': query,
     })
 
 @login_required
 def view_annotations(request):
-    verified_annotations = KeypointAnnotation.objects.filter(status='verified')
+    try:
+        cursor = page_cursor(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    def verified_annotations():
+        page = keyset_paginate(
+            KeypointAnnotation.objects.filter(status='verified')
+                .select_related('image', 'annotator')
+                .annotate(comment_count=comment_count()),
+            cursor,
+            'created_at',
+        )
+        html = render_to_string('core/_verified_annotations.html', {'annotations': page.object_list})
+        return html, page.next_cursor
+
+    annotations, next_cursor = cached(
+        'verified_annotations', ['keypointannotation', 'comment'], [cursor], verified_annotations,
+    )
     return render(request, 'core/view_annotations.html', {
-        'verified_annotations': verified_annotations
+        'progress': progress(),
+        'annotations': annotations,
+        'next_cursor': next_cursor,
     })
 
 @login_required
+@verifier_required
 def verify_annotation(request, annotation_id):
-    annotation = get_object_or_404(KeypointAnnotation, id=annotation_id)
+    annotation = get_object_or_404(
+        KeypointAnnotation.objects.select_related('image', 'annotator').prefetch_related(
+            Prefetch('comments', queryset=Comment.objects.select_related('author').order_by('created_at'))
+        ),
+        id=annotation_id,
+    )
     if request.method == 'POST':
         status = request.POST.get('status')
-        comments = request.POST.get('comments')
-        
-        annotation.status = status
-        annotation.comments = comments
-        annotation.save()
-        
-        if status == 'verified':
-            annotation.image.status = 'verified'
-            annotation.image.save()
-        
+        if status not in VERIFICATION_STATUSES:
+            messages.error(request, 'Invalid verification status.')
+            return redirect('verify_annotation', annotation_id=annotation.id)
+
+        apply_verification([annotation], status, request.POST.get('annotation_notes'), request.user)
         return redirect('verifier_dashboard')
     
     return render(request, 'core/verify_annotation.html', {'annotation': annotation})
 
 @login_required
+@require_POST
+@verifier_required
+def verify_annotations_batch(request):
+    if request.content_type == 'application/json':
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'Invalid JSON body.'}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({'success': False, 'error': 'Send a JSON object.'}, status=400)
+        ids, status, notes = payload.get('ids', []), payload.get('status'), payload.get('notes')
+    else:
+        ids, status, notes = request.POST.getlist('ids'), request.POST.get('status'), request.POST.get('notes')
+
+    if status not in VERIFICATION_STATUSES:
+        return JsonResponse({'success': False, 'error': f'status must be one of {", ".join(VERIFICATION_STATUSES)}'}, status=400)
+    try:
+        # A string would otherwise be read one digit at a time; bools are ints too.
+        if not isinstance(ids, list) or any(isinstance(pk, (bool, float)) for pk in ids):
+            raise TypeError
+        ids = list(dict.fromkeys(int(pk) for pk in ids))
+        if any(not 0 < pk < 2 ** 63 for pk in ids):
+            raise ValueError
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'ids must be a list of integers.'}, status=400)
+    if not ids or len(ids) > MAX_BATCH_VERIFY:
+        return JsonResponse({'success': False, 'error': f'Send between 1 and {MAX_BATCH_VERIFY} ids.'}, status=400)
+
+    annotations = list(KeypointAnnotation.objects.filter(id__in=ids).select_related('image'))
+    apply_verification(annotations, status, notes or None, request.user)
+
+    found = {annotation.id for annotation in annotations}
+    return JsonResponse({
+        'success': True,
+        'results': [
+            {'id': pk, 'success': True, 'status': status} if pk in found
+            else {'id': pk, 'success': False, 'error': 'Annotation not found.'}
+            for pk in ids
+        ],
+    })
+
+@login_required
+def export_annotations(request):
+    fmt = request.GET.get('format', 'jsonl')
+    if fmt not in FORMATS:
+        return HttpResponseBadRequest(f'format must be one of {", ".join(FORMATS)}')
+    try:
+        annotations = export_queryset(
+            status=request.GET.get('status', 'verified'),
+            since=request.GET.get('since'),
+            until=request.GET.get('until'),
+            dataset=request.GET.get('dataset'),
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    compress = request.GET.get('gzip') in ('1', 'true')
+    if request.GET.get('background') in ('1', 'true'):
+        job = enqueue('export.annotations', {
+            'fmt': fmt, 'compress': compress,
+            'status': request.GET.get('status', 'verified'), 'since': request.GET.get('since'),
+            'until': request.GET.get('until'), 'dataset': request.GET.get('dataset'),
+        }, created_by=request.user)
+        return JsonResponse(job_status_data(job), status=202)
+
+    filename = export_filename(fmt, compress)
+    content_type = 'application/json' if fmt == 'coco' else 'application/x-ndjson'
+    if compress:
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(iter_export(annotations, fmt, compress), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def job_status_data(job):
+    data = {
+        'id': job.id,
+        'task': job.task,
+        'status': job.status,
+        'attempts': job.attempts,
+        'result': job.result,
+        'status_url': reverse('job_status', args=[job.id]),
+    }
+    if job.status == 'succeeded' and job.task == 'export.annotations':
+        data['download_url'] = settings.MEDIA_URL + job.result['file']
+    return data
+
+@login_required
+def job_status(request, job_id):
+    jobs = Job.objects.all() if request.user.is_staff else Job.objects.filter(created_by=request.user)
+    return JsonResponse(job_status_data(get_object_or_404(jobs, id=job_id)))
+
+@login_required
+@verifier_required
 def add_comment(request, annotation_id):
     annotation = get_object_or_404(KeypointAnnotation, id=annotation_id)
     if request.method == 'POST':
@@ -108,6 +581,33 @@ def add_comment(request, annotation_id):
 
 
 
+async def event_stream(request):
+    """
+    Server-Sent Events feed of dashboard changes for the user's role. Needs
+    an ASGI server; each idle client is just a parked asyncio task.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the stream would hold a worker thread per client; 204
+        # tells EventSource not to reconnect.
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponseForbidden()
+    role = await sync_to_async(get_role)(request)
+    try:
+        last_event_id = int(request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        last_event_id = None
+    response = StreamingHttpResponse(stream(event_topics(role), last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@staff_member_required
+def metrics(request):
+    return HttpResponse(registry.render_prometheus(), content_type='text/plain; version=0.0.4')
+
 def logout_view(request):
     logout(request)
     return redirect('login')
@@ -0,0 +1,69 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.db import connection, transaction
+
+from .db import retry_on_locked
+
+
+class WriteQueue:
+    """
+    Single background writer that coalesces submitted write functions into
+    batched transactions. Each function runs in its own savepoint, so one
+    failure only fails its own Future.
+    """
+
+    def __init__(self, max_batch=100, linger=0.002):
+        self.max_batch = max_batch
+        self.linger = linger
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='write-queue', daemon=True)
+                self.thread.start()
+        self.queue.put((future, function, args, kwargs))
+        return future
+
+    def run(self):
+        try:
+            while True:
+                batch = [self.queue.get()]
+                try:
+                    while len(batch) < self.max_batch:
+                        batch.append(self.queue.get(timeout=self.linger))
+                except queue.Empty:
+                    pass
+                try:
+                    results = self.commit(batch)
+                except Exception as e:
+                    for future, *_ in batch:
+                        future.set_exception(e)
+                    continue
+                for future, ok, value in results:
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+        finally:
+            connection.close()
+
+    @retry_on_locked
+    def commit(self, batch):
+        results = []
+        with transaction.atomic():
+            for future, function, args, kwargs in batch:
+                try:
+                    with transaction.atomic():
+                        results.append((future, True, function(*args, **kwargs)))
+                except Exception as e:
+                    results.append((future, False, e))
+        return results
+
+
+write_queue = WriteQueue()